@@ -0,0 +1,135 @@
+"""
+Maintenance commands for the portal database.
+
+    python admin_cli.py backfill-completeness
+    python admin_cli.py snapshot [--dest app.snapshot.db] [--every 600]
+    python admin_cli.py adopt-blobs
+    python admin_cli.py jobs [--retry-failed] [--run] [--processes 2]
+    python admin_cli.py reconcile [--root uploads] [--minutes 10] [--restart] [--quarantine | --delete]
+"""
+import time
+import argparse
+
+import models_db
+
+
+def cmd_backfill_completeness(args):
+    models_db.init_db_all()
+    t0 = time.perf_counter()
+    changed = models_db.sync_required_doc_types()
+    n = models_db.backfill_completeness()
+    c = models_db.con()
+    try:
+        complete, total = c.execute(
+            "SELECT SUM(required_total > 0 AND required_uploaded_count >= required_total), COUNT(*) "
+            "FROM applications"
+        ).fetchone()
+    finally:
+        c.close()
+    print(f"Recounted {n} application(s) in {time.perf_counter() - t0:.2f}s"
+          f"{' (required document list changed)' if changed else ''}.")
+    print(f"{complete or 0}/{total} have every required document.")
+
+
+def cmd_snapshot(args):
+    while True:
+        info = models_db.backup_snapshot(args.dest)
+        how = f"single step after {info['restarts']} restart(s)" if info["single_step"] else "stepwise"
+        print(f"{info['path']}: {info['bytes'] / 1e6:.1f} MB in {info['seconds']:.2f}s ({how})")
+        if not args.every:
+            return
+        time.sleep(args.every)
+
+
+def cmd_adopt_blobs(args):
+    import blobstore
+
+    models_db.init_db_all()
+    t0 = time.perf_counter()
+    stats = blobstore.adopt_legacy_documents()
+    print(f"Moved {stats['files']} file(s) ({stats['rows']} document row(s)) into {blobstore.BLOB_ROOT} "
+          f"in {time.perf_counter() - t0:.2f}s; {stats['bytes_saved'] / 1e6:.1f} MB were duplicates.")
+    if stats["missing"]:
+        print(f"{stats['missing']} path(s) no longer exist on disk and were left as they are.")
+
+
+def cmd_jobs(args):
+    import jobs
+
+    models_db.init_db_all()
+    if args.retry_failed:
+        print(f"Requeued {jobs.retry_failed()} failed job(s).")
+    if args.run:
+        print(f"Requeued {jobs.recover()} job(s) left running by a stopped worker.")
+        t0 = time.perf_counter()
+        counts = jobs.run_until_idle(args.processes)
+        print(f"Checked {counts['done'] + counts['invalid']} document(s) in {time.perf_counter() - t0:.2f}s: "
+              f"{counts['invalid']} invalid, {counts['reused']} reused earlier results, {counts['errors']} error(s).")
+    stats = jobs.queue_stats()
+    print(", ".join(f"{n} {state}" for state, n in stats.items()))
+
+
+def cmd_reconcile(args):
+    import reconcile
+
+    models_db.init_db_all()
+    grace_s = args.grace_hours * 3600
+    stats = reconcile.run(args.root, batch=args.batch, resume=not args.restart,
+                          time_budget_s=args.minutes * 60 if args.minutes else None, grace_s=grace_s)
+    rate = stats["files"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"Run #{stats['run_id']}: {stats['files']} file(s) scanned ({rate:.0f}/s), "
+          f"{stats['orphans']} orphan(s) ({stats['orphan_bytes'] / 1e6:.1f} MB), "
+          f"{stats['recent']} newer than the grace period left alone; "
+          f"{stats['rows']} document row(s) checked, {stats['dangling']} dangling.")
+    if stats["phase"] != "done":
+        print(f"Stopped in the {stats['phase']} phase; run the command again to continue from the checkpoint.")
+        return
+    for kind in ("orphan", "dangling"):
+        rows = reconcile.findings(stats["run_id"], kind, args.show)
+        if rows:
+            print(f"\n{kind.capitalize()} (largest first, up to {args.show}):")
+        for path, size, doc_id, _action in rows:
+            print(f"  {path}  {size / 1e6:.2f} MB" if kind == "orphan" else f"  document #{doc_id}: {path or '(no path)'}")
+    if args.quarantine or args.delete:
+        counts = reconcile.act(stats["run_id"], "quarantine" if args.quarantine else "delete",
+                               batch=args.batch, grace_s=grace_s)
+        print("\n" + ", ".join(f"{k}: {v}" for k, v in counts.items()))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--db", help="database file (default: app.db)")
+    sub = p.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill-completeness", help="recompute required_uploaded_count / required_total")
+    snap = sub.add_parser("snapshot", help="copy the live database with the online backup API")
+    snap.add_argument("--dest", help="snapshot file (default: DB_SNAPSHOT_PATH or app.snapshot.db)")
+    snap.add_argument("--every", type=float, default=0, help="repeat every N seconds")
+    sub.add_parser("adopt-blobs", help="move pre-blob-store uploads into the content-addressed store")
+    jb = sub.add_parser("jobs", help="show the document processing queue, optionally work through it")
+    jb.add_argument("--run", action="store_true", help="process due jobs in the foreground until none are left")
+    jb.add_argument("--retry-failed", action="store_true", help="queue failed jobs again")
+    jb.add_argument("--processes", type=int, default=2, help="worker processes for --run (0: in-process)")
+    rc = sub.add_parser("reconcile", help="find orphan upload files and documents rows whose file is gone")
+    rc.add_argument("--root", help="tree to walk (default: UPLOAD_ROOT)")
+    rc.add_argument("--batch", type=int, default=1000, help="files per lookup and checkpoint")
+    rc.add_argument("--minutes", type=float, default=0, help="stop after this long; the next run resumes")
+    rc.add_argument("--restart", action="store_true", help="abandon an unfinished run and start over")
+    rc.add_argument("--grace-hours", type=float, default=1.0, help="never touch files younger than this")
+    rc.add_argument("--show", type=int, default=20, help="findings to list")
+    act = rc.add_mutually_exclusive_group()
+    act.add_argument("--quarantine", action="store_true", help="move orphans to <root>/quarantine/<run>/")
+    act.add_argument("--delete", action="store_true", help="delete orphans")
+    args = p.parse_args()
+    if args.db:
+        models_db.DB_PATH = args.db
+    {
+        "backfill-completeness": cmd_backfill_completeness,
+        "snapshot": cmd_snapshot,
+        "adopt-blobs": cmd_adopt_blobs,
+        "jobs": cmd_jobs,
+        "reconcile": cmd_reconcile,
+    }[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,625 @@
+import os
+import json
+import time
+import asyncio
+import queue
+import codecs
+import logging
+import threading
 import subprocess
+import http.client
+from typing import AsyncIterator, Iterator
+
+from llm_queue import PRIORITY, LLMBusy, Scheduler
+from llm_metrics import llm_metrics
+
+log = logging.getLogger(__name__)
 
 SYSTEM_PROMPT = (
     "You are a helpful university admissions assistant. "
     "Be clear, structured, and practical."
 )
 MODEL_NAME = "llama3"
+# Bump when SYSTEM_PROMPT or a handler's prompt template changes; cached answers key on it.
+PROMPT_VERSION = 1
+
+# "http" talks to a long-lived `ollama serve`; "subprocess" shells out to `ollama run`.
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "http")
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "127.0.0.1:11434")
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_CMD = os.environ.get("OLLAMA_CMD", "ollama").split()
+HTTP_POOL_SIZE = int(os.environ.get("LLM_HTTP_POOL_SIZE", "4"))
+# Concurrent generations, and how many more may wait before callers get "busy".
+LLM_WORKERS = int(os.environ.get("LLM_WORKERS", "2"))
+LLM_QUEUE_MAX = int(os.environ.get("LLM_QUEUE_MAX", "32"))
+# Hard per-call deadline, covering queue wait for callers and generation for workers.
+LLM_TIMEOUT_S = float(os.environ.get("LLM_TIMEOUT_S", "120"))
+# Open the breaker after this many consecutive failures, for this long.
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN_S = float(os.environ.get("LLM_BREAKER_COOLDOWN_S", "30"))
+# If no token arrives within this many seconds, race a second request (0 = off).
+LLM_HEDGE_AFTER_S = float(os.environ.get("LLM_HEDGE_AFTER_S", "0"))
+# Optional model routing config, re-read whenever the file changes.
+LLM_ROUTES_FILE = os.environ.get(
+    "LLM_ROUTES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_routes.json")
+)
+
+
+class LLMUnavailable(RuntimeError):
+    """The model backend failed, timed out, or the circuit breaker is open."""
+
+
+class LLMTimeout(LLMUnavailable):
+    pass
+
+
+def build_prompt(user_text: str) -> str:
+    return f"{SYSTEM_PROMPT}\n\n{user_text}\n"
+
+
+# Backends
+class SubprocessBackend:
+    """One `ollama run` process per call. Slow, but needs no server."""
+
+    name = "subprocess"
+
+    def __init__(self, cmd=None):
+        self.cmd = list(cmd or OLLAMA_CMD)
+
+    def stream(self, prompt: str, model: str, deadline: float = None) -> Iterator[str]:
+        proc = subprocess.Popen(
+            self.cmd + ["run", model],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # Drain stderr on the side so a chatty CLI cannot block on a full pipe.
+        err_chunks = []
+        err_reader = threading.Thread(target=lambda: err_chunks.append(proc.stderr.read()), daemon=True)
+        err_reader.start()
+        killer = None
+        if deadline is not None:
+            killer = threading.Timer(max(0.0, deadline - time.perf_counter()), proc.kill)
+            killer.daemon = True
+            killer.start()
+        try:
+            try:
+                proc.stdin.write(prompt.encode("utf-8"))
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass  # exited early; the exit code below says why
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            while True:
+                data = os.read(proc.stdout.fileno(), 4096)
+                if not data:
+                    break
+                text = decoder.decode(data)
+                if text:
+                    yield text
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            err_reader.join()
+            err = b"".join(err_chunks).decode("utf-8", "replace")
+            if proc.wait() != 0:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    raise LLMTimeout("ollama run exceeded its deadline")
+                raise RuntimeError(err.strip() or "Ollama failed")
+        finally:
+            if killer is not None:
+                killer.cancel()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            err_reader.join()
+            proc.stdout.close()
+            proc.stderr.close()
+
+
+class HttpBackend:
+    """
+    Talks to the Ollama HTTP API over a small pool of keep-alive connections.
+    `keep_alive` asks the server to keep the model loaded between calls.
+    """
+
+    name = "http"
+
+    def __init__(self, host: str = None, pool_size: int = None, keep_alive: str = None):
+        self.host = host or OLLAMA_HOST
+        self.keep_alive = keep_alive or OLLAMA_KEEP_ALIVE
+        self._pool = queue.LifoQueue(maxsize=pool_size or HTTP_POOL_SIZE)
+
+    def _acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host)
+
+    def _release(self, conn: http.client.HTTPConnection):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _post(self, path: str, payload: dict, deadline: float = None):
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        # A pooled connection may have been closed by the server while idle;
+        # retry once on a fresh one before giving up.
+        for attempt in range(2):
+            conn = self._acquire()
+            timeout = LLM_TIMEOUT_S if deadline is None else max(0.001, deadline - time.perf_counter())
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except TimeoutError:
+                conn.close()
+                raise LLMTimeout(f"Ollama server at {self.host} did not answer in time")
+            except (http.client.HTTPException, ConnectionError) as e:
+                conn.close()
+                if attempt == 1:
+                    raise ConnectionError(f"Ollama server unreachable at {self.host}: {e}")
+            except OSError as e:
+                conn.close()
+                raise ConnectionError(f"Ollama server unreachable at {self.host}: {e}")
+
+    def stream(self, prompt: str, model: str, deadline: float = None) -> Iterator[str]:
+        conn, resp = self._post(
+            "/api/generate",
+            {"model": model, "prompt": prompt, "stream": True, "keep_alive": self.keep_alive},
+            deadline,
+        )
+        if resp.status != 200:
+            data = resp.read()
+            conn.close()
+            raise RuntimeError(data.decode("utf-8", "replace").strip() or f"Ollama HTTP {resp.status}")
+        done = False
+        try:
+            # Newline-delimited JSON, one object per token batch.
+            while True:
+                if deadline is not None:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise LLMTimeout("Ollama response exceeded its deadline")
+                    conn.sock.settimeout(remaining)
+                try:
+                    line = resp.readline()
+                except TimeoutError:
+                    raise LLMTimeout("Ollama response exceeded its deadline")
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                obj = json.loads(line)
+                if obj.get("error"):
+                    raise RuntimeError(obj["error"])
+                if obj.get("response"):
+                    yield obj["response"]
+                if obj.get("done"):
+                    done = True
+                    break
+        finally:
+            # Only a fully drained response leaves the connection reusable.
+            if done and not resp.read():
+                self._release(conn)
+            else:
+                conn.close()
+
+
+_subprocess_backend = SubprocessBackend()
+_http_backend = HttpBackend()
+
+
+def get_backend():
+    return _http_backend if LLM_BACKEND == "http" else _subprocess_backend
+
+
+def _backend_stream(prompt: str, model: str, deadline: float = None) -> Iterator[str]:
+    backend = get_backend()
+    try:
+        chunks = backend.stream(prompt, model, deadline)
+        first = next(chunks, None)
+    except ConnectionError:
+        if backend is _subprocess_backend:
+            raise
+        # Server not running: fall back to the one-shot CLI.
+        chunks = _subprocess_backend.stream(prompt, model, deadline)
+        first = next(chunks, None)
+    if first is None:
+        return
+    yield first
+    yield from chunks
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. After `failures` consecutive errors it opens and
+    rejects calls for `cooldown_s`, then lets one probe through (half-open).
+    """
+
+    def __init__(self, failures: int, cooldown_s: float):
+        self.failures = failures
+        self.cooldown_s = cooldown_s
+        self.consecutive = 0
+        self.opened_at = None
+        self.probing = False
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown_s:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def cancel_probe(self):
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive = 0
+            self.opened_at = None
+            self.probing = False
 
-def ask_llm(user_text: str) -> str:
-    prompt = f"{SYSTEM_PROMPT}\n\n{user_text}\n"
-    result = subprocess.run(
-        ["ollama", "run", MODEL_NAME],
-        input=prompt,
-        capture_output=True,
-        text=True,
-        encoding="utf-8",
-        errors="replace",
+    def record_failure(self):
+        with self._lock:
+            self.consecutive += 1
+            self.probing = False
+            if self.opened_at is not None or self.consecutive >= self.failures:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN_S)
+
+
+def _hedged_stream(prompt: str, model: str, deadline: float) -> Iterator[str]:
+    """
+    Start one request; if it has produced nothing after LLM_HEDGE_AFTER_S,
+    start a second and keep whichever yields first. The loser is abandoned.
+    """
+    events = queue.Queue()
+    cancelled = [threading.Event(), threading.Event()]
+
+    def pump(i: int):
+        chunks = _backend_stream(prompt, model, deadline)
+        try:
+            for chunk in chunks:
+                if cancelled[i].is_set():
+                    return
+                events.put((i, "chunk", chunk))
+            events.put((i, "done", None))
+        except Exception as e:
+            events.put((i, "error", e))
+        finally:
+            chunks.close()
+
+    threading.Thread(target=pump, args=(0,), daemon=True).start()
+    running, failed, winner = 1, 0, None
+    try:
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise LLMTimeout("LLM call exceeded its deadline")
+            wait = remaining
+            if winner is None and running == 1:
+                wait = min(wait, LLM_HEDGE_AFTER_S)
+            try:
+                i, kind, value = events.get(timeout=wait)
+            except queue.Empty:
+                if winner is None and running == 1:
+                    log.info("llm hedging after %.1fs without a token", LLM_HEDGE_AFTER_S)
+                    threading.Thread(target=pump, args=(1,), daemon=True).start()
+                    running = 2
+                continue
+            if winner is None:
+                if kind == "error":
+                    failed += 1
+                    if failed == running:
+                        raise value
+                    continue
+                winner = i
+                cancelled[1 - i].set()
+            if i != winner:
+                continue
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        cancelled[0].set()
+        cancelled[1].set()
+
+
+def _guarded_stream(prompt: str, model: str) -> Iterator[str]:
+    """What scheduler workers run: deadline, optional hedging, breaker accounting."""
+    deadline = time.perf_counter() + LLM_TIMEOUT_S
+    try:
+        if LLM_HEDGE_AFTER_S > 0:
+            yield from _hedged_stream(prompt, model, deadline)
+        else:
+            yield from _backend_stream(prompt, model, deadline)
+    except LLMTimeout:
+        breaker.record_failure()
+        raise
+    except Exception as e:
+        breaker.record_failure()
+        raise LLMUnavailable(str(e) or type(e).__name__) from e
+    breaker.record_success()
+
+
+# Model routing
+#
+# Config format (JSON), first matching rule wins, otherwise "default":
+#   {
+#     "default": "full",
+#     "routes": {"full": {"model": "llama3", "max_concurrency": 2},
+#                "fast": {"model": "llama3.2:1b", "max_concurrency": 4}},
+#     "rules": [{"route": "fast", "surfaces": ["public"], "intents": ["GENERAL"],
+#                "max_prompt_chars": 600}]
+#   }
+# Each route gets its own scheduler, so max_concurrency caps that model alone.
+DEFAULT_ROUTES = {
+    "default": "full",
+    "routes": {"full": {"model": MODEL_NAME, "max_concurrency": LLM_WORKERS}},
+    "rules": [],
+}
+
+
+class ModelRouter:
+    def __init__(self, path: str = None, config: dict = None):
+        self.path = path
+        self.config = config or DEFAULT_ROUTES
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def validate(config: dict) -> dict:
+        routes = config.get("routes") or {}
+        if not routes or config.get("default") not in routes:
+            raise ValueError("routes config needs 'routes' and a 'default' that names one of them")
+        for name, r in routes.items():
+            if not r.get("model"):
+                raise ValueError(f"route {name!r} has no model")
+        for rule in config.get("rules") or []:
+            if rule.get("route") not in routes:
+                raise ValueError(f"rule points at unknown route {rule.get('route')!r}")
+        return config
+
+    def load(self, config: dict):
+        with self._lock:
+            self.config = self.validate(config)
+
+    def _maybe_reload(self):
+        # stat() at most once a second; a broken file keeps the last good config.
+        now = time.monotonic()
+        if not self.path or now - self._checked_at < 1.0:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.load(json.load(f))
+            log.info("llm routes reloaded from %s", self.path)
+        except (OSError, ValueError) as e:
+            log.error("ignoring invalid llm routes file %s: %s", self.path, e)
+
+    def choose(self, surface: str, intent: str, prompt: str):
+        """Returns (route_name, route_config)."""
+        self._maybe_reload()
+        with self._lock:
+            config = self.config
+        for rule in config.get("rules") or []:
+            if "surfaces" in rule and surface not in rule["surfaces"]:
+                continue
+            if "intents" in rule and intent not in rule["intents"]:
+                continue
+            if "max_prompt_chars" in rule and len(prompt) > rule["max_prompt_chars"]:
+                continue
+            if "min_prompt_chars" in rule and len(prompt) < rule["min_prompt_chars"]:
+                continue
+            return rule["route"], config["routes"][rule["route"]]
+        return config["default"], config["routes"][config["default"]]
+
+
+router = ModelRouter(LLM_ROUTES_FILE)
+_schedulers = {}  # route name -> (workers, max_queue, Scheduler)
+_schedulers_lock = threading.Lock()
+
+
+def choose_model(surface: str, intent: str, user_text: str) -> str:
+    return router.choose(surface, intent, build_prompt(user_text))[1]["model"]
+
+
+def scheduler_for(route: str, cfg: dict) -> Scheduler:
+    workers = int(cfg.get("max_concurrency") or LLM_WORKERS)
+    max_queue = int(cfg.get("max_queue") or LLM_QUEUE_MAX)
+    with _schedulers_lock:
+        current = _schedulers.get(route)
+        if current and current[:2] == (workers, max_queue):
+            return current[2]
+        if current:
+            current[2].retire()
+        sched = Scheduler(_guarded_stream, workers=workers, max_queue=max_queue)
+        _schedulers[route] = (workers, max_queue, sched)
+        return sched
+
+
+def scheduler_stats() -> dict:
+    """Scheduler.stats() summed over routes; ratios and averages recomputed."""
+    with _schedulers_lock:
+        scheds = [s for _w, _q, s in _schedulers.values()]
+    total = {"queue_depth": 0, "in_flight": 0, "submitted": 0, "coalesced": 0, "rejected": 0, "completed": 0}
+    started, wait_total, wait_max = 0, 0.0, 0.0
+    for sched in scheds:
+        st = sched.stats()
+        for k in total:
+            total[k] += st[k]
+        started += sched.started
+        wait_total += sched.wait_total_s
+        wait_max = max(wait_max, sched.wait_max_s)
+    asked = total["submitted"] + total["coalesced"]
+    total["coalesce_ratio"] = (total["coalesced"] / asked) if asked else 0.0
+    total["wait_avg_ms"] = (wait_total / started * 1000) if started else 0.0
+    total["wait_max_ms"] = wait_max * 1000
+    return total
+
+
+def _submit(prompt: str, surface: str, intent: str, route_surface: str = None):
+    """Returns (flight, model)."""
+    if not breaker.allow():
+        raise LLMUnavailable("The AI assistant is temporarily unavailable.")
+    route, cfg = router.choose(route_surface or surface, intent, prompt)
+    try:
+        return scheduler_for(route, cfg).submit(prompt, cfg["model"], PRIORITY.get(surface, 1)), cfg["model"]
+    except LLMBusy:
+        breaker.cancel_probe()
+        raise
+
+
+def _log_call(surface: str, model: str, status: str, t0: float, ttft, prompt: str, response_bytes: int, flight):
+    total = time.perf_counter() - t0
+    log.info(
+        "llm surface=%s model=%s status=%s ttft_ms=%s total_ms=%.0f",
+        surface, model, status,
+        f"{ttft * 1000:.0f}" if ttft is not None else "-",
+        total * 1000,
     )
-    if result.returncode != 0:
-        raise RuntimeError((result.stderr or "").strip() or "Ollama failed")
-    return (result.stdout or "").strip()
+    llm_metrics.record(
+        surface=surface,
+        model=model,
+        status=status,
+        prompt_bytes=len(prompt.encode("utf-8")),
+        response_bytes=response_bytes,
+        queue_wait_s=flight.queue_wait() if flight is not None else None,
+        ttft_s=ttft,
+        total_s=total,
+    )
+
+
+def ask_llm_stream(user_text: str, surface: str = "cli", intent: str = "GENERAL",
+                   route_surface: str = None) -> Iterator[str]:
+    """
+    Yields the answer in pieces as the model produces them. `surface` names
+    the caller ("portal", "public", "cli", "batch") and sets queue priority;
+    together with `intent` and the prompt length it picks the model.
+    `route_surface` routes as another surface would (e.g. batch jobs
+    answering for the public tab).
+    Raises LLMBusy when the queue is full, LLMUnavailable (or LLMTimeout)
+    when the backend fails, times out or the breaker is open.
+    """
+    prompt = build_prompt(user_text)
+    t0 = time.perf_counter()
+    ttft = None
+    status = "error"
+    flight = None
+    model = MODEL_NAME
+    response_bytes = 0
+    try:
+        flight, model = _submit(prompt, surface, intent, route_surface)
+        for chunk in flight.iter(deadline=t0 + LLM_TIMEOUT_S):
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            response_bytes += len(chunk.encode("utf-8"))
+            yield chunk
+        status = "ok"
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    except LLMBusy:
+        status = "busy"
+        raise
+    except LLMTimeout:
+        status = "timeout"
+        raise
+    except TimeoutError:
+        status = "timeout"
+        raise LLMTimeout("LLM call exceeded its deadline")
+    except LLMUnavailable:
+        status = "unavailable"
+        raise
+    finally:
+        _log_call(surface, model, status, t0, ttft, prompt, response_bytes, flight)
+
+
+def ask_llm(user_text: str, surface: str = "cli", intent: str = "GENERAL", route_surface: str = None) -> str:
+    return "".join(ask_llm_stream(user_text, surface, intent, route_surface)).strip()
+
+
+async def ask_llm_stream_async(user_text: str, surface: str = "cli", intent: str = "GENERAL",
+                               route_surface: str = None) -> AsyncIterator[str]:
+    """
+    Async twin of ask_llm_stream, same arguments. The generation still runs
+    on the scheduler's worker threads; the caller awaits chunks without
+    holding a thread.
+    """
+    prompt = build_prompt(user_text)
+    t0 = time.perf_counter()
+    ttft = None
+    status = "error"
+    flight = None
+    model = MODEL_NAME
+    response_bytes = 0
+    try:
+        flight, model = _submit(prompt, surface, intent, route_surface)
+        async for chunk in flight.aiter(deadline=t0 + LLM_TIMEOUT_S):
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            response_bytes += len(chunk.encode("utf-8"))
+            yield chunk
+        status = "ok"
+    except (GeneratorExit, asyncio.CancelledError):
+        status = "cancelled"
+        raise
+    except LLMBusy:
+        status = "busy"
+        raise
+    except LLMTimeout:
+        status = "timeout"
+        raise
+    except TimeoutError:
+        status = "timeout"
+        raise LLMTimeout("LLM call exceeded its deadline")
+    except LLMUnavailable:
+        status = "unavailable"
+        raise
+    finally:
+        _log_call(surface, model, status, t0, ttft, prompt, response_bytes, flight)
+
+
+async def ask_llm_async(user_text: str, surface: str = "cli", intent: str = "GENERAL",
+                        route_surface: str = None) -> str:
+    parts = [chunk async for chunk in ask_llm_stream_async(user_text, surface, intent, route_surface)]
+    return "".join(parts).strip()
@@ -1,35 +1,44 @@
 import os
-import shutil
 import re
+import time
+import asyncio
+import secrets
+import threading
+from datetime import date
 import gradio as gr
 
-from models_db import init_db_all
+from models_db import con_ro, init_db_all, start_snapshot_thread
+from db import chat_log, log_chat
 import auth
 import applications
-
-from ai import ask_llm
+import blobstore
+import export
+import jobs
+import search
+
+import ai
+from ai import ask_llm_stream_async, LLMBusy, LLMUnavailable
+from llm_cache import answer_cache, make_key
+from llm_metrics import render_prometheus
 from intents import detect_intent
-from programmes import (
-    BACHELOR_PROGRAMMES,
-    MASTER_PROGRAMMES,
-    REQUIRED_DOCS_BACHELOR,
-    REQUIRED_DOCS_MASTER,
-)
+from programmes import BACHELOR_PROGRAMMES, MASTER_PROGRAMMES
 from portal_tools import (
     list_my_applications,
     application_summary,
     delete_all_docs_for_application,
     delete_doc_by_id,
+    requirements_reply,
+    requirements_reply_all_apps,
+    public_prompt,
+    public_cache_key,
+    required_docs_for,
 )
 
 
 init_db_all()
-UPLOAD_ROOT = os.environ.get("UPLOAD_ROOT", "uploads")
-
-
+jobs.start_workers()  # checks uploads in background worker processes
+start_snapshot_thread()  # no-op unless DB_SNAPSHOT_INTERVAL_S > 0
 
-def required_docs_for(level: str):
-    return REQUIRED_DOCS_BACHELOR if level == "Bachelor" else REQUIRED_DOCS_MASTER
 
 
 def degrees_markdown():
@@ -53,47 +62,90 @@ def requirements_md(level: str, programme: str):
     return f"### Typical required documents for **{programme}** ({level})\n{bullets}"
 
 
-def _ensure_dir(path: str):
-    os.makedirs(path, exist_ok=True)
-
-
 def get_uploaded_doc_types(app_id: int):
     docs = applications.list_documents(int(app_id))
     return {d[1] for d in docs}  # doc_type
 
 
-def compute_progress_and_status(app_id: int, level: str):
-    req = required_docs_for(level)
-    uploaded = get_uploaded_doc_types(int(app_id))
-    missing = [x for x in req if x not in uploaded]
-    progress_text = f"{len(uploaded)}/{len(req)} documents uploaded"
-    computed_status = "Complete" if len(missing) == 0 else "In Progress"
-    return progress_text, computed_status, missing
+def compute_progress_and_status(app_id: int, counts=None):
+    """
+    From the completeness counters on the application (required doc types
+    uploaded / required in total). `counts` is that pair when the caller
+    already has it, e.g. from read_application_aggregate.
+    """
+    if counts is None:
+        counts = applications.read_required_counts(int(app_id)) or (0, 0)
+    uploaded, total = counts
+    if total:
+        progress_text = f"{uploaded}/{total} required documents uploaded"
+    else:
+        progress_text = "No required documents are configured for this level yet"
+    computed_status = "Complete" if applications.is_complete(uploaded, total) else "In Progress"
+    return progress_text, computed_status
 
 
 # =========================
 # PUBLIC AI
 # =========================
-def ai_public_answer(question: str, level: str, programme: str):
-    question = (question or "").strip()
-    if not question:
-        return "Please type a question."
+UNAVAILABLE_MSG = "⚠️ The AI assistant is temporarily unavailable. Please try again in a few minutes."
 
-    injected = ""
+
+def public_fallback_answer(level: str, programme: str) -> str:
     if level in {"Bachelor", "Master"} and programme:
-        injected = (
-            f"\nProgramme:\n"
-            f"- Level: {level}\n"
-            f"- Name: {programme}\n"
-            f"- Typical required documents: {', '.join(required_docs_for(level))}\n"
-        )
+        bullets = "\n".join(f"- {x}" for x in required_docs_for(level))
+        return f"{UNAVAILABLE_MSG}\n\nTypical required documents for {programme} ({level}):\n{bullets}"
+    return UNAVAILABLE_MSG
 
-    prompt = (
-        "You are an admissions assistant. Answer clearly and practically.\n"
-        "If asked about document requirements, use the typical checklist provided.\n"
-        f"{injected}\nUser question: {question}\nAssistant:"
-    )
-    return ask_llm(prompt)
+
+PORTAL_FALLBACK = (
+    f"{UNAVAILABLE_MSG}\n\n"
+    "I can still help with: listing your applications, what you are missing, "
+    "document requirements, and deleting documents."
+)
+
+
+async def _stream_answer(prompt: str, surface: str, intent: str, cache_key: str = None,
+                         fallback: str = UNAVAILABLE_MSG):
+    # Gradio re-renders the whole value on each yield, so yield the running text.
+    if cache_key:
+        cached = await asyncio.to_thread(answer_cache.get, cache_key)
+        if cached is not None:
+            yield cached
+            return
+    answer = ""
+    try:
+        async for chunk in ask_llm_stream_async(prompt, surface, intent):
+            answer += chunk
+            yield answer.strip()
+    except LLMBusy as e:
+        yield f"⏳ {e}"
+        return
+    except LLMUnavailable:
+        # Timeout, backend error or open breaker: answer fast with what we have.
+        yield fallback
+        return
+    # Only reached when the stream finished; aborted answers are not cached.
+    if cache_key and answer.strip():
+        await asyncio.to_thread(answer_cache.put, cache_key, answer.strip())
+
+
+async def ai_public_answer(question: str, level: str, programme: str):
+    question = (question or "").strip()
+    if not question:
+        yield "Please type a question."
+        return
+
+    answer = ""
+    async for partial in _stream_answer(
+        public_prompt(question, level, programme),
+        "public",
+        detect_intent(question),
+        public_cache_key(question, level, programme),
+        fallback=public_fallback_answer(level, programme),
+    ):
+        answer = partial
+        yield partial
+    await asyncio.to_thread(log_chat, question, answer, "public")
 
 
 def do_register(full_name: str, email: str, password: str):
@@ -143,18 +195,19 @@ def apply_create(user_id, level, programme):
 
 
 # Application page (student)
-def docs_text_and_delete_choices(user_id, app_id):
+def docs_text_and_delete_choices(user_id, app_id, docs=None):
     if not user_id or not app_id:
         return "No documents loaded.", gr.update(choices=[], value=None)
 
-    docs = applications.list_documents(int(app_id))
+    if docs is None:
+        docs = applications.list_documents(int(app_id))
     if not docs:
         return "No documents uploaded yet.", gr.update(choices=[], value=None)
 
     lines = []
     choices = []
-    for doc_id, doc_type, fname, saved_path, ts in docs:
-        lines.append(f"- [{doc_id}] {doc_type} | {fname} | {ts}")
+    for doc_id, doc_type, fname, saved_path, ts, state, info in docs:
+        lines.append(f"- [{doc_id}] {doc_type} | {fname} | {ts} | {jobs.processing_label(state, info)}")
         choices.append((f"{doc_type} — {fname}", doc_id))
 
     return "\n".join(lines), gr.update(choices=choices, value=(choices[0][1] if choices else None))
@@ -179,8 +232,8 @@ def load_application(user_id, app_id):
             gr.update(interactive=True),
         )
 
-    row = applications.read_application(int(app_id))
-    if not row:
+    agg = applications.read_application_aggregate(int(app_id))
+    if not agg:
         return (
             "Application not found.",
             "—", "—", "—",
@@ -198,19 +251,22 @@ def load_application(user_id, app_id):
             gr.update(interactive=True),
         )
 
-    level, name, status_db = row
-    progress_text, computed_status, _missing = compute_progress_and_status(int(app_id), level)
+    level, name, status_db = agg["level"], agg["programme"], agg["status"]
+    progress_text, computed_status = compute_progress_and_status(
+        int(app_id), (agg["required_uploaded"], agg["required_total"])
+    )
 
     if status_db != "Submitted":
         status = computed_status
-        applications.update_application_status(int(app_id), status)
+        if status != status_db:
+            applications.update_application_status(int(app_id), status)
     else:
         status = "Submitted"
 
     req = required_docs_for(level)
-    docs_txt, delete_dd = docs_text_and_delete_choices(user_id, app_id)
+    docs_txt, delete_dd = docs_text_and_delete_choices(user_id, app_id, agg["documents"])
 
-    latest_row = applications.get_latest_decision_row(int(app_id))
+    latest_row = agg["latest_decision"]
     if latest_row:
         decision_ts, decision_status, decision_note, _admin_id = latest_row
         note_text = (decision_note or "").strip()
@@ -263,24 +319,21 @@ def upload_doc(user_id, app_id, doc_type, file_obj):
         if not doc_type:
             return "Select a document type first."
 
-        row = applications.read_application(int(app_id))
-        if row and row[2] == "Submitted":
+        agg = applications.read_application_aggregate(int(app_id))
+        if not agg:
+            return "❌ Application not found."
+        if agg["status"] == "Submitted":
             return "🔒 Application is Submitted. Uploads are locked."
 
         src_path = getattr(file_obj, "name", None) or str(file_obj)
         filename = os.path.basename(src_path)
 
-        dest_dir = os.path.join(UPLOAD_ROOT, f"app_{int(app_id)}")
-        _ensure_dir(dest_dir)
-
-        dest_path = os.path.join(dest_dir, filename)
-        shutil.copy(src_path, dest_path)
+        # Stored once per content; re-uploading the same file adds a reference.
+        blobstore.add_document(int(app_id), doc_type, filename, src_path)
+        jobs.notify()  # checks run in the background; the documents list shows the result
 
-        applications.add_document(int(app_id), doc_type, filename, dest_path)
-
-        level, _name, _status = applications.read_application(int(app_id))
-        progress_text, new_status, _missing = compute_progress_and_status(int(app_id), level)
-        if _status != "Submitted":
+        progress_text, new_status = compute_progress_and_status(int(app_id))
+        if new_status != agg["status"]:
             applications.update_application_status(int(app_id), new_status)
 
         return f"✅ Uploaded: {filename}. Progress: {progress_text}. Status: {new_status}"
@@ -297,17 +350,21 @@ def delete_one_doc(user_id, app_id, doc_id):
         if not doc_id:
             return "Select a document first."
 
-        row = applications.read_application(int(app_id))
-        if row and row[2] == "Submitted":
+        agg = applications.read_application_aggregate(int(app_id))
+        if not agg:
+            return "❌ Application not found."
+        if agg["status"] == "Submitted":
             return "🔒 Application is Submitted. Deletions are locked."
 
+        # Only documents of this application can be deleted from its page.
+        if int(doc_id) not in {d[0] for d in agg["documents"]}:
+            return "❌ Not found."
         ok = delete_doc_by_id(int(doc_id))
         if not ok:
             return "❌ Not found."
 
-        level, _name, _status = applications.read_application(int(app_id))
-        progress_text, new_status, _missing = compute_progress_and_status(int(app_id), level)
-        if _status != "Submitted":
+        progress_text, new_status = compute_progress_and_status(int(app_id))
+        if new_status != agg["status"]:
             applications.update_application_status(int(app_id), new_status)
 
         return f"✅ Deleted. Progress: {progress_text}. Status: {new_status}"
@@ -322,15 +379,16 @@ def delete_all_docs(user_id, app_id):
         if not app_id:
             return "Select an application first."
 
-        row = applications.read_application(int(app_id))
-        if row and row[2] == "Submitted":
+        agg = applications.read_application_aggregate(int(app_id))
+        if not agg:
+            return "❌ Application not found."
+        if agg["status"] == "Submitted":
             return "🔒 Application is Submitted. Deletions are locked."
 
         n = delete_all_docs_for_application(int(app_id))
 
-        level, _name, _status = applications.read_application(int(app_id))
-        progress_text, new_status, _missing = compute_progress_and_status(int(app_id), level)
-        if _status != "Submitted":
+        progress_text, new_status = compute_progress_and_status(int(app_id))
+        if new_status != agg["status"]:
             applications.update_application_status(int(app_id), new_status)
 
         return f"✅ Deleted {n} document(s). Progress: {progress_text}. Status: {new_status}"
@@ -352,8 +410,10 @@ def submit_application(user_id, app_id):
     if status == "Submitted":
         return "Already submitted."
 
-    _progress_text, computed_status, missing = compute_progress_and_status(int(app_id), level)
+    _progress_text, computed_status = compute_progress_and_status(int(app_id))
     if computed_status != "Complete":
+        uploaded = get_uploaded_doc_types(int(app_id))
+        missing = [x for x in required_docs_for(level) if x not in uploaded]
         return f"❌ Not ready to submit. Missing: {', '.join(missing) if missing else 'unknown'}"
 
     applications.submit_application(int(app_id))
@@ -362,17 +422,147 @@ def submit_application(user_id, app_id):
 
 
 # ADMIN 
-def admin_refresh(user_id):
+ADMIN_STATUSES = list(applications.DECISION_STATUSES)
+ALL = "All"
+# Status filter choice backed by the completeness counters, not by `status`.
+COMPLETE_NOT_SUBMITTED = "Complete, not submitted"
+
+
+def _admin_filters(status, level, programme, date_from, date_to) -> dict:
+    def day(value, label):
+        value = (value or "").strip()
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value).isoformat()
+        except ValueError:
+            raise ValueError(f"{label} must be a date like 2026-01-31.")
+
+    pick = lambda v: None if not v or v in (ALL, COMPLETE_NOT_SUBMITTED) else v
+    return {
+        "status": pick(status),
+        "complete_not_submitted": status == COMPLETE_NOT_SUBMITTED,
+        "level": pick(level),
+        "programme": pick(programme),
+        "created_from": day(date_from, "From date"),
+        "created_to": day(date_to, "To date"),
+    }
+
+
+def admin_programme_choices(level):
+    if level == "Bachelor":
+        programmes = BACHELOR_PROGRAMMES
+    elif level == "Master":
+        programmes = MASTER_PROGRAMMES
+    else:
+        programmes = BACHELOR_PROGRAMMES + MASTER_PROGRAMMES
+    return gr.update(choices=[ALL] + list(programmes), value=ALL)
+
+
+def admin_list_page(user_id, status, level, programme, date_from, date_to, page=None, direction="first"):
+    """
+    direction: "first", "older", "newer" or "current" (reload the page in `page`).
+    Returns (status_text, table, app_dropdown, bulk_dropdown, page_state, newer_btn, older_btn).
+    """
+    empty = ([], gr.update(choices=[], value=None), gr.update(choices=[], value=[]), None,
+             gr.update(interactive=False), gr.update(interactive=False))
     if not user_id:
-        return "Not logged in.", [], gr.update(choices=[], value=None)
+        return ("Not logged in.",) + empty
     if not auth.is_admin_user(int(user_id)):
-        return "Not authorized.", [], gr.update(choices=[], value=None)
+        return ("Not authorized.",) + empty
+    try:
+        filters = _admin_filters(status, level, programme, date_from, date_to)
+    except ValueError as e:
+        return (f"❌ {e}",) + empty
+
+    page = page or {}
+    if direction == "older" and page.get("last_id"):
+        result = applications.list_applications_page(before_id=page["last_id"], **filters)
+    elif direction == "newer" and page.get("first_id"):
+        result = applications.list_applications_page(after_id=page["first_id"], **filters)
+    elif direction == "current" and page.get("first_id"):
+        result = applications.list_applications_page(before_id=page["first_id"] + 1, **filters)
+    else:
+        result = applications.list_applications_page(**filters)
 
-    rows = applications.list_all_applications()
-    table = [[app_id, uid, lvl, prog, status, ts] for app_id, uid, lvl, prog, status, ts in rows]
-    choices = [(f"#{app_id} — {lvl} — {prog} — {status}", app_id) for app_id, uid, lvl, prog, status, ts in rows]
+    rows = result["rows"]
+    table = [[app_id, uid, lvl, prog, st, ts] for app_id, uid, lvl, prog, st, ts in rows]
+    choices = [(f"#{app_id} — {lvl} — {prog} — {st}", app_id) for app_id, uid, lvl, prog, st, ts in rows]
     dd = gr.update(choices=choices, value=(choices[0][1] if choices else None))
-    return f"Found {len(rows)} total applications.", table, dd
+    new_page = {"first_id": rows[0][0], "last_id": rows[-1][0]} if rows else None
+
+    total = applications.count_applications(**filters)
+    by_status = applications.count_applications_by_status()
+    shown = f"showing #{rows[0][0]}–#{rows[-1][0]}" if rows else "nothing to show"
+    breakdown = ", ".join(f"{k}: {v}" for k, v in sorted(by_status.items()))
+    text = f"{total} matching application(s), {shown}. All applications by status: {breakdown or 'none'}."
+    return (
+        text, table, dd, gr.update(choices=choices, value=[]), new_page,
+        gr.update(interactive=result["has_newer"]),
+        gr.update(interactive=result["has_older"]),
+    )
+
+
+def admin_refresh(user_id, status=ALL, level=ALL, programme=ALL, date_from="", date_to=""):
+    return admin_list_page(user_id, status, level, programme, date_from, date_to)
+
+
+def admin_older(user_id, status, level, programme, date_from, date_to, page):
+    return admin_list_page(user_id, status, level, programme, date_from, date_to, page, "older")
+
+
+def admin_newer(user_id, status, level, programme, date_from, date_to, page):
+    return admin_list_page(user_id, status, level, programme, date_from, date_to, page, "newer")
+
+
+def admin_reload_page(user_id, status, level, programme, date_from, date_to, page):
+    return admin_list_page(user_id, status, level, programme, date_from, date_to, page, "current")
+
+
+def admin_search(user_id, text, page=None, direction="first"):
+    """
+    Full-text search (search.py), one page of ranked hits at a time.
+    Returns (status_text, table, app_dropdown, page_state, prev_btn, next_btn).
+    """
+    empty = ([], gr.update(), None, gr.update(interactive=False), gr.update(interactive=False))
+    if not user_id:
+        return ("Not logged in.",) + empty
+    if not auth.is_admin_user(int(user_id)):
+        return ("Not authorized.",) + empty
+
+    page = page or {}
+    if direction == "first":
+        page = {"text": (text or "").strip(), "offset": 0}
+    elif direction == "next":
+        page = {**page, "offset": page.get("offset", 0) + search.SEARCH_PAGE_SIZE}
+    else:
+        page = {**page, "offset": max(0, page.get("offset", 0) - search.SEARCH_PAGE_SIZE)}
+    if not search.fts_query(page.get("text")):
+        return ("Type a name, email, programme, note, filename or chat text.",) + empty
+
+    t0 = time.perf_counter()
+    result = search.search(page["text"], offset=page["offset"])
+    ms = (time.perf_counter() - t0) * 1000
+    rows = result["rows"]
+    table = [[kind, app_id or "", uid or "", snippet] for kind, app_id, uid, snippet in rows]
+    app_ids = list(dict.fromkeys(app_id for _kind, app_id, _uid, _snip in rows if app_id))
+    dd = gr.update(choices=[(f"#{a}", a) for a in app_ids], value=app_ids[0]) if app_ids else gr.update()
+    first = page["offset"] + 1
+    text = (f"Hits {first}–{page['offset'] + len(rows)} for “{page['text']}” ({ms:.1f} ms)." if rows
+            else f"No hits for “{page['text']}”.")
+    return (
+        text, table, dd, page,
+        gr.update(interactive=page["offset"] > 0),
+        gr.update(interactive=result["has_more"]),
+    )
+
+
+def admin_search_next(user_id, page):
+    return admin_search(user_id, None, page, "next")
+
+
+def admin_search_prev(user_id, page):
+    return admin_search(user_id, None, page, "prev")
 
 
 def admin_set_status(user_id, app_id, new_status, note):
@@ -384,19 +574,23 @@ def admin_set_status(user_id, app_id, new_status, note):
         return "Select an application id."
 
     app_id = int(app_id)
-    applications.update_application_status(app_id, new_status)
+    try:
+        applications.apply_decisions([app_id], int(user_id), new_status, note)
+    except ValueError as e:
+        return f"❌ {e}"
+    return f"✅ Updated application #{app_id} to {new_status}"
 
-    note = (note or "").strip()
-    if new_status == "Rejected" and not note:
-        return "❌ Please write a reason when rejecting."
 
-    applications.add_decision_note(
-        application_id=app_id,
-        admin_user_id=int(user_id),
-        new_status=new_status,
-        note=note,
-    )
-    return f"✅ Updated application #{app_id} to {new_status}"
+def admin_bulk_decision(user_id, app_ids, new_status, note):
+    if not user_id:
+        return "Not logged in."
+    if not auth.is_admin_user(int(user_id)):
+        return "Not authorized."
+    try:
+        n = applications.apply_decisions(app_ids or [], int(user_id), new_status, note)
+    except ValueError as e:
+        return f"❌ {e}"
+    return f"✅ Updated {n} application(s) to {new_status}"
 
 
 def admin_load_documents(user_id, app_id):
@@ -407,7 +601,11 @@ def admin_load_documents(user_id, app_id):
     if not app_id:
         return [], gr.update(choices=[], value=None), {}, None
 
-    docs = applications.list_documents(int(app_id))
+    c = con_ro()
+    try:
+        docs = applications.list_documents(int(app_id), c)
+    finally:
+        c.close()
     if not docs:
         return [], gr.update(choices=[], value=None), {}, None
 
@@ -415,11 +613,11 @@ def admin_load_documents(user_id, app_id):
     labels = []
     path_map = {}
 
-    for doc_id, doc_type, fname, saved_path, ts in docs:
-        table.append([doc_type, fname, ts])
+    for doc_id, doc_type, fname, saved_path, ts, state, info in docs:
+        table.append([doc_type, fname, ts, jobs.processing_label(state, info)])
         label = f"[{doc_id}] {doc_type} — {fname}"
         labels.append(label)
-        path_map[label] = saved_path
+        path_map[label] = [saved_path, fname]
 
     return table, gr.update(choices=labels, value=labels[0]), path_map, None
 
@@ -429,58 +627,98 @@ def admin_download_selected(label, path_map):
         return None
     if not path_map or label not in path_map:
         return None
-    path = path_map[label]
+    path, filename = path_map[label]
     if not path or not os.path.exists(path):
         return None
-    return path 
+    return blobstore.named_path(path, filename)
 
 
-# PORTAL AI
-def portal_chat_fn(message, history, user_id_val, app_id_val):
-    message = (message or "").strip()
-    if not message:
-        return "Type a message."
-    if not user_id_val:
-        return "🔒 Please log in first."
+def _export_link(user_id, app_ids, label) -> str:
+    token = export.create_export(int(user_id), app_ids, label)
+    minutes = int(export.EXPORT_TTL_S // 60)
+    return (f"✅ [Download {label}.zip](/export/{token}.zip) — {len(set(app_ids))} application(s), "
+            f"documents plus manifest.csv and decisions.csv. The link works for {minutes} minutes.")
 
-    intent = detect_intent(message)
+
+def admin_export_selected(user_id, bulk_ids, app_id):
+    """The applications picked for bulk decisions, else the one under review."""
+    if not user_id or not auth.is_admin_user(int(user_id)):
+        return "Not authorized."
+    ids = list(bulk_ids or []) or ([app_id] if app_id else [])
+    try:
+        return _export_link(user_id, ids, "applications" if len(ids) > 1 else f"application_{ids[0] if ids else ''}")
+    except ValueError as e:
+        return f"❌ {e}"
+
+
+def admin_export_matching(user_id, status, level, programme, date_from, date_to):
+    """Every application matching the listing filters, not just the page shown."""
+    if not user_id or not auth.is_admin_user(int(user_id)):
+        return "Not authorized."
+    try:
+        filters = _admin_filters(status, level, programme, date_from, date_to)
+        ids = applications.list_application_ids(limit=export.EXPORT_MAX_APPLICATIONS + 1, **filters)
+        status_label = filters["status"] or ("complete" if filters["complete_not_submitted"] else None)
+        label = "_".join(str(v) for v in (status_label, filters["programme"] or filters["level"]) if v)
+        return _export_link(user_id, ids, label or "applications")
+    except ValueError as e:
+        return f"❌ {e}"
+
+
+# PORTAL AI
+def _portal_reply(message, intent, user_id_val, app_id_val):
+    """
+    Returns (reply, prompt, cache_key): a ready reply for intents we can answer
+    from the database, otherwise the prompt to send to the model. cache_key is
+    set only for GENERAL questions.
+    """
 
     if intent == "LIST_APPS":
         apps = list_my_applications(int(user_id_val))
         if not apps:
-            return "You don’t have any applications yet."
+            return "You don’t have any applications yet.", None, None
         return "Your applications:\n" + "\n".join(
             f"- (#{a['app_id']}) [{a['level']}] {a['programme']} — {a['status']}"
             for a in apps
-        )
+        ), None, None
 
     info = application_summary(int(app_id_val)) if app_id_val else None
     if info and info.get("status") == "Submitted":
         if intent in {"DELETE_ALL_DOCS", "DELETE_DOC_ID"}:
-            return "🔒 This application is Submitted. Document deletion is locked."
+            return "🔒 This application is Submitted. Document deletion is locked.", None, None
 
     if intent == "MISSING_DOCS":
         if not app_id_val:
-            return "Select an application first (Application Page dropdown)."
+            return "Select an application first (Application Page dropdown).", None, None
         if not info:
-            return "Application not found."
+            return "Application not found.", None, None
         if not info["missing_types"]:
-            return "✅ All required documents are uploaded."
-        return "You are missing:\n" + "\n".join(f"- {x}" for x in info["missing_types"])
+            return "✅ All required documents are uploaded.", None, None
+        return "You are missing:\n" + "\n".join(f"- {x}" for x in info["missing_types"]), None, None
+
+    if intent == "REQUIREMENTS":
+        return requirements_reply(info), None, None
+
+    if intent == "REQS_ALL_APPS":
+        return requirements_reply_all_apps(int(user_id_val)), None, None
 
     if intent == "DELETE_ALL_DOCS":
         if not app_id_val:
-            return "Select an application first."
+            return "Select an application first.", None, None
         n = delete_all_docs_for_application(int(app_id_val))
-        return f"✅ Deleted {n} document(s) for application #{app_id_val}."
+        if info:
+            _progress, new_status = compute_progress_and_status(int(app_id_val))
+            if new_status != info["status"]:
+                applications.update_application_status(int(app_id_val), new_status)
+        return f"✅ Deleted {n} document(s) for application #{app_id_val}.", None, None
 
     if intent == "DELETE_DOC_ID":
         m = re.search(r"(#|id\s*)(\d+)", message.lower())
         if not m:
-            return "Tell me the document id, e.g. 'delete doc id 12'."
+            return "Tell me the document id, e.g. 'delete doc id 12'.", None, None
         doc_id = int(m.group(2))
         ok = delete_doc_by_id(doc_id)
-        return "✅ Deleted." if ok else "❌ Not found."
+        return "✅ Deleted." if ok else "❌ Not found.", None, None
 
     ctx = ""
     if info:
@@ -503,7 +741,55 @@ def portal_chat_fn(message, history, user_id_val, app_id_val):
         "Use the application context if provided.\n"
         f"{ctx}\nUser: {message}\nAssistant:"
     )
-    return ask_llm(prompt)
+    cache_key = None
+    if intent == "GENERAL":
+        # The context carries the application's state, so answers are shared
+        # only between identical situations.
+        cache_key = make_key(
+            message,
+            info["level"] if info else "",
+            info["programme"] if info else "",
+            ai.choose_model("portal", intent, prompt),
+            ai.PROMPT_VERSION,
+            extra=ctx,
+        )
+    return None, prompt, cache_key
+
+
+# Portal chat turns, and how many were answered without calling the model.
+chat_turns = {"total": 0, "local": 0}
+_chat_turns_lock = threading.Lock()
+
+
+def _count_turn(local: bool):
+    with _chat_turns_lock:
+        chat_turns["total"] += 1
+        if local:
+            chat_turns["local"] += 1
+
+
+async def portal_chat_fn(message, history, user_id_val, app_id_val):
+    message = (message or "").strip()
+    if not message:
+        yield "Type a message."
+        return
+    if not user_id_val:
+        yield "🔒 Please log in first."
+        return
+
+    # DB work stays off the event loop; the model wait below holds no thread.
+    intent = detect_intent(message)
+    reply, prompt, cache_key = await asyncio.to_thread(_portal_reply, message, intent, user_id_val, app_id_val)
+    _count_turn(local=(reply is not None))
+    if reply is not None:
+        yield reply
+        await asyncio.to_thread(log_chat, message, reply, "portal", user_id_val)
+        return
+    answer = ""
+    async for partial in _stream_answer(prompt, "portal", intent, cache_key, fallback=PORTAL_FALLBACK):
+        answer = partial
+        yield partial
+    await asyncio.to_thread(log_chat, message, answer, "portal", user_id_val)
 
 
 
@@ -540,11 +826,18 @@ def do_logout_reset():
         "Not loaded.",             # admin_status
         [],                        # admin_table
         gr.update(choices=[], value=None),  # admin_app_pick
+        gr.update(choices=[], value=[]),    # admin_bulk_pick
         "",                        # admin_update_out
         [],                        # admin_docs_table
         gr.update(choices=[], value=None),  # admin_doc_selector
         {},                        # admin_doc_paths_state
         None,                      # admin_download
+        None,                      # admin_page_state
+        "",                        # admin_search_q
+        "",                        # admin_search_out
+        [],                        # admin_search_table
+        None,                      # admin_search_state
+        "",                        # admin_export_out
         "",                        # whoami_text
     )
 
@@ -556,6 +849,10 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
 
     # Admin docs state map
     admin_doc_paths_state = gr.State({})
+    # {"first_id", "last_id"} of the admin page on screen (keyset pagination)
+    admin_page_state = gr.State(None)
+    # {"text", "offset"} of the search hits on screen
+    admin_search_state = gr.State(None)
 
     # Visible when NOT logged in
     public_group = gr.Group(visible=True)
@@ -586,7 +883,14 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
                 pub_q = gr.Textbox(label="Your question", lines=2, max_lines=6)
                 pub_btn = gr.Button("Ask")
                 pub_a = gr.Textbox(label="Answer", lines=8, max_lines=12)
-                pub_btn.click(ai_public_answer, inputs=[pub_q, pub_level, pub_programme], outputs=[pub_a])
+                # Async handler: waiting on the model holds no worker thread, and the
+                # LLM scheduler bounds real concurrency, so Gradio need not.
+                pub_btn.click(
+                    ai_public_answer,
+                    inputs=[pub_q, pub_level, pub_programme],
+                    outputs=[pub_a],
+                    concurrency_limit=None,
+                )
 
             with gr.Tab("Account"):
                 gr.Markdown("### Register")
@@ -654,6 +958,7 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
                     upload_out = gr.Textbox(label="Upload Result", interactive=False, lines=1, max_lines=3)
 
                     docs_out = gr.Textbox(label="Uploaded Documents", lines=10, max_lines=18, interactive=False)
+                    refresh_docs_btn = gr.Button("Refresh document checks")
 
                     gr.Markdown("## Delete uploaded documents")
                     delete_doc_dropdown = gr.Dropdown(choices=[], label="Select document to delete")
@@ -668,6 +973,7 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
                     gr.ChatInterface(
                         fn=portal_chat_fn,
                         additional_inputs=[user_id_state, selected_app_id_state],
+                        concurrency_limit=None,
                     )
 
         # Admin-only UI
@@ -675,6 +981,15 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
         with admin_only_group:
             gr.Markdown("## Admin / Reviewer Console")
 
+            with gr.Row():
+                admin_f_status = gr.Dropdown(choices=[ALL, COMPLETE_NOT_SUBMITTED] + ADMIN_STATUSES, value=ALL, label="Status")
+                admin_f_level = gr.Dropdown(choices=[ALL, "Bachelor", "Master"], value=ALL, label="Level")
+                admin_f_programme = gr.Dropdown(
+                    choices=[ALL] + BACHELOR_PROGRAMMES + MASTER_PROGRAMMES, value=ALL, label="Programme"
+                )
+                admin_f_from = gr.Textbox(label="Created from (YYYY-MM-DD)")
+                admin_f_to = gr.Textbox(label="Created to (YYYY-MM-DD)")
+
             with gr.Row():
                 admin_refresh_btn = gr.Button("Refresh applications")
                 admin_status = gr.Textbox(label="Admin status", interactive=False)
@@ -684,11 +999,27 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
                 interactive=False,
             )
 
+            with gr.Row():
+                admin_newer_btn = gr.Button("◀ Newer", interactive=False)
+                admin_older_btn = gr.Button("Older ▶", interactive=False)
+
+            gr.Markdown("### 🔎 Search")
+            with gr.Row():
+                admin_search_q = gr.Textbox(
+                    label="Applicant name or email, programme, decision note, document filename or chat text",
+                )
+                admin_search_btn = gr.Button("Search")
+            admin_search_out = gr.Textbox(label="Search status", interactive=False)
+            admin_search_table = gr.Dataframe(headers=["Match", "App ID", "User ID", "Snippet"], interactive=False)
+            with gr.Row():
+                admin_search_prev_btn = gr.Button("◀ Previous hits", interactive=False)
+                admin_search_next_btn = gr.Button("More hits ▶", interactive=False)
+
             admin_app_pick = gr.Dropdown(label="Select application to review", choices=[])
 
             with gr.Row():
                 admin_new_status = gr.Dropdown(
-                    choices=["Submitted", "Approved", "Rejected", "In Progress", "Complete"],
+                    choices=ADMIN_STATUSES,
                     value="Approved",
                     label="Set status",
                 )
@@ -700,17 +1031,28 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
             )
 
             admin_update_btn = gr.Button("Apply decision")
+
+            admin_bulk_pick = gr.Dropdown(
+                label="Or select several applications on this page", choices=[], multiselect=True
+            )
+            admin_bulk_btn = gr.Button("Apply decision to selected")
             admin_update_out = gr.Textbox(label="Update result", interactive=False)
 
             gr.Markdown("### 📂 Uploaded Documents")
             admin_docs_table = gr.Dataframe(
-                headers=["Doc Type", "Filename", "Uploaded"],
+                headers=["Doc Type", "Filename", "Uploaded", "Checks"],
                 interactive=False,
             )
 
             admin_doc_selector = gr.Dropdown(label="Select document to download", choices=[])
             admin_download = gr.File(label="Download selected document")
 
+            gr.Markdown("### 📦 Export documents (ZIP)")
+            with gr.Row():
+                admin_export_selected_btn = gr.Button("Export selected applications")
+                admin_export_matching_btn = gr.Button("Export all applications matching the filters")
+            admin_export_out = gr.Markdown("")
+
 
     def _after_login(uid: int):
         is_admin = auth.is_admin_user(int(uid))
@@ -791,6 +1133,7 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
     # Upload
     upload_btn.click(upload_doc, [user_id_state, apps_dropdown, req_doc_type, file_obj], [upload_out])
     upload_btn.click(docs_text_and_delete_choices, [user_id_state, apps_dropdown], [docs_out, delete_doc_dropdown])
+    refresh_docs_btn.click(docs_text_and_delete_choices, [user_id_state, apps_dropdown], [docs_out, delete_doc_dropdown])
     upload_btn.click(load_application, [user_id_state, apps_dropdown], LOAD_APP_OUTPUTS)
 
     # Delete selected
@@ -808,8 +1151,25 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
     submit_btn.click(load_application, [user_id_state, apps_dropdown], LOAD_APP_OUTPUTS)
     submit_btn.click(refresh_apps, [user_id_state], [dash_out, apps_table, apps_dropdown])
 
-    # Admin refresh
-    admin_refresh_btn.click(admin_refresh, [user_id_state], [admin_status, admin_table, admin_app_pick])
+    # Admin listing: filters are applied server-side, one page at a time
+    ADMIN_FILTERS = [admin_f_status, admin_f_level, admin_f_programme, admin_f_from, admin_f_to]
+    ADMIN_PAGE_OUTPUTS = [
+        admin_status, admin_table, admin_app_pick, admin_bulk_pick, admin_page_state, admin_newer_btn, admin_older_btn,
+    ]
+    admin_refresh_btn.click(admin_refresh, [user_id_state] + ADMIN_FILTERS, ADMIN_PAGE_OUTPUTS)
+    admin_older_btn.click(admin_older, [user_id_state] + ADMIN_FILTERS + [admin_page_state], ADMIN_PAGE_OUTPUTS)
+    admin_newer_btn.click(admin_newer, [user_id_state] + ADMIN_FILTERS + [admin_page_state], ADMIN_PAGE_OUTPUTS)
+    admin_f_level.change(admin_programme_choices, [admin_f_level], [admin_f_programme])
+
+    # Admin search: hits fill the review dropdown
+    ADMIN_SEARCH_OUTPUTS = [
+        admin_search_out, admin_search_table, admin_app_pick, admin_search_state,
+        admin_search_prev_btn, admin_search_next_btn,
+    ]
+    admin_search_btn.click(admin_search, [user_id_state, admin_search_q], ADMIN_SEARCH_OUTPUTS)
+    admin_search_q.submit(admin_search, [user_id_state, admin_search_q], ADMIN_SEARCH_OUTPUTS)
+    admin_search_next_btn.click(admin_search_next, [user_id_state, admin_search_state], ADMIN_SEARCH_OUTPUTS)
+    admin_search_prev_btn.click(admin_search_prev, [user_id_state, admin_search_state], ADMIN_SEARCH_OUTPUTS)
 
     admin_app_pick.change(
         admin_load_documents,
@@ -824,13 +1184,25 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
         outputs=[admin_download],
     )
 
+    # Export: a link to the streamed ZIP served by create_server_app
+    admin_export_selected_btn.click(
+        admin_export_selected, [user_id_state, admin_bulk_pick, admin_app_pick], [admin_export_out]
+    )
+    admin_export_matching_btn.click(admin_export_matching, [user_id_state] + ADMIN_FILTERS, [admin_export_out])
+
     # Admin decision
     admin_update_btn.click(
         admin_set_status,
         [user_id_state, admin_app_pick, admin_new_status, admin_note],
         [admin_update_out],
-    )
-    admin_update_btn.click(admin_refresh, [user_id_state], [admin_status, admin_table, admin_app_pick])
+    ).then(admin_reload_page, [user_id_state] + ADMIN_FILTERS + [admin_page_state], ADMIN_PAGE_OUTPUTS)
+
+    # Bulk decision: one transaction, then one refresh
+    admin_bulk_btn.click(
+        admin_bulk_decision,
+        [user_id_state, admin_bulk_pick, admin_new_status, admin_note],
+        [admin_update_out],
+    ).then(admin_reload_page, [user_id_state] + ADMIN_FILTERS + [admin_page_state], ADMIN_PAGE_OUTPUTS)
 
     # Global logout
     logout_btn.click(
@@ -845,12 +1217,82 @@ with gr.Blocks(title="Student Application Portal (Beta)") as demo:
             req_doc_type, upload_out, docs_out,
             delete_doc_dropdown, delete_out,
             submit_btn, upload_btn, delete_one_btn, delete_all_btn, file_obj, req_doc_type,
-            admin_note, admin_status, admin_table, admin_app_pick, admin_update_out,
+            admin_note, admin_status, admin_table, admin_app_pick, admin_bulk_pick, admin_update_out,
             admin_docs_table, admin_doc_selector, admin_doc_paths_state, admin_download,
+            admin_page_state,
+            admin_search_q, admin_search_out, admin_search_table, admin_search_state,
+            admin_export_out,
             whoami_text,
         ],
     )
 
+def metrics_text() -> str:
+    q = ai.scheduler_stats()
+    c = answer_cache.stats()
+    logs = chat_log.stats()
+    jobs_q = jobs.queue_stats()
+    breaker_state = {"closed": 0, "half-open": 1, "open": 2}[ai.breaker.state]
+    return render_prometheus({
+        "llm_queue_depth": q["queue_depth"],
+        "llm_in_flight": q["in_flight"],
+        "llm_coalesce_ratio": q["coalesce_ratio"],
+        "llm_queue_rejected_total": q["rejected"],
+        "llm_breaker_state": breaker_state,
+        "llm_breaker_opened_total": ai.breaker.times_opened,
+        "llm_cache_hits_total": c["hits_memory"] + c["hits_disk"],
+        "llm_cache_misses_total": c["misses"],
+        "portal_chat_turns_total": chat_turns["total"],
+        "portal_chat_turns_local_total": chat_turns["local"],
+        "chat_log_queued": logs["queued"],
+        "chat_log_dropped_total": logs["dropped"],
+        "jobs_queued": jobs_q["queued"],
+        "jobs_running": jobs_q["running"],
+        "jobs_failed": jobs_q["failed"],
+    })
+
+
+# Bearer token for /metrics; without one it is off. The peer address proves
+# nothing behind a reverse proxy, where every request comes from 127.0.0.1.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+
+def metrics_allowed(authorization: str) -> bool:
+    return bool(METRICS_TOKEN) and secrets.compare_digest((authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+
+def create_server_app():
+    """The Gradio UI mounted on a FastAPI app that also serves /metrics and ZIP exports."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import PlainTextResponse, StreamingResponse
+
+    # No API pages, from FastAPI or Gradio.
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics(request: Request):
+        if not METRICS_TOKEN:
+            return PlainTextResponse("Not Found", status_code=404)
+        if not metrics_allowed(request.headers.get("authorization")):
+            return PlainTextResponse("Forbidden", status_code=403)
+        return PlainTextResponse(metrics_text(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/export/{token}.zip")
+    def export_zip(token: str):
+        job = export.lookup(token)
+        if job is None:
+            return PlainTextResponse("This export link has expired. Create a new one in the reviewer console.",
+                                     status_code=404)
+        return StreamingResponse(
+            export.stream_zip(job["app_ids"]),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{job["filename"]}"'},
+        )
+
+    return gr.mount_gradio_app(app, demo, path="/", show_api=False)
+
+
 if __name__ == "__main__":
+    import uvicorn
+
     port = int(os.environ.get("PORT", 7860))
-    demo.launch(server_name="0.0.0.0", server_port=port, show_api=False)
+    uvicorn.run(create_server_app(), host="0.0.0.0", port=port)
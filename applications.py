@@ -1,5 +1,19 @@
+import json
 from typing import List, Tuple, Optional
-from models_db import con, now
+from models_db import con, con_ro, now, transaction
+
+DECISION_STATUSES = ("Submitted", "Approved", "Rejected", "In Progress", "Complete")
+
+# Same predicate as the partial index idx_applications_complete_open
+# (models_db migration 3); queries must contain it verbatim to use the index.
+COMPLETE_NOT_SUBMITTED_SQL = (
+    "required_total > 0 AND required_uploaded_count >= required_total AND status != 'Submitted'"
+)
+
+
+def is_complete(required_uploaded: int, required_total: int) -> bool:
+    """Every required document uploaded. With none configured for the level, nothing is complete."""
+    return required_total > 0 and required_uploaded >= required_total
 
 
 def create_application(user_id: int, level: str, programme: str) -> int:
@@ -17,6 +31,28 @@ def create_application(user_id: int, level: str, programme: str) -> int:
     c.close()
     return int(app_id)
 
+def list_applications_with_doc_types(user_id: int) -> List[Tuple]:
+    """
+    Returns one row per (application, uploaded doc type), or a single row with
+    doc_type None for applications without documents:
+    (id, program_level, program_name, status, doc_type)
+    """
+    c = con()
+    cur = c.cursor()
+    cur.execute(
+        """
+        SELECT DISTINCT a.id, a.program_level, a.program_name, a.status, d.doc_type
+        FROM applications a
+        LEFT JOIN documents d ON d.application_id = a.id
+        WHERE a.user_id = ?
+        ORDER BY a.id DESC
+        """,
+        (int(user_id),),
+    )
+    rows = cur.fetchall()
+    c.close()
+    return rows
+
 def list_applications(user_id: int) -> List[Tuple]:
     """
     Returns: (id, program_level, program_name, status, created_ts)
@@ -54,6 +90,59 @@ def read_application(app_id: int) -> Optional[Tuple[str, str, str]]:
     c.close()
     return row
 
+def read_application_aggregate(app_id: int, c=None) -> Optional[dict]:
+    """
+    Everything the application page needs, on one connection in two queries.
+    Returns None if the application does not exist, else a dict with
+    app_id, user_id, level, programme, status, required_uploaded, required_total,
+    documents: [(id, doc_type, original_filename, saved_path, uploaded_ts,
+                 processing_state, processing_info)] newest first,
+    latest_decision: (created_ts, new_status, note, admin_user_id) or None
+    Reads on `c` when given (e.g. con_ro() for admin reads) and leaves it open.
+    """
+    own = c is None
+    if own:
+        c = con()
+    cur = c.cursor()
+    cur.execute(
+        """
+        SELECT a.user_id, a.program_level, a.program_name, a.status,
+               a.required_uploaded_count, a.required_total,
+               d.created_ts, d.new_status, d.note, d.admin_user_id
+        FROM applications a
+        LEFT JOIN application_decisions d
+          ON d.id = (SELECT MAX(id) FROM application_decisions WHERE application_id = a.id)
+        WHERE a.id = ?
+        """,
+        (int(app_id),),
+    )
+    row = cur.fetchone()
+    docs = list_documents(app_id, c) if row else None
+    if own:
+        c.close()
+    if not row:
+        return None
+    return {
+        "app_id": int(app_id),
+        "user_id": row[0],
+        "level": row[1],
+        "programme": row[2],
+        "status": row[3],
+        "required_uploaded": row[4],
+        "required_total": row[5],
+        "documents": docs,
+        "latest_decision": tuple(row[6:]) if row[7] is not None else None,
+    }
+
+def read_required_counts(app_id: int) -> Optional[Tuple[int, int]]:
+    """(required documents uploaded, required documents in total), kept by the migration 3 triggers."""
+    c = con()
+    row = c.execute(
+        "SELECT required_uploaded_count, required_total FROM applications WHERE id = ?", (int(app_id),)
+    ).fetchone()
+    c.close()
+    return row
+
 def update_application_status(app_id: int, new_status: str) -> None:
     c = con()
     cur = c.cursor()
@@ -73,7 +162,7 @@ def list_all_applications() -> List[Tuple]:
     """
     Returns: (id, user_id, program_level, program_name, status, created_ts)
     """
-    c = con()
+    c = con_ro()
     cur = c.cursor()
     cur.execute(
         """
@@ -86,6 +175,129 @@ def list_all_applications() -> List[Tuple]:
     c.close()
     return rows
 
+# Admin listings and counts read through con_ro(): they never write, and in
+# WAL mode they do not hold up student uploads.
+ADMIN_PAGE_SIZE = 50
+
+def _admin_where(status: str = None, level: str = None, programme: str = None,
+                 created_from: str = None, created_to: str = None,
+                 complete_not_submitted: bool = False) -> Tuple[str, list]:
+    """
+    created_from / created_to are ISO dates (YYYY-MM-DD), both inclusive.
+    created_ts is an ISO timestamp, so plain string comparison works.
+    complete_not_submitted keeps applications with every required document
+    uploaded that are not submitted yet (the completeness counters).
+    """
+    clauses, params = [], []
+    if status:
+        clauses.append("status = ?")
+        params.append(status)
+    if complete_not_submitted:
+        clauses.append(COMPLETE_NOT_SUBMITTED_SQL)
+    if level:
+        clauses.append("program_level = ?")
+        params.append(level)
+    if programme:
+        clauses.append("program_name = ?")
+        params.append(programme)
+    if created_from:
+        clauses.append("created_ts >= ?")
+        params.append(created_from)
+    if created_to:
+        clauses.append("created_ts < ?")
+        params.append(created_to + "\uffff")  # any time on that day
+    return (" AND ".join(clauses) or "1"), params
+
+def list_applications_page(before_id: int = None, after_id: int = None, limit: int = ADMIN_PAGE_SIZE,
+                           **filters) -> dict:
+    """
+    One page of the admin listing, newest first, keyset-paginated on id.
+    before_id: the page of ids just below it (next / older page)
+    after_id:  the page of ids just above it (previous / newer page)
+    filters:   status, level, programme, created_from, created_to, complete_not_submitted
+    Returns {"rows": [(id, user_id, program_level, program_name, status, created_ts)],
+             "has_newer": bool, "has_older": bool}
+    """
+    where, params = _admin_where(**filters)
+    newer_first = after_id is None
+    sql = f"SELECT id, user_id, program_level, program_name, status, created_ts FROM applications WHERE {where}"
+    args = list(params)
+    if after_id is not None:
+        sql += " AND id > ?"
+        args.append(int(after_id))
+    elif before_id is not None:
+        sql += " AND id < ?"
+        args.append(int(before_id))
+    sql += f" ORDER BY id {'DESC' if newer_first else 'ASC'} LIMIT ?"
+    args.append(int(limit) + 1)
+
+    c = con_ro()
+    cur = c.cursor()
+    cur.execute(sql, args)
+    rows = cur.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not newer_first:
+        rows.reverse()
+
+    def exists(op: str, edge: int) -> bool:
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM applications WHERE {where} AND id {op} ?)", params + [edge])
+        return bool(cur.fetchone()[0])
+
+    if newer_first:
+        has_older = more
+        has_newer = before_id is not None and exists(">", rows[0][0] if rows else int(before_id) - 1)
+    else:
+        has_newer = more
+        has_older = exists("<", rows[-1][0] if rows else int(after_id) + 1)
+    c.close()
+    return {"rows": rows, "has_newer": has_newer, "has_older": has_older}
+
+def count_applications(**filters) -> int:
+    where, params = _admin_where(**filters)
+    c = con_ro()
+    n = c.execute(f"SELECT COUNT(*) FROM applications WHERE {where}", params).fetchone()[0]
+    c.close()
+    return int(n)
+
+def count_applications_by_status() -> dict:
+    """status -> count; answered from idx_applications_status alone."""
+    c = con_ro()
+    rows = c.execute("SELECT status, COUNT(*) FROM applications GROUP BY status").fetchall()
+    c.close()
+    return dict(rows)
+
+def list_application_ids(limit: int = None, **filters) -> List[int]:
+    """Ids of every application matching the admin filters, newest first."""
+    where, params = _admin_where(**filters)
+    sql = f"SELECT id FROM applications WHERE {where} ORDER BY id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    c = con_ro()
+    ids = [r[0] for r in c.execute(sql, params)]
+    c.close()
+    return ids
+
+def list_complete_not_submitted() -> List[Tuple]:
+    """
+    Applications with every required document uploaded that are not yet
+    submitted. Returns: (id, user_id, program_level, program_name, status, created_ts)
+    """
+    c = con_ro()
+    cur = c.cursor()
+    cur.execute(
+        f"""
+        SELECT id, user_id, program_level, program_name, status, created_ts
+        FROM applications
+        WHERE {COMPLETE_NOT_SUBMITTED_SQL}
+        ORDER BY id DESC
+        """
+    )
+    rows = cur.fetchall()
+    c.close()
+    return rows
+
 # Documents
 def add_document(app_id: int, doc_type: str, original_filename: str, saved_path: str) -> int:
     c = con()
@@ -102,15 +314,19 @@ def add_document(app_id: int, doc_type: str, original_filename: str, saved_path:
     c.close()
     return int(doc_id)
 
-def list_documents(app_id: int) -> List[Tuple]:
+def list_documents(app_id: int, c=None) -> List[Tuple]:
     """
-    Returns: (id, doc_type, original_filename, saved_path, uploaded_ts)
+    Returns: (id, doc_type, original_filename, saved_path, uploaded_ts, processing_state, processing_info)
+    processing_state is set by the jobs runner: queued, processing, ready, invalid or failed.
+    Reads on `c` when given and leaves it open.
     """
-    c = con()
+    own = c is None
+    if own:
+        c = con()
     cur = c.cursor()
     cur.execute(
         """
-        SELECT id, doc_type, original_filename, saved_path, uploaded_ts
+        SELECT id, doc_type, original_filename, saved_path, uploaded_ts, processing_state, processing_info
         FROM documents
         WHERE application_id = ?
         ORDER BY id DESC
@@ -118,7 +334,8 @@ def list_documents(app_id: int) -> List[Tuple]:
         (int(app_id),),
     )
     rows = cur.fetchall()
-    c.close()
+    if own:
+        c.close()
     return rows
 
 from typing import Optional
@@ -137,6 +354,40 @@ def add_decision_note(application_id: int, admin_user_id: int, new_status: str,
     c.commit()
     c.close()
 
+def apply_decisions(app_ids, admin_user_id: int, new_status: str, note: str) -> int:
+    """
+    Sets new_status on every application in app_ids and records one decision
+    row each, all in one transaction. Everything is validated before the
+    first write; raises ValueError and changes nothing if any check fails.
+    Returns the number of applications updated.
+    """
+    ids = sorted({int(x) for x in app_ids or []})
+    note = (note or "").strip() or None
+    if not ids:
+        raise ValueError("Select at least one application.")
+    if new_status not in DECISION_STATUSES:
+        raise ValueError(f"Unknown status: {new_status}")
+    if new_status == "Rejected" and not note:
+        raise ValueError("Please write a reason when rejecting.")
+
+    with transaction() as c:
+        found = {r[0] for r in c.execute(
+            "SELECT id FROM applications WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)
+        )}
+        missing = [i for i in ids if i not in found]
+        if missing:
+            raise ValueError(f"Application(s) not found: {', '.join(map(str, missing[:10]))}")
+        ts = now()
+        c.executemany("UPDATE applications SET status = ? WHERE id = ?", [(new_status, i) for i in ids])
+        c.executemany(
+            """
+            INSERT INTO application_decisions(application_id, admin_user_id, created_ts, new_status, note)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(i, int(admin_user_id), ts, new_status, note) for i in ids],
+        )
+    return len(ids)
+
 def get_latest_decision_note(application_id: int) -> Optional[str]:
     c = con()
     cur = c.cursor()
@@ -156,6 +407,28 @@ def get_latest_decision_note(application_id: int) -> Optional[str]:
         return None
     return row[0]
 
+def list_decisions(application_id: int, c=None) -> List[Tuple]:
+    """
+    Every decision on the application, oldest first.
+    Returns: (created_ts, new_status, note, admin_user_id)
+    Reads on `c` when given and leaves it open, else on its own con_ro().
+    """
+    own = c is None
+    if own:
+        c = con_ro()
+    rows = c.execute(
+        """
+        SELECT created_ts, new_status, note, admin_user_id
+        FROM application_decisions
+        WHERE application_id = ?
+        ORDER BY id
+        """,
+        (int(application_id),),
+    ).fetchall()
+    if own:
+        c.close()
+    return rows
+
 def get_latest_decision_row(application_id: int):
     """
     Returns tuple: (created_ts, new_status, note, admin_user_id) or None
@@ -65,12 +65,16 @@ def login_user(email: str, password: str) -> int:
 
     return int(user_id)
 
-def get_user_email(user_id: int) -> str:
-    c = con()
+def get_user_email(user_id: int, c=None) -> str:
+    """Reads on `c` when given (e.g. con_ro() for admin reads) and leaves it open."""
+    own = c is None
+    if own:
+        c = con()
     cur = c.cursor()
     cur.execute("SELECT email FROM users WHERE id = ?", (int(user_id),))
     row = cur.fetchone()
-    c.close()
+    if own:
+        c.close()
     return row[0] if row else ""
 
 def is_admin_user(user_id: int) -> bool:
@@ -0,0 +1,885 @@
+"""
+SQLite micro-benchmarks against a throwaway database (app.db is never touched).
+
+    python bench_db.py pool [-n 5000] [--threads 4]
+    python bench_db.py chatlog [-n 5000]
+    python bench_db.py queries
+    python bench_db.py admin [-n 50000]
+    python bench_db.py decisions [-n 1000]
+    python bench_db.py readonly [-n 200000]
+    python bench_db.py deletes [-n 100] [--docs 20]
+    python bench_db.py search [-n 100000]
+    python bench_db.py blobs [-n 200] [--mb 2]
+    python bench_db.py ingest [-n 24] [--threads 4]
+    python bench_db.py jobs [-n 40] [--mb 2] [--threads 4]
+    python bench_db.py export [-n 20] [--docs 10] [--mb 5]
+    python bench_db.py reconcile [-n 200000]
+
+Query plans are checked by tests/test_query_plans.py.
+"""
+import os
+import time
+import argparse
+import sqlite3
+import tempfile
+import threading
+
+import auth
+import applications
+import db
+import models_db
+import programmes
+
+
+def _fixture(n_users: int = 50, apps_per_user: int = 6):
+    models_db.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    models_db.init_db_all()
+    uids, app_ids = [], []
+    for u in range(n_users):
+        uid = auth.register_user(f"User {u}", f"user{u}@example.com", "pw")
+        uids.append(uid)
+        for i in range(apps_per_user):
+            app_ids.append(applications.create_application(uid, "Bachelor", f"Programme {i}"))
+    return uids, app_ids
+
+
+def _ops_per_sec(fn, n: int, threads: int) -> float:
+    def work():
+        for i in range(n):
+            fn(i)
+
+    ts = [threading.Thread(target=work) for _ in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return n * threads / (time.perf_counter() - t0)
+
+
+def bench_pool(n: int, threads: int):
+    uids, app_ids = _fixture()
+    ops = {
+        "list_applications": lambda i: applications.list_applications(uids[i % len(uids)]),
+        "read_application": lambda i: applications.read_application(app_ids[i % len(app_ids)]),
+    }
+    print(f"{n} calls per thread")
+    for name, fn in ops.items():
+        for t in sorted({1, threads}):
+            models_db.POOL_ENABLED = False
+            before = _ops_per_sec(fn, n, t)
+            models_db.POOL_ENABLED = True
+            after = _ops_per_sec(fn, n, t)
+            print(f"{name:<20} threads={t:<2} connect-per-call {before:9.0f} ops/s   "
+                  f"pooled {after:9.0f} ops/s   x{after / before:.1f}")
+
+
+def _traced(fn, *args):
+    """
+    Runs fn on this thread's pooled connections (read-write and read-only)
+    and returns the statements it executed.
+    """
+    conns = [models_db.con(), models_db.con_ro()]
+    stmts = []
+    for c in conns:
+        c.close()  # back on the idle list, where fn's con()/con_ro() will pick it up
+        c.set_trace_callback(stmts.append)
+    try:
+        fn(*args)
+    finally:
+        for c in conns:
+            c.set_trace_callback(None)
+    return [s for s in stmts if s.split()[0].upper() in {"SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA"}]
+
+
+def bench_chatlog(n: int):
+    """Caller-side cost of logging n chat turns: one commit per row vs the batched sink."""
+    _fixture(n_users=1, apps_per_user=1)
+
+    def per_row(i):
+        c = models_db.con()
+        c.execute(
+            "INSERT INTO chat_logs (ts, surface, user_id, user_text, assistant_text) VALUES (?, ?, ?, ?, ?)",
+            (models_db.now(), "cli", None, f"question {i}", "answer"),
+        )
+        c.commit()
+        c.close()
+
+    for label, fn in (("insert + commit per row", per_row),
+                      ("batched log_chat", lambda i: db.log_chat(f"question {i}", "answer"))):
+        t0 = time.perf_counter()
+        for i in range(n):
+            fn(i)
+        caller = time.perf_counter() - t0
+        db.chat_log.flush()
+        total = time.perf_counter() - t0
+        print(f"{label:<26} caller {n / caller:9.0f} rows/s   until durable {n / total:9.0f} rows/s")
+    print(db.chat_log.stats())
+    count = models_db.con().execute("SELECT COUNT(*) FROM chat_logs").fetchone()[0]
+    assert count == 2 * n, count
+
+
+def count_queries():
+    """Statements per request for the application page, old call chain vs the aggregate read."""
+    import portal_tools
+
+    uids, app_ids = _fixture(n_users=1, apps_per_user=1)
+    app_id = app_ids[0]
+    for doc_type in ("Passport/ID", "Transcript"):
+        applications.add_document(app_id, doc_type, "f.pdf", "/tmp/f.pdf")
+    applications.add_decision_note(app_id, uids[0], "Under Review", "note")
+
+    def old_load_application():
+        level = applications.read_application(app_id)[0]
+        applications.list_documents(app_id)  # compute_progress_and_status
+        applications.update_application_status(app_id, "In Progress")  # written on every load
+        applications.list_documents(app_id)  # docs_text_and_delete_choices
+        applications.get_latest_decision_row(app_id)
+        return level
+
+    def new_load_application():
+        agg = applications.read_application_aggregate(app_id)
+        return agg["level"]  # status only written when it changes
+
+    def old_upload_doc_reads():
+        applications.read_application(app_id)  # lock check
+        applications.read_application(app_id)  # level after insert
+        applications.list_documents(app_id)
+        applications.update_application_status(app_id, "In Progress")
+
+    def new_upload_doc_reads():
+        applications.read_application_aggregate(app_id)
+        applications.read_required_counts(app_id)  # progress after the insert
+
+    def old_application_summary():
+        applications.read_application(app_id)
+        applications.list_documents(app_id)
+
+    for label, old, new in (
+        ("load_application", old_load_application, new_load_application),
+        ("upload_doc (excl. insert)", old_upload_doc_reads, new_upload_doc_reads),
+        ("application_summary", old_application_summary, lambda: portal_tools.application_summary(app_id)),
+    ):
+        before = len(_traced(old))
+        after = len(_traced(new))
+        print(f"{label:<28} before {before} statement(s), {before} connection(s)   after {after} on one connection")
+
+
+def bench_admin(n: int):
+    """Admin listing over n applications: whole table vs one keyset page."""
+    models_db.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    models_db.init_db_all()
+    statuses = ["In Progress", "Complete", "Submitted", "Approved", "Rejected"]
+    with models_db.transaction() as c:
+        c.executemany(
+            "INSERT INTO applications (user_id, created_ts, program_level, program_name, status) VALUES (?, ?, ?, ?, ?)",
+            [(i // 3 + 1, f"2025-{i % 12 + 1:02d}-01T00:00:00", ("Bachelor", "Master")[i % 2],
+              f"Programme {i % 17}", statuses[i % 5]) for i in range(n)],
+        )
+    models_db.con().execute("ANALYZE")
+
+    def timed(label, fn, repeat=20):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            out = fn()
+        ms = (time.perf_counter() - t0) / repeat * 1000
+        size = len(out["rows"]) if isinstance(out, dict) else out if isinstance(out, int) else len(out)
+        print(f"{label:<44} {ms:8.2f}ms  ({size} rows)" if not isinstance(out, int) else
+              f"{label:<44} {ms:8.2f}ms  (= {out})")
+
+    deep = applications.list_applications_page(before_id=n // 10)
+    print(f"{n} applications")
+    timed("list_all_applications (before)", applications.list_all_applications, repeat=5)
+    timed("first page", lambda: applications.list_applications_page())
+    timed("page deep in the table (before_id)", lambda: applications.list_applications_page(before_id=n // 10))
+    timed("previous page (after_id)", lambda: applications.list_applications_page(after_id=deep["rows"][0][0]))
+    timed("status=Submitted page", lambda: applications.list_applications_page(status="Submitted"))
+    timed("level+programme page", lambda: applications.list_applications_page(level="Master", programme="Programme 3"))
+    timed("date range page", lambda: applications.list_applications_page(created_from="2025-03-01",
+                                                                          created_to="2025-03-31"))
+    timed("count, no filter", lambda: applications.count_applications())
+    timed("count, status=Submitted", lambda: applications.count_applications(status="Submitted"))
+    timed("counts by status", lambda: len(applications.count_applications_by_status()))
+
+
+def bench_decisions(n: int):
+    """n admin decisions: one click each (status + note, two commits) vs one bulk transaction."""
+    uids, app_ids = _fixture(n_users=max(1, n // 5), apps_per_user=5)
+    app_ids = app_ids[:n]
+    admin = uids[0]
+
+    def one_by_one():
+        for app_id in app_ids:
+            applications.update_application_status(app_id, "Approved")
+            applications.add_decision_note(app_id, admin, "Approved", "batch review")
+
+    for label, fn in (
+        ("one at a time, pooled", one_by_one),
+        ("apply_decisions (bulk)", lambda: applications.apply_decisions(app_ids, admin, "Approved", "batch review")),
+    ):
+        t0 = time.perf_counter()
+        fn()
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"{label:<26} {n} decisions in {ms:8.1f}ms  ({n / ms * 1000:8.0f}/s)")
+
+    models_db.POOL_ENABLED = False
+    t0 = time.perf_counter()
+    one_by_one()
+    ms = (time.perf_counter() - t0) * 1000
+    models_db.POOL_ENABLED = True
+    print(f"{'one at a time, DB_POOL=0':<26} {n} decisions in {ms:8.1f}ms  ({n / ms * 1000:8.0f}/s)")
+
+    try:
+        applications.apply_decisions(app_ids + [10 ** 9], admin, "Rejected", "x")
+    except ValueError as e:
+        print(f"invalid batch rejected before any write: {e}")
+    rows = models_db.con().execute("SELECT COUNT(*) FROM application_decisions WHERE new_status = 'Rejected'").fetchone()
+    assert rows[0] == 0
+
+
+def bench_readonly(n: int, seconds: float = 2.0):
+    """
+    Student status writes while an admin scans the whole table, and the
+    snapshot copy idle vs under those writes.
+    """
+    models_db.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    models_db.init_db_all()
+    with models_db.transaction() as c:
+        c.executemany(
+            "INSERT INTO applications (user_id, created_ts, program_level, program_name, status) VALUES (?, ?, ?, ?, ?)",
+            [(i // 3 + 1, models_db.now(), "Bachelor", f"Programme {i % 17}", "In Progress") for i in range(n)],
+        )
+    print(f"{n} applications, {os.path.getsize(models_db.DB_PATH) / 1e6:.1f} MB")
+
+    def writes_during(background=None):
+        stop = threading.Event()
+        lat, scans = [], [0]
+
+        def admin():
+            while not stop.is_set():
+                background()
+                scans[0] += 1
+
+        t = threading.Thread(target=admin) if background else None
+        if t:
+            t.start()
+        t_end = time.perf_counter() + seconds
+        i = 0
+        while time.perf_counter() < t_end:
+            t0 = time.perf_counter()
+            applications.update_application_status(i % n + 1, ("Complete", "In Progress")[i % 2])
+            lat.append(time.perf_counter() - t0)
+            i += 1
+        stop.set()
+        if t:
+            t.join()
+        lat.sort()
+        return len(lat) / seconds, lat[len(lat) // 2] * 1000, lat[int(len(lat) * 0.99)] * 1000, scans[0]
+
+    for label, bg in (("no admin reads", None),
+                      ("list_all_applications loop", applications.list_all_applications),
+                      ("count_applications loop", applications.count_applications)):
+        rate, p50, p99, scans = writes_during(bg)
+        print(f"writes with {label:<28} {rate:8.0f}/s  p50 {p50:6.2f}ms  p99 {p99:6.2f}ms  ({scans} admin scans)")
+
+    try:
+        models_db.con_ro().execute("DELETE FROM applications")
+    except sqlite3.OperationalError as e:
+        print(f"write through con_ro() refused: {e}")
+
+    info = models_db.backup_snapshot()
+    print(f"snapshot, idle            {info['seconds'] * 1000:8.1f}ms  restarts {info['restarts']}")
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            applications.update_application_status(i % n + 1, "Complete")
+            i += 1
+
+    t = threading.Thread(target=writer)
+    t.start()
+    info = models_db.backup_snapshot()
+    stop.set()
+    t.join()
+    print(f"snapshot, under writes    {info['seconds'] * 1000:8.1f}ms  restarts {info['restarts']}"
+          f"{'  (finished in one step)' if info['single_step'] else ''}")
+    count = models_db.con_ro(info["path"]).execute("SELECT COUNT(*) FROM applications").fetchone()[0]
+    assert count == n, count
+
+
+def bench_deletes(n_apps: int, docs_per_app: int):
+    """Delete-all for n_apps applications: the old per-document loop vs one set-based transaction."""
+    import portal_tools
+
+    def old_delete_all(app_id):
+        # select ids, then per document: PRAGMA table_info + select path + delete, each on its own connection
+        def schema():
+            c = models_db.con()
+            c.execute("PRAGMA table_info(documents)").fetchall()
+            c.close()
+
+        schema()
+        c = models_db.con()
+        ids = [r[0] for r in c.execute("SELECT id FROM documents WHERE application_id = ?", (app_id,))]
+        c.close()
+        for doc_id in ids:
+            schema()
+            c = models_db.con()
+            path = c.execute("SELECT saved_path FROM documents WHERE id = ?", (doc_id,)).fetchone()[0]
+            c.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+            c.commit()
+            c.close()
+            os.remove(path)
+        return len(ids)
+
+    _uids, app_ids = _fixture(n_users=n_apps, apps_per_user=2)
+    upload_dir = tempfile.mkdtemp()
+
+    def fill(ids):
+        for app_id in ids:
+            for i in range(docs_per_app):
+                path = os.path.join(upload_dir, f"{app_id}_{i}.pdf")
+                with open(path, "wb") as f:
+                    f.write(b"%PDF-1.4 bench")
+                applications.add_document(app_id, f"Doc {i}", f"{i}.pdf", path)
+
+    old_ids, new_ids = app_ids[0::2], app_ids[1::2]
+    fill(old_ids)
+    fill(new_ids)
+    total = n_apps * docs_per_app
+    for label, fn, ids in (("per-document loop (before)", old_delete_all, old_ids),
+                           ("delete_all_docs_for_application", portal_tools.delete_all_docs_for_application, new_ids)):
+        c = models_db.con()
+        c.close()
+        trace = []
+        c.set_trace_callback(trace.append)
+        fn(ids[0])
+        c.set_trace_callback(None)
+        commits = sum(s == "COMMIT" for s in trace)
+        schema = sum(s.startswith("PRAGMA table_info") for s in trace)
+        t0 = time.perf_counter()
+        deleted = sum(fn(app_id) for app_id in ids[1:])
+        caller = time.perf_counter() - t0
+        portal_tools.wait_for_unlinks()
+        total_s = time.perf_counter() - t0
+        assert deleted == total - docs_per_app, deleted
+        print(f"{label:<32} per app: {commits:2d} commit(s), {schema:2d} table_info   caller {caller * 1000:8.1f}ms   "
+              f"files gone {total_s * 1000:8.1f}ms   ({deleted} documents)")
+    assert not os.listdir(upload_dir), os.listdir(upload_dir)
+    left = models_db.con().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    assert left == 0, left
+
+
+def _search_like(text: str, offset: int = 0, limit: int = 20):
+    """What a reviewer search costs without FTS: LIKE '%term%' over every source, newest first."""
+    like = f"%{text.strip()}%"
+    sql = """
+        SELECT * FROM (
+            SELECT 'applicant', a.id, u.id, u.full_name || ' ' || u.email FROM users u
+            LEFT JOIN applications a ON a.user_id = u.id WHERE u.full_name LIKE ?1 OR u.email LIKE ?1
+            UNION ALL
+            SELECT 'programme', a.id, a.user_id, a.program_name FROM applications a WHERE a.program_name LIKE ?1
+            UNION ALL
+            SELECT 'decision note', d.application_id, NULL, d.note FROM application_decisions d WHERE d.note LIKE ?1
+            UNION ALL
+            SELECT 'document', d.application_id, NULL, d.original_filename FROM documents d
+            WHERE d.original_filename LIKE ?1
+            UNION ALL
+            SELECT 'chat', NULL, c.user_id, c.user_text FROM chat_logs c
+            WHERE c.user_text LIKE ?1 OR c.assistant_text LIKE ?1
+        ) ORDER BY 1, 2 DESC LIMIT ?2 OFFSET ?3
+    """
+    c = models_db.con_ro()
+    rows = c.execute(sql, (like, limit + 1, offset)).fetchall()
+    c.close()
+    return {"rows": rows[:limit], "has_more": len(rows) > limit}
+
+
+def bench_search(n: int):
+    """Reviewer search over n applications (and as many documents, notes and chat turns): FTS5 vs LIKE."""
+    import random
+    import search
+
+    rnd = random.Random(7)
+    first = ["Anna", "Ben", "Chloé", "David", "Emma", "Farid", "Grace", "Hugo", "Ines", "Jonas", "Kwame", "Lena"]
+    last = ["Smith", "Müller", "Okafor", "Rossi", "Nguyen", "Dubois", "Kowalski", "Silva", "Jensen", "Haddad"]
+    words = ("transcript passport signature missing blurry deadline scholarship visa english "
+             "certificate portfolio recommendation interview funding housing").split()
+    models_db.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    models_db.init_db_all()
+    t0 = time.perf_counter()
+    n_users = max(1, n // 2)
+    with models_db.transaction() as c:
+        c.executemany(
+            "INSERT INTO users (created_ts, full_name, email, password_hash, password_salt) VALUES (?, ?, ?, '', '')",
+            [(models_db.now(), f"{rnd.choice(first)} {rnd.choice(last)}", f"student{i}@example.com")
+             for i in range(n_users)],
+        )
+        c.executemany(
+            "INSERT INTO applications (user_id, created_ts, program_level, program_name, status) "
+            "VALUES (?, ?, ?, ?, 'In Progress')",
+            [(i % n_users + 1, models_db.now(), "Bachelor", f"{programmes.BACHELOR_PROGRAMMES[i % 7]} {i}")
+             for i in range(n)],
+        )
+        c.executemany(
+            "INSERT INTO documents (application_id, uploaded_ts, doc_type, original_filename, saved_path) "
+            "VALUES (?, ?, 'Transcript', ?, '')",
+            [(i + 1, models_db.now(), f"{rnd.choice(words)}_{i}.pdf") for i in range(n)],
+        )
+        c.executemany(
+            "INSERT INTO application_decisions (application_id, admin_user_id, created_ts, new_status, note) "
+            "VALUES (?, 1, ?, 'Rejected', ?)",
+            [(i + 1, models_db.now(), " ".join(rnd.choices(words, k=8))) for i in range(0, n, 2)],
+        )
+        c.executemany(
+            "INSERT INTO chat_logs (ts, surface, user_id, user_text, assistant_text) VALUES (?, 'portal', ?, ?, ?)",
+            [(models_db.now(), i % n_users + 1, " ".join(rnd.choices(words, k=10)),
+              " ".join(rnd.choices(words, k=40))) for i in range(n)],
+        )
+    models_db.con().execute("ANALYZE")
+    print(f"{n} applications, {n_users} users, {n} documents, {n // 2} notes, {n} chat turns "
+          f"(loaded and indexed in {time.perf_counter() - t0:.1f}s, "
+          f"{os.path.getsize(models_db.DB_PATH) / 1e6:.0f} MB)")
+
+    def timed(fn, *args, repeat=5, **kw):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            out = fn(*args, **kw)
+        return (time.perf_counter() - t0) / repeat * 1000, out
+
+    for label, text, kw in (
+        ("rare name", "Chloé Okafor", {}),
+        ("email", "student4242@example.com", {}),
+        ("programme", programmes.BACHELOR_PROGRAMMES[3], {}),
+        ("common word, page 1", "passport", {}),
+        ("common word, page 25", "passport", {"offset": 24 * 20}),
+    ):
+        fts_ms, fts = timed(search.search, text, **kw)
+        like_ms, like = timed(_search_like, text, **kw)
+        print(f"{label:<22} fts {fts_ms:8.2f}ms ({len(fts['rows'])} hits)   "
+              f"LIKE scan {like_ms:8.2f}ms ({len(like['rows'])} hits)   x{like_ms / max(fts_ms, 1e-3):.0f}")
+
+
+def bench_blobs(n_students: int, mb: float, apps_per_student: int = 3):
+    """
+    Each student uploads the same passport and transcript to every one of
+    their applications: copy per upload vs the content-addressed store.
+    """
+    import shutil
+    import blobstore
+
+    _uids, app_ids = _fixture(n_users=n_students, apps_per_user=apps_per_student)
+    work = tempfile.mkdtemp()
+    src = {}
+    for s in range(n_students):
+        for doc in ("passport", "transcript"):
+            path = os.path.join(work, f"{doc}_{s}.pdf")
+            with open(path, "wb") as f:
+                f.write(os.urandom(int(mb * 1e6)))
+            src[(s, doc)] = path
+    uploads = [(app_id, doc, src[(i // apps_per_student, doc)])
+               for i, app_id in enumerate(app_ids) for doc in ("passport", "transcript")]
+
+    def disk(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+
+    old_root = os.path.join(work, "copies")
+
+    def copy_each():
+        for app_id, doc, path in uploads:
+            dest_dir = os.path.join(old_root, f"app_{app_id}")
+            os.makedirs(dest_dir, exist_ok=True)
+            dest = os.path.join(dest_dir, os.path.basename(path))
+            shutil.copy(path, dest)
+            applications.add_document(app_id, doc, os.path.basename(path), dest)
+
+    def blobs():
+        for app_id, doc, path in uploads:
+            blobstore.add_document(app_id, doc, os.path.basename(path), path)
+
+    blobstore.BLOB_ROOT = os.path.join(work, "blobs")
+    print(f"{len(uploads)} uploads of {mb} MB ({n_students} students x {apps_per_student} applications x 2)")
+    for label, fn, root in (("shutil.copy per upload", copy_each, old_root),
+                            ("content-addressed store", blobs, blobstore.BLOB_ROOT)):
+        t0 = time.perf_counter()
+        fn()
+        s = time.perf_counter() - t0
+        print(f"{label:<26} {s * 1000:8.1f}ms  {len(uploads) / s:7.1f} uploads/s  on disk {disk(root) / 1e6:8.1f} MB")
+    c = models_db.con()
+    blobs_n, refs = c.execute("SELECT COUNT(*), SUM(refcount) FROM blobs").fetchone()
+    print(f"{blobs_n} blobs, {refs} references")
+    assert blobs_n == 2 * n_students and refs == len(uploads)
+
+
+def bench_ingest(n_files: int, workers: int):
+    """
+    n_files uploads of 1-50 MB through `workers` concurrent handler threads
+    (Gradio runs sync handlers on a thread pool). Worker occupancy is the
+    time a handler holds its thread.
+    """
+    import random
+    import shutil
+    import statistics
+    from concurrent.futures import ThreadPoolExecutor
+
+    import blobstore
+
+    rnd = random.Random(3)
+    sizes = [rnd.randint(1, 50) for _ in range(n_files)]
+    _uids, app_ids = _fixture(n_users=1, apps_per_user=n_files)
+    work = tempfile.mkdtemp()
+    other_fs = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    srcs = {}
+    for where, root in (("same filesystem", work), ("other filesystem", other_fs)):
+        if root is None:
+            continue
+        d = tempfile.mkdtemp(dir=root)
+        srcs[where] = []
+        for i, mb in enumerate(sizes):
+            path = os.path.join(d, f"scan_{i}.pdf")
+            with open(path, "wb") as f:
+                f.write(os.urandom(mb << 20))
+            srcs[where].append(path)
+    total_mb = sum(sizes)
+
+    def legacy(i, src):
+        dest_dir = os.path.join(work, "legacy", f"app_{app_ids[i]}")
+        os.makedirs(dest_dir, exist_ok=True)
+        dest = os.path.join(dest_dir, os.path.basename(src))
+        shutil.copy(src, dest)
+        applications.add_document(app_ids[i], "Scan", os.path.basename(src), dest)
+
+    def ingest_only(i, src):
+        dest_dir = os.path.join(blobstore.BLOB_ROOT, f"app_{app_ids[i]}")
+        os.makedirs(dest_dir, exist_ok=True)
+        dest = os.path.join(dest_dir, os.path.basename(src))
+        blobstore.ingest_file(src, dest, blobstore.MAX_UPLOAD_BYTES)
+        applications.add_document(app_ids[i], "Scan", os.path.basename(src), dest)
+
+    def blob(i, src):
+        blobstore.add_document(app_ids[i], "Scan", os.path.basename(src), src)
+
+    def run(label, fn, files):
+        held = []
+
+        def handler(i):
+            t0 = time.perf_counter()
+            fn(i, files[i])
+            held.append(time.perf_counter() - t0)
+
+        blobstore.BLOB_ROOT = tempfile.mkdtemp(dir=work)  # no dedup across runs
+        os.sync()  # the last run's writeback must not slow this one
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(handler, range(len(files))))
+        wall = time.perf_counter() - t0
+        held.sort()
+        print(f"{label:<44} {total_mb / wall:7.0f} MB/s   worker held mean {statistics.mean(held) * 1000:7.1f}ms "
+              f"p95 {held[int(len(held) * 0.95)] * 1000:7.1f}ms   busy {sum(held) / (workers * wall):4.0%}")
+
+    print(f"{n_files} uploads, {total_mb} MB total, {workers} workers")
+    for where, files in srcs.items():
+        run(f"shutil.copy ({where})", legacy, files)
+        run(f"ingest_file, no hash ({where})", ingest_only, files)
+        run(f"blobstore.add_document ({where})", blob, files)
+        methods = {}
+        for f in files[:3]:
+            dest = os.path.join(work, "probe")
+            methods[blobstore.ingest_file(f, dest)] = True
+            os.remove(dest)
+        print(f"{'':<44} ingest method: {', '.join(methods)}")
+    for where in srcs:
+        shutil.rmtree(os.path.dirname(srcs[where][0]), ignore_errors=True)
+
+    big = os.path.join(work, "too_big.pdf")
+    with open(big, "wb") as f:
+        f.truncate(blobstore.MAX_UPLOAD_BYTES + 1)
+    try:
+        blobstore.add_document(app_ids[0], "Scan", "too_big.pdf", big)
+    except ValueError as e:
+        print(f"over the cap: {e}")
+
+
+def _scan_pdf(path: str, pages: int, image_mb: float, seed: int) -> None:
+    """A scanned-looking PDF: a JPEG per page plus a compressed text layer."""
+    import zlib
+
+    objs = [b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Count %d >>" % pages]
+    image = b"\xff\xd8\xff\xe0" + os.urandom(max(1, int(image_mb * (1 << 20) / pages)))
+    for p in range(pages):
+        words = b" ".join(b"(grade %d course %d credit %d) Tj T*" % (seed, p, i) for i in range(2000))
+        content = zlib.compress(b"BT /F1 10 Tf 40 800 Td " + words + b" ET")
+        objs.append(b"<< /Type /Page /Parent 2 0 R >>")
+        objs.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream")
+        objs.append(b"<< /Type /XObject /Subtype /Image /Filter /DCTDecode /Length %d >>\nstream\n" % len(image)
+                    + image + b"\nendstream")
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.5\n")
+        for i, o in enumerate(objs):
+            f.write(b"%d 0 obj\n" % (i + 1) + o + b"\nendobj\n")
+        f.write(b"%%EOF\n")
+
+
+def bench_jobs(n_files: int, mb: float, processes: int):
+    """
+    Post-upload checks on n_files scanned PDFs: inline in the upload handler
+    vs queued for the jobs runner, jobs/s by pool size, restart recovery.
+    """
+    import socket
+    import shutil
+
+    import blobstore
+    import doc_processing
+    import jobs
+
+    _uids, app_ids = _fixture(n_users=1, apps_per_user=1)
+    work = tempfile.mkdtemp()
+    blobstore.UPLOAD_ROOT = work
+    files = []
+    for i in range(n_files):
+        path = os.path.join(work, f"scan_{i}.pdf")
+        _scan_pdf(path, pages=8, image_mb=mb, seed=i)
+        files.append(path)
+
+    def uploads(label, inline):
+        blobstore.BLOB_ROOT = tempfile.mkdtemp(dir=work)
+        blobstore.ARTIFACT_ROOT = tempfile.mkdtemp(dir=work)
+        c = models_db.con()
+        c.execute("DELETE FROM jobs")
+        c.commit()
+        c.close()
+        held = []
+        for path in files:
+            t0 = time.perf_counter()
+            doc_id = blobstore.add_document(app_ids[0], "Scan", os.path.basename(path), path)
+            if inline:
+                sha = blobstore.hash_file(path)[0]
+                doc_processing.verdict(
+                    doc_processing.process(blobstore.blob_path(sha), blobstore.artifact_dir(sha, doc_id)), path)
+            else:
+                jobs.notify()
+            held.append(time.perf_counter() - t0)
+        held.sort()
+        print(f"upload handler, {label:<22} mean {sum(held) / len(held) * 1000:7.1f}ms   "
+              f"p95 {held[int(len(held) * 0.95)] * 1000:7.1f}ms")
+
+    print(f"{n_files} scanned PDFs, {os.path.getsize(files[0]) / 1e6:.1f} MB each, 8 pages")
+    uploads("checks inline", inline=True)
+    uploads("checks queued", inline=False)
+
+    for procs in sorted({0, 1, processes}):
+        blobstore.ARTIFACT_ROOT = tempfile.mkdtemp(dir=work)  # nothing to reuse
+        c = models_db.con()
+        c.execute("UPDATE jobs SET state = 'queued', attempts = 0, run_after = 0")
+        c.commit()
+        c.close()
+        t0 = time.perf_counter()
+        counts = jobs.run_until_idle(procs)
+        wall = time.perf_counter() - t0
+        print(f"runner, {procs} process(es){' (in-thread)' if not procs else '':<12} "
+              f"{(counts['done'] + counts['invalid']) / wall:7.1f} jobs/s   {counts}")
+
+    # A worker that died mid-job: its rows stay 'running' until recover().
+    c = models_db.con()
+    c.execute("UPDATE jobs SET state = 'running', worker = ?, lease_until = ?",
+              (f"{socket.gethostname()}:{2 ** 22 + 1}", time.time() + 3600))
+    c.execute("UPDATE documents SET processing_state = 'processing'")
+    c.commit()
+    c.close()
+    print(f"recover(): {jobs.recover()} job(s) of a dead worker requeued; "
+          f"after run_until_idle: {jobs.run_until_idle(processes)['reused']} finished (artifacts reused), "
+          f"queue {jobs.queue_stats()}")
+    shutil.rmtree(work, ignore_errors=True)
+
+
+def bench_export(n_apps: int, docs_per_app: int, mb: float):
+    """
+    ZIP export of n_apps applications: the archive built in memory (what
+    gr.File download of one ZIP would need) vs export.stream_zip.
+    Peak is Python heap (tracemalloc).
+    """
+    import io
+    import shutil
+    import zipfile
+    import tracemalloc
+
+    import blobstore
+    import export
+
+    _uids, app_ids = _fixture(n_users=1, apps_per_user=n_apps)
+    work = tempfile.mkdtemp()
+    blobstore.BLOB_ROOT = os.path.join(work, "blobs")
+    src = os.path.join(work, "scan.pdf")
+    for app_id in app_ids:
+        for d in range(docs_per_app):
+            with open(src, "wb") as f:
+                f.write(os.urandom(int(mb * (1 << 20))))
+            blobstore.add_document(app_id, "Transcript", f"scan_{d}.pdf", src)
+    total_mb = n_apps * docs_per_app * mb
+
+    def in_memory():
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zf:
+            for app_id in app_ids:
+                for doc_id, doc_type, fname, path, *_rest in applications.list_documents(app_id):
+                    zf.write(path, f"app_{app_id}/{doc_id}_{fname}")
+        return len(buf.getvalue())
+
+    def streamed():
+        n = 0
+        with open(os.devnull, "wb") as out:
+            for piece in export.stream_zip(app_ids):
+                out.write(piece)
+                n += len(piece)
+        return n
+
+    print(f"{n_apps} applications x {docs_per_app} documents of {mb:g} MB = {total_mb:.0f} MB")
+    for label, fn in (("zipfile into BytesIO", in_memory), ("export.stream_zip", streamed)):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        size = fn()
+        wall = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:<22} {size / 1e6:8.1f} MB archive   {total_mb / wall:7.0f} MB/s   peak {peak / 1e6:8.1f} MB")
+
+    first = time.perf_counter()
+    next(iter(export.stream_zip(app_ids)))
+    print(f"first bytes of the stream after {(time.perf_counter() - first) * 1000:.1f}ms")
+    path = os.path.join(work, "check.zip")
+    with open(path, "wb") as f:
+        for piece in export.stream_zip(app_ids[:2]):
+            f.write(piece)
+    with zipfile.ZipFile(path) as z:
+        print(f"2-application archive: {len(z.namelist())} entries, testzip: {z.testzip() or 'ok'}")
+    shutil.rmtree(work, ignore_errors=True)
+
+
+def bench_reconcile(n_files: int):
+    """
+    Reconciling n_files upload files (80% pre-blob-store paths, 20% blobs;
+    1% of each orphaned, 1% of rows dangling): the obvious scripts vs
+    reconcile.run. Peak is Python heap (tracemalloc), measured in a second pass.
+    """
+    import hashlib
+    import shutil
+    import tracemalloc
+
+    import blobstore
+    import reconcile
+
+    _uids, app_ids = _fixture(n_users=n_files // 3000 + 1, apps_per_user=6)  # 500 files per application
+    root = tempfile.mkdtemp()
+    blobstore.BLOB_ROOT = os.path.join(root, "blobs")
+    blobstore.ARTIFACT_ROOT = os.path.join(root, "artifacts")
+    docs, blobs = [], []
+    t0 = time.perf_counter()
+    for i in range(n_files):
+        if i % 5:
+            path = os.path.join(root, f"app_{i // 500}", f"doc_{i}.pdf")
+            sha = None
+        else:
+            sha = hashlib.sha256(str(i).encode()).hexdigest()
+            path = blobstore.blob_path(sha)
+            if i % 100:
+                blobs.append((sha, 0, "t"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+        if i % 100 != 0:
+            docs.append((app_ids[i // 500], "t", "Scan", f"doc_{i}.pdf", path, sha))
+        if i % 100 == 1:
+            docs.append((app_ids[i // 500], "t", "Scan", "gone.pdf", path + ".gone", None))
+    with models_db.transaction() as c:
+        c.executemany("INSERT INTO blobs (sha256, size, created_ts) VALUES (?, ?, ?)", blobs)
+        c.executemany(
+            "INSERT INTO documents (application_id, uploaded_ts, doc_type, original_filename, saved_path, blob_sha256) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            docs,
+        )
+    print(f"{n_files} files, {len(docs)} document rows (fixture {time.perf_counter() - t0:.1f}s)")
+
+    def walk_files():
+        for dirpath, _dirs, names in os.walk(root):
+            for name in names:
+                yield os.path.join(dirpath, name)
+
+    def all_paths_in_memory():
+        c = models_db.con_ro()
+        known = {r[0] for r in c.execute("SELECT saved_path FROM documents")}
+        c.close()
+        return sum(1 for p in walk_files() if p not in known)
+
+    def query_per_file():
+        c = models_db.con_ro()
+        orphans = sum(1 for p in walk_files()
+                      if not c.execute("SELECT 1 FROM documents WHERE saved_path = ?", (p,)).fetchone())
+        c.close()
+        return orphans
+
+    def incremental():
+        return reconcile.run(root, resume=False, grace_s=0)["orphans"]
+
+    for label, fn in (("saved_path set in memory + os.walk", all_paths_in_memory),
+                      ("one query per file", query_per_file),
+                      ("reconcile.run (batches of 1000)", incremental)):
+        t0 = time.perf_counter()
+        orphans = fn()
+        wall = time.perf_counter() - t0
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:<36} {n_files / wall:9.0f} files/s   {orphans:6d} orphans   peak {peak / 1e6:6.1f} MB")
+
+    slices, t0 = 0, time.perf_counter()
+    reconcile.run(root, resume=False, grace_s=0, time_budget_s=1e-9)
+    while True:
+        slices += 1
+        stats = reconcile.run(root, grace_s=0, time_budget_s=0.25)
+        if stats["phase"] == "done":
+            break
+    print(f"in {slices + 1} slices of 0.25s (resumed from the checkpoint): {time.perf_counter() - t0:.2f}s, "
+          f"{stats['orphans']} orphans, {stats['dangling']} dangling rows, {stats['files']} files")
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("scenario", choices=["pool", "chatlog", "queries", "admin", "decisions", "readonly", "deletes", "search", "blobs", "ingest", "jobs", "export", "reconcile"])
+    p.add_argument("-n", type=int, default=5000)
+    p.add_argument("--threads", type=int, default=4)
+    p.add_argument("--docs", type=int, default=20)
+    p.add_argument("--mb", type=float, default=2)
+    args = p.parse_args()
+    if args.scenario == "pool":
+        bench_pool(args.n, args.threads)
+    elif args.scenario == "chatlog":
+        bench_chatlog(args.n)
+    elif args.scenario == "queries":
+        count_queries()
+    elif args.scenario == "admin":
+        bench_admin(args.n)
+    elif args.scenario == "decisions":
+        bench_decisions(args.n)
+    elif args.scenario == "readonly":
+        bench_readonly(args.n)
+    elif args.scenario == "deletes":
+        bench_deletes(args.n, args.docs)
+    elif args.scenario == "search":
+        bench_search(args.n)
+    elif args.scenario == "blobs":
+        bench_blobs(args.n, args.mb)
+    elif args.scenario == "ingest":
+        bench_ingest(args.n, args.threads)
+    elif args.scenario == "jobs":
+        bench_jobs(args.n, args.mb, args.threads)
+    elif args.scenario == "export":
+        bench_export(args.n, args.docs, args.mb)
+    elif args.scenario == "reconcile":
+        bench_reconcile(args.n)
+
+
+if __name__ == "__main__":
+    main()
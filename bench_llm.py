@@ -0,0 +1,266 @@
+"""
+Offline LLM benchmarks against llm_stub_server (no Ollama needed).
+
+    python bench_llm.py backends [-n 20]
+    python bench_llm.py burst [-n 40]
+    python bench_llm.py async [-n 32] [--pool 8]
+    python bench_llm.py routed [-n 60]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import ai
+import auth
+import applications
+import llm_stub_server
+import models_db
+
+STUB_CLI = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_stub_server.py"), "--cli"]
+
+
+def _single_model(workers: int, max_queue: int, name: str = "full"):
+    ai._schedulers.clear()
+    ai.router.path = None
+    ai.router.load({
+        "default": name,
+        "routes": {name: {"model": ai.MODEL_NAME, "max_concurrency": workers, "max_queue": max_queue}},
+        "rules": [],
+    })
+
+
+def _timed(fn, n: int):
+    lat = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        fn(i)
+        lat.append(time.perf_counter() - t0)
+    return lat
+
+
+def _report(label: str, lat):
+    lat = sorted(lat)
+    p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+    print(f"{label:<28} n={len(lat):<4} mean={statistics.mean(lat) * 1000:8.1f}ms  p95={p95 * 1000:8.1f}ms")
+
+
+def bench_backends(n: int):
+    srv, host = llm_stub_server.start_in_thread()
+    try:
+        sub = ai.SubprocessBackend(cmd=STUB_CLI)
+        http = ai.HttpBackend(host=host)
+
+        def answer(backend, text):
+            return "".join(backend.stream(ai.build_prompt(text), ai.MODEL_NAME)).strip()
+
+        # Same answer from both paths.
+        a = answer(sub, "What documents do I need?")
+        b = answer(http, "What documents do I need?")
+        assert a == b, (a, b)
+
+        _report("subprocess (ollama run)", _timed(lambda i: answer(sub, f"q{i}"), n))
+        _report("http keep-alive pool", _timed(lambda i: answer(http, f"q{i}"), n))
+
+        # Server down -> ask_llm falls back to the CLI path.
+        ai._http_backend = ai.HttpBackend(host="127.0.0.1:9")
+        ai._subprocess_backend = sub
+        assert ai.ask_llm("fallback check").startswith("Stub answer")
+        print("fallback to subprocess: ok")
+    finally:
+        srv.shutdown()
+
+
+def bench_burst(n: int):
+    """A deadline-day burst: n callers, mostly the same few questions."""
+    srv, host = llm_stub_server.start_in_thread()
+    try:
+        ai._http_backend = ai.HttpBackend(host=host)
+        _single_model(workers=2, max_queue=8)
+        questions = ["What documents do I need?", "what documents do I need", "Deadline?", "Is IELTS required?"]
+        results = {"ok": 0, "busy": 0}
+        lat = []
+        lock = threading.Lock()
+
+        def one(i):
+            t0 = time.perf_counter()
+            try:
+                ai.ask_llm(questions[i % len(questions)], surface="portal" if i % 3 == 0 else "public")
+                outcome = "ok"
+            except ai.LLMBusy:
+                outcome = "busy"
+            with lock:
+                results[outcome] += 1
+                lat.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=one, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+        _report("burst callers", lat)
+        print(f"wall={wall * 1000:.0f}ms results={results} stub_requests={srv.RequestHandlerClass.state.requests}")
+        print(ai.scheduler_stats())
+    finally:
+        srv.shutdown()
+
+
+def _temp_db():
+    # Keeps llm_calls rows (and everything else) out of the real app.db.
+    models_db.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    models_db.init_db_all()
+
+
+def _db_fixture(n_apps: int = 20) -> int:
+    _temp_db()
+    uid = auth.register_user("Bench User", "bench@example.com", "pw")
+    for i in range(n_apps):
+        applications.create_application(uid, "Bachelor", f"Programme {i}")
+    return uid
+
+
+def _db_only_handler(uid: int):
+    # What "Refresh" / "Load application" cost without any LLM work.
+    rows = applications.list_applications(uid)
+    applications.read_application(rows[0][0])
+    applications.list_documents(rows[0][0])
+
+
+def bench_async(n_chats: int, pool: int, n_db: int = 50):
+    """
+    p99 of DB-only handlers while n_chats are waiting on the model, with a
+    Gradio-like worker pool of `pool` threads. Before: chats block a worker
+    for the whole generation. After: chats are coroutines.
+    """
+    srv, host = llm_stub_server.start_in_thread(token_delay_s=0.01)
+    uid = _db_fixture()
+    ai._http_backend = ai.HttpBackend(host=host)
+
+    def reset_scheduler():
+        _single_model(workers=2, max_queue=n_chats + 1)
+
+    def run_db_calls(submit):
+        lat = []
+        for _ in range(n_db):
+            t0 = time.perf_counter()
+            submit()
+            lat.append(time.perf_counter() - t0)
+            time.sleep(0.01)
+        return lat
+
+    try:
+        reset_scheduler()
+        with ThreadPoolExecutor(max_workers=pool) as ex:
+            chats = [ex.submit(ai.ask_llm, f"sync question {i}", "portal") for i in range(n_chats)]
+            time.sleep(0.05)
+            before = run_db_calls(lambda: ex.submit(_db_only_handler, uid).result())
+            for f in chats:
+                f.result()
+
+        reset_scheduler()
+
+        async def after_run():
+            loop = asyncio.get_running_loop()
+            ex = ThreadPoolExecutor(max_workers=pool)
+            chats = [asyncio.create_task(ai.ask_llm_async(f"async question {i}", "portal")) for i in range(n_chats)]
+            await asyncio.sleep(0.05)
+            lat = []
+            for _ in range(n_db):
+                t0 = time.perf_counter()
+                await loop.run_in_executor(ex, _db_only_handler, uid)
+                lat.append(time.perf_counter() - t0)
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*chats)
+            ex.shutdown()
+            return lat
+
+        after = asyncio.run(after_run())
+        print(f"{n_chats} chats in flight, {pool} worker threads")
+        for label, lat in (("db handler, sync chats", before), ("db handler, async chats", after)):
+            lat = sorted(lat)
+            p99 = lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+            print(f"{label:<28} p50={lat[len(lat) // 2] * 1000:8.1f}ms  p99={p99 * 1000:8.1f}ms")
+    finally:
+        srv.shutdown()
+
+
+def bench_routed(n: int):
+    """
+    Mixed traffic: 2/3 short public questions, 1/3 long portal prompts.
+    Single model (llama3, 2 slots) vs routed (short -> small model, 4 slots).
+    """
+    srv, host = llm_stub_server.start_in_thread(load_delay_s=0, token_delay_s=0.01)
+    ai._http_backend = ai.HttpBackend(host=host, pool_size=8)
+    context = "Application context:\n" + "- Uploaded: Passport/ID, Transcript\n" * 20
+
+    def workload(i):
+        if i % 3 == 2:
+            return "portal", context + f"User: long question {i}\nAssistant:"
+        return "public", f"Deadline for programme {i}?"
+
+    def run(label):
+        lat = {"public": [], "portal": []}
+        lock = threading.Lock()
+
+        def one(i):
+            surface, text = workload(i)
+            t0 = time.perf_counter()
+            ai.ask_llm(text, surface=surface)
+            with lock:
+                lat[surface].append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=one, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+        print(f"{label}: {n / wall:.1f} answers/s, wall {wall:.2f}s")
+        for surface, values in lat.items():
+            _report(f"  {surface}", values)
+
+    try:
+        _single_model(workers=2, max_queue=n)
+        run("single model")
+
+        ai._schedulers.clear()
+        ai.router.load({
+            "default": "full",
+            "routes": {
+                "full": {"model": ai.MODEL_NAME, "max_concurrency": 2, "max_queue": n},
+                "fast": {"model": "llama3.2:1b", "max_concurrency": 4, "max_queue": n},
+            },
+            "rules": [{"route": "fast", "surfaces": ["public"], "intents": ["GENERAL"], "max_prompt_chars": 400}],
+        })
+        run("routed")
+    finally:
+        srv.shutdown()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("scenario", choices=["backends", "burst", "async", "routed"])
+    p.add_argument("-n", type=int, default=20)
+    p.add_argument("--pool", type=int, default=8)
+    args = p.parse_args()
+    _temp_db()
+    if args.scenario == "backends":
+        bench_backends(args.n)
+    elif args.scenario == "burst":
+        bench_burst(args.n)
+    elif args.scenario == "async":
+        bench_async(args.n, args.pool)
+    elif args.scenario == "routed":
+        bench_routed(args.n)
+
+
+if __name__ == "__main__":
+    main()
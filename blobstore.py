@@ -0,0 +1,300 @@
+"""
+Content-addressed document storage: every upload is hashed (SHA-256) while
+it is read, stored once under its hash, and shared by all documents rows
+with the same content. blobs.refcount is kept by triggers on documents
+(models_db migration 6); a blob file goes when its last row does.
+"""
+import os
+import json
+import mmap
+import errno
+import uuid
+import shutil
+import hashlib
+from typing import List, Optional, Tuple
+
+from models_db import con, now, transaction
+
+UPLOAD_ROOT = os.environ.get("UPLOAD_ROOT", "uploads")
+BLOB_ROOT = os.environ.get("BLOB_ROOT", os.path.join(UPLOAD_ROOT, "blobs"))
+# Derived files (doc_processing): one directory per blob, shared like the blob.
+ARTIFACT_ROOT = os.environ.get("ARTIFACT_ROOT", os.path.join(UPLOAD_ROOT, "artifacts"))
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+CHUNK = 256 << 10  # hashed while still in the CPU cache
+COPY_CHUNK = 8 << 20  # per copy_file_range / sendfile call
+
+
+def _tmp_dir() -> str:
+    path = os.path.join(BLOB_ROOT, "tmp")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(BLOB_ROOT, sha256[:2], sha256)
+
+
+def artifact_dir(sha256: Optional[str], doc_id: int = None) -> str:
+    """Per content for blob-store rows; per document for rows from before it."""
+    return os.path.join(ARTIFACT_ROOT, sha256 if sha256 else f"doc-{int(doc_id)}")
+
+
+def is_blob_path(path: str) -> bool:
+    root = os.path.abspath(BLOB_ROOT) + os.sep
+    return os.path.abspath(path or "").startswith(root)
+
+
+def _too_large(max_bytes: int) -> ValueError:
+    return ValueError(f"File is larger than the {max_bytes / (1024 * 1024):.0f} MB upload limit.")
+
+
+def hash_file(path: str, max_bytes: int = None) -> Tuple[str, int]:
+    """SHA-256 of a mapping of the file, so the bytes are not copied first; ValueError past max_bytes."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if max_bytes and size > max_bytes:
+            raise _too_large(max_bytes)
+        if not size:
+            return hashlib.sha256().hexdigest(), 0
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as m:
+            return hashlib.sha256(m).hexdigest(), size
+
+
+def _copy_hashed(src_path: str, dest_path: str, max_bytes: int = None) -> Tuple[str, int]:
+    """Copies src to dest (which must not exist), hashing each CHUNK of a mapping of src as it is written."""
+    h = hashlib.sha256()
+    with open(src_path, "rb") as src, open(dest_path, "xb") as dst:
+        size = os.fstat(src.fileno()).st_size
+        if max_bytes and size > max_bytes:
+            raise _too_large(max_bytes)
+        if size:
+            with mmap.mmap(src.fileno(), size, access=mmap.ACCESS_READ) as m, memoryview(m) as view:
+                for pos in range(0, size, CHUNK):
+                    with view[pos:pos + CHUNK] as part:
+                        h.update(part)
+                        dst.write(part)
+    return h.hexdigest(), size
+
+
+def _kernel_copy(src_fd: int, dst_fd: int, max_bytes: int = None) -> str:
+    """Copies src to dst in COPY_CHUNK steps without passing the bytes through Python."""
+    copied = 0
+    for method in ("copy_file_range", "sendfile", "read/write"):
+        try:
+            while True:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(src_fd, dst_fd, COPY_CHUNK)
+                elif method == "sendfile":
+                    n = os.sendfile(dst_fd, src_fd, None, COPY_CHUNK)
+                else:
+                    chunk = os.read(src_fd, CHUNK)
+                    n = os.write(dst_fd, chunk) if chunk else 0
+                if not n:
+                    return method
+                copied += n
+                if max_bytes and copied > max_bytes:
+                    raise _too_large(max_bytes)
+        except (AttributeError, OSError) as e:
+            # Not offered here (EXDEV, EINVAL, ENOSYS...): the offsets have
+            # moved by `copied`, so the next method carries on from there.
+            if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                                                            errno.EOPNOTSUPP, errno.EBADF, errno.EPERM):
+                raise
+    raise OSError("no copy method worked")
+
+
+def ingest_file(src_path: str, dest_path: str, max_bytes: int = None, link: bool = True) -> str:
+    """
+    Puts the bytes of src_path at dest_path (which must not exist) without a
+    userspace copy where possible: a hard link when both are on the same
+    filesystem, else a kernel-side copy_file_range/sendfile. The source is
+    left in place (Gradio still owns its temp file) and must not be written
+    to afterwards, since a link shares its bytes. Returns the method used.
+    """
+    if max_bytes and os.path.getsize(src_path) > max_bytes:
+        raise _too_large(max_bytes)
+    if link:
+        try:
+            os.link(src_path, dest_path)
+            return "link"
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+                raise
+    try:
+        with open(src_path, "rb") as src, open(dest_path, "xb") as dst:
+            return _kernel_copy(src.fileno(), dst.fileno(), max_bytes)
+    except BaseException:
+        try:
+            os.remove(dest_path)
+        except OSError:
+            pass
+        raise
+
+
+def stage(src_path: str, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, int, Optional[str]]:
+    """
+    Puts src_path in a temp file next to the blobs and hashes it, reading
+    the bytes once: a hard link hashed afterwards on the same filesystem,
+    else a copy hashed chunk by chunk. Returns (sha256, size, staged temp
+    path, or None when that content is stored already); commit_blob()
+    moves the temp file into place.
+    """
+    if max_bytes and os.path.getsize(src_path) > max_bytes:
+        raise _too_large(max_bytes)
+    tmp = os.path.join(_tmp_dir(), uuid.uuid4().hex)
+    try:
+        try:
+            os.link(src_path, tmp)
+            sha, size = hash_file(tmp, max_bytes)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+                raise
+            sha, size = _copy_hashed(src_path, tmp, max_bytes)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    if os.path.exists(blob_path(sha)):
+        os.remove(tmp)
+        return sha, size, None
+    return sha, size, tmp
+
+
+def commit_blob(c, sha256: str, size: int, staged: Optional[str], src_path: str = None) -> str:
+    """
+    Inside the transaction that inserts the documents row. Deleters take the
+    same write lock before removing a blob, so a file seen here stays.
+    """
+    c.execute(
+        "INSERT INTO blobs (sha256, size, refcount, created_ts) VALUES (?, ?, 0, ?) ON CONFLICT DO NOTHING",
+        (sha256, int(size), now()),
+    )
+    final = blob_path(sha256)
+    if not os.path.exists(final):
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        if staged:
+            os.replace(staged, final)
+        else:  # removed by a delete since stage() looked
+            ingest_file(src_path, final)
+    return final
+
+
+def add_document(app_id: int, doc_type: str, original_filename: str, src_path: str) -> int:
+    sha, size, staged = stage(src_path)
+    try:
+        with transaction() as c:
+            final = commit_blob(c, sha, size, staged, src_path)
+            cur = c.execute(
+                """
+                INSERT INTO documents (application_id, uploaded_ts, doc_type, original_filename, saved_path, blob_sha256)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (int(app_id), now(), doc_type, original_filename, final, sha),
+            )
+            return int(cur.lastrowid)
+    finally:
+        if staged and os.path.exists(staged):
+            os.remove(staged)
+
+
+def release(c, shas) -> List[str]:
+    """
+    Call last inside the transaction that deleted documents rows: drops the
+    blobs among `shas` that lost their last reference and moves their files
+    aside. Pass the result to purge() after commit, restore() on failure.
+    If release() itself fails, it puts back the files it had moved.
+    """
+    shas = sorted({s for s in shas if s})
+    if not shas:
+        return []
+    gone = [r[0] for r in c.execute(
+        "SELECT sha256 FROM blobs WHERE refcount <= 0 AND sha256 IN (SELECT value FROM json_each(?))",
+        (json.dumps(shas),),
+    )]
+    trashed = []
+    try:
+        for sha in gone:
+            c.execute("DELETE FROM blobs WHERE sha256 = ?", (sha,))
+            trash = os.path.join(_tmp_dir(), f"{sha}.deleted")
+            try:
+                os.replace(blob_path(sha), trash)
+                trashed.append(trash)
+            except FileNotFoundError:
+                pass
+    except BaseException:
+        restore(trashed)  # the caller's transaction rolls back; the rows need their files
+        raise
+    return trashed
+
+
+def restore(trashed: List[str]) -> None:
+    for trash in trashed:
+        sha = os.path.basename(trash).split(".")[0]
+        if not os.path.exists(blob_path(sha)):
+            os.replace(trash, blob_path(sha))
+
+
+def purge(trashed: List[str]) -> None:
+    for trash in trashed:
+        sha = os.path.basename(trash).split(".")[0]
+        shutil.rmtree(os.path.join(BLOB_ROOT, "named", sha), ignore_errors=True)
+        shutil.rmtree(artifact_dir(sha), ignore_errors=True)
+        try:
+            os.remove(trash)
+        except OSError:
+            pass
+
+
+def named_path(saved_path: str, filename: str) -> str:
+    """A hard link to the blob under its original filename, for downloads."""
+    if not is_blob_path(saved_path):
+        return saved_path
+    sha = os.path.basename(saved_path)
+    name = os.path.basename(filename or "") or sha
+    path = os.path.join(BLOB_ROOT, "named", sha, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(saved_path, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(saved_path, path)
+    return path
+
+
+def adopt_legacy_documents() -> dict:
+    """
+    Moves the files of documents rows written before the blob store
+    (blob_sha256 IS NULL) into it. Rows whose file is missing are left alone.
+    """
+    c = con()
+    paths = [r[0] for r in c.execute("SELECT DISTINCT saved_path FROM documents WHERE blob_sha256 IS NULL")]
+    c.close()
+    stats = {"files": 0, "rows": 0, "missing": 0, "bytes_saved": 0}
+    for path in paths:
+        if not path or not os.path.isfile(path):
+            stats["missing"] += 1
+            continue
+        sha, size = hash_file(path)
+        with transaction() as c:
+            final = blob_path(sha)
+            existed = os.path.exists(final)
+            c.execute(
+                "INSERT INTO blobs (sha256, size, refcount, created_ts) VALUES (?, ?, 0, ?) ON CONFLICT DO NOTHING",
+                (sha, size, now()),
+            )
+            if not existed:
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                shutil.copyfile(path, final)
+            stats["rows"] += c.execute(
+                "UPDATE documents SET blob_sha256 = ?, saved_path = ? WHERE blob_sha256 IS NULL AND saved_path = ?",
+                (sha, final, path),
+            ).rowcount
+        if existed:
+            stats["bytes_saved"] += size
+        os.remove(path)
+        stats["files"] += 1
+    return stats
@@ -1,28 +1,29 @@
-import sqlite3
+import os
 from datetime import datetime
 
-DB_PATH = "app.db"
+from models_db import init_db_all, BatchWriter
+
+# When the queue is full: "drop" loses the log row, "block" makes the
+# chatting user wait (up to CHAT_LOG_BLOCK_S) for the writer to catch up.
+chat_log = BatchWriter(
+    "INSERT INTO chat_logs (ts, surface, user_id, user_text, assistant_text) VALUES (?, ?, ?, ?, ?)",
+    name="chat-log-writer",
+    max_queue=int(os.environ.get("CHAT_LOG_QUEUE_MAX", "5000")),
+    batch_size=int(os.environ.get("CHAT_LOG_BATCH", "200")),
+    flush_interval_s=float(os.environ.get("CHAT_LOG_FLUSH_S", "1.0")),
+    policy=os.environ.get("CHAT_LOG_POLICY", "drop"),
+    block_timeout_s=float(os.environ.get("CHAT_LOG_BLOCK_S", "0.5")),
+)
 
 def init_db():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS chat_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts TEXT NOT NULL,
-            user_text TEXT NOT NULL,
-            assistant_text TEXT NOT NULL
-        )
-    """)
-    con.commit()
-    con.close()
+    init_db_all()
 
-def log_chat(user_text: str, assistant_text: str):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute(
-        "INSERT INTO chat_logs (ts, user_text, assistant_text) VALUES (?, ?, ?)",
-        (datetime.utcnow().isoformat(), user_text, assistant_text)
-    )
-    con.commit()
-    con.close()
+def log_chat(user_text: str, assistant_text: str, surface: str = "cli", user_id: int = None) -> bool:
+    """Queues the exchange for the background writer; False if it was dropped."""
+    return chat_log.put((
+        datetime.utcnow().isoformat(),
+        surface,
+        int(user_id) if user_id else None,
+        user_text,
+        assistant_text,
+    ))
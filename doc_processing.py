@@ -0,0 +1,245 @@
+"""
+Checks an uploaded document and derives small artifacts from it. Runs in
+the jobs worker processes (this file run as a script, see serve()), so
+everything here is a plain function of a file path: no database, no shared
+state. Standard library only.
+
+process() records facts about the content only, so its info.json can be
+shared by every document with the same bytes. verdict() then applies what
+depends on the document's own filename.
+
+    type        from the magic bytes; verdict() checks it against the extension
+    size        against blobstore.MAX_UPLOAD_BYTES
+    pages       PDF page count
+    text.txt    extracted text (PDF content streams, DOCX)
+    preview.*   first page preview: the first embedded JPEG of a scanned
+                PDF, or a thumbnail of an image upload when Pillow is there
+"""
+import os
+import re
+import sys
+import json
+import zlib
+import struct
+import zipfile
+
+MAGIC = (
+    (b"%PDF-", "pdf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"PK\x03\x04", "zip"),
+)
+# extension -> the type its bytes must have
+EXTENSIONS = {
+    ".pdf": "pdf",
+    ".png": "png",
+    ".jpg": "jpeg",
+    ".jpeg": "jpeg",
+    ".docx": "zip",
+}
+MAX_TEXT_CHARS = 200_000
+MAX_INFLATE_BYTES = 64 << 20  # decompressed PDF streams or DOCX XML examined per document
+PREVIEW_PX = 600
+# Bump when what process() records changes; older info.json files are redone.
+INFO_VERSION = 1
+
+_STREAM = re.compile(rb"stream\r?\n")
+_PAGES_COUNT = re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b", re.S)
+_PAGE = re.compile(rb"/Type\s*/Page\b(?!s)")
+_TEXT_BLOCK = re.compile(rb"BT\b(.*?)\bET\b", re.S)
+_PDF_STRING = re.compile(rb"\(((?:\\.|[^\\()])*)\)", re.S)
+_PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+_XML_TOKEN = re.compile(r"(?:<[^>]*>)+|[^<]+")
+
+
+def sniff(head: bytes) -> str:
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            return kind
+    return "unknown"
+
+
+def _unescape(s: bytes) -> bytes:
+    def sub(m):
+        c = m.group(1)
+        if c in _PDF_ESCAPES:
+            return _PDF_ESCAPES[c]
+        if c[:1].isdigit():
+            return bytes([int(c, 8) & 0xFF])
+        return c
+
+    return re.sub(rb"\\([nrtbf()\\]|[0-7]{1,3})", sub, s)
+
+
+def _pdf_streams(data: bytes):
+    """Yields (dictionary bytes, raw stream bytes) for each stream object."""
+    pos = 0
+    while True:
+        m = _STREAM.search(data, pos)
+        if not m:
+            return
+        end = data.find(b"endstream", m.end())
+        if end < 0:
+            return
+        head = data[max(0, data.rfind(b"obj", 0, m.start())):m.start()]
+        yield head, data[m.end():end]
+        pos = end + 9
+
+
+def _inspect_pdf(data: bytes, out_dir: str) -> dict:
+    inflated, budget, preview = [], MAX_INFLATE_BYTES, None
+    for head, raw in _pdf_streams(data):
+        if preview is None and b"/DCTDecode" in head and b"/Image" in head:
+            preview = os.path.join(out_dir, "preview.jpg")
+            with open(preview, "wb") as f:
+                f.write(raw.rstrip(b"\r\n"))
+        elif b"/FlateDecode" in head and budget > 0:
+            try:
+                chunk = zlib.decompressobj().decompress(raw, budget)
+            except zlib.error:
+                continue
+            budget -= len(chunk)
+            inflated.append(chunk)
+
+    counts = [int(a or b) for blob in [data] + inflated for a, b in _PAGES_COUNT.findall(blob)]
+    pages = max(counts) if counts else sum(len(_PAGE.findall(blob)) for blob in [data] + inflated)
+
+    text, size = [], 0
+    for blob in inflated:
+        for block in _TEXT_BLOCK.findall(blob):
+            line = b"".join(_unescape(s) for s in _PDF_STRING.findall(block)).decode("latin-1").strip()
+            if line:
+                text.append(line)
+                size += len(line)
+        if size >= MAX_TEXT_CHARS:
+            break
+    return {"pages": pages or None, "text": "\n".join(text), "preview": preview}
+
+
+def _inspect_docx(path: str) -> dict:
+    try:
+        with zipfile.ZipFile(path) as z:
+            entry = z.getinfo("word/document.xml")
+            if entry.file_size > MAX_INFLATE_BYTES:
+                return {"invalid": f"Word document expands to more than {MAX_INFLATE_BYTES >> 20} MB"}
+            with z.open(entry) as f:
+                raw = f.read(MAX_INFLATE_BYTES + 1)  # file_size is only what the zip claims
+    except (zipfile.BadZipFile, KeyError, zlib.error):
+        return {"invalid": "not a Word document"}
+    if len(raw) > MAX_INFLATE_BYTES:
+        return {"invalid": f"Word document expands to more than {MAX_INFLATE_BYTES >> 20} MB"}
+    text, size = [], 0
+    for m in _XML_TOKEN.finditer(raw.decode("utf-8", "replace")):
+        token = m.group()
+        if token.startswith("<"):
+            token = "\n" * token.count("</w:p>")
+        text.append(token)
+        size += len(token)
+        if size >= MAX_TEXT_CHARS:
+            break
+    return {"text": "".join(text)}
+
+
+def _image_size(kind: str, data: bytes):
+    if kind == "png" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if kind == "jpeg":
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker, length = data[i + 1], struct.unpack(">H", data[i + 2:i + 4])[0]
+            if marker in (0xC0, 0xC1, 0xC2):
+                h, w = struct.unpack(">HH", data[i + 5:i + 9])
+                return w, h
+            i += 2 + length
+    return None
+
+
+def _thumbnail(path: str, out_dir: str) -> dict:
+    try:
+        from PIL import Image  # installed with gradio; optional here
+    except ImportError:
+        return {}
+    dest = os.path.join(out_dir, "preview.jpg")
+    try:
+        with Image.open(path) as im:
+            im.thumbnail((PREVIEW_PX, PREVIEW_PX))
+            thumb = im.convert("RGB")
+    except (OSError, Image.DecompressionBombError):  # UnidentifiedImageError, truncated data
+        return {"invalid": "unreadable image"}
+    thumb.save(dest, "JPEG", quality=80)
+    return {"preview": dest}
+
+
+def process(path: str, out_dir: str, max_bytes: int = None) -> dict:
+    """
+    Checks the content and writes its artifacts to out_dir (info.json last,
+    so its presence means the directory is complete). Returns the info dict;
+    "valid" is False with a "reason" when the content fails a check.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        data = f.read(max_bytes + 1 if max_bytes else -1)
+    kind = sniff(data[:16])
+    info = {"version": INFO_VERSION, "type": kind, "size": size, "valid": True, "reason": None}
+
+    if max_bytes and size > max_bytes:
+        info.update(valid=False, reason=f"larger than {max_bytes >> 20} MB")
+    elif kind == "unknown":
+        info.update(valid=False, reason="unsupported file type")
+    else:
+        found = {}
+        if kind == "pdf":
+            found = _inspect_pdf(data, out_dir)
+        elif kind == "zip":
+            found = _inspect_docx(path)
+        else:
+            dims = _image_size(kind, data)
+            info["dimensions"] = list(dims) if dims else None
+            found = _thumbnail(path, out_dir)
+        if found.get("invalid"):
+            info.update(valid=False, reason=found["invalid"])
+        info["pages"] = found.get("pages")
+        text = (found.get("text") or "")[:MAX_TEXT_CHARS]
+        if text.strip():
+            with open(os.path.join(out_dir, "text.txt"), "w", encoding="utf-8") as f:
+                f.write(text)
+        info["text_chars"] = len(text)
+        info["preview"] = os.path.basename(found["preview"]) if found.get("preview") else None
+
+    tmp = os.path.join(out_dir, "info.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    os.replace(tmp, os.path.join(out_dir, "info.json"))
+    return info
+
+
+def verdict(info: dict, filename: str) -> dict:
+    """info for one document: the content's checks plus its extension against the type found."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if info.get("valid") and ext in EXTENSIONS and EXTENSIONS[ext] != info.get("type"):
+        return dict(info, valid=False, reason=f"{ext} file does not contain {EXTENSIONS[ext].upper()} data")
+    return info
+
+
+def serve() -> None:
+    """
+    Worker loop for jobs.py: reads one JSON list of process() arguments per
+    line on stdin, answers {"info": ...} or {"error": ...} on one line of
+    stdout. Exits when stdin closes.
+    """
+    out, sys.stdout = sys.stdout, sys.stderr  # stray prints must not corrupt the replies
+    for line in sys.stdin:
+        try:
+            reply = {"info": process(*json.loads(line))}
+        except Exception as e:
+            reply = {"error": f"{type(e).__name__}: {e}"}
+        out.write(json.dumps(reply) + "\n")
+        out.flush()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,191 @@
+"""
+ZIP export of applications' documents for reviewers. The archive is
+streamed: zipfile writes to a sink that hands its bytes to the HTTP
+response as they are produced, one CHUNK of a file at a time. Nothing is
+built in memory or in a temp file; memory stays at about one CHUNK plus
+zipfile's central directory (a small record per entry).
+
+    manifest.csv   one row per document (one per application without any)
+    decisions.csv  every decision on the exported applications
+    app_<id>/<doc id>_<doc type>_<filename>
+
+The console cannot hand a stream to gr.File, so it creates an export link
+(create_export) served by the /export route of create_server_app.
+
+Reads go through con_ro(), one checkout per application: the response may
+ask for the next piece on another thread, and a connection stays on its own.
+"""
+import io
+import os
+import re
+import csv
+import time
+import secrets
+import zipfile
+import threading
+from typing import Iterator, List, Optional
+
+import applications
+import auth
+from models_db import con_ro
+
+EXPORT_TTL_S = float(os.environ.get("EXPORT_TTL_S", "900"))
+EXPORT_MAX_APPLICATIONS = int(os.environ.get("EXPORT_MAX_APPLICATIONS", "5000"))
+CHUNK = 1 << 20
+
+MANIFEST_COLUMNS = [
+    "application_id", "applicant_email", "level", "programme", "status",
+    "latest_decision", "latest_decision_ts", "latest_decision_note",
+    "document_id", "doc_type", "original_filename", "uploaded_ts", "checks", "size_bytes", "zip_path",
+]
+DECISION_COLUMNS = ["application_id", "created_ts", "new_status", "note", "admin_user_id"]
+
+
+class _Sink(io.RawIOBase):
+    """Write-only and unseekable, so zipfile streams (data descriptors, no seeking back)."""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _safe(name: str) -> str:
+    return re.sub(r"[^\w.\- ]+", "_", name or "").strip(" .") or "file"
+
+
+def _zip_path(app_id: int, doc_id: int, doc_type: str, filename: str) -> str:
+    return f"app_{app_id}/{doc_id}_{_safe(doc_type)}_{_safe(os.path.basename(filename or ''))}"
+
+
+def _entry(name: str, size: int = 0, mtime: float = None, deflate: bool = False) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, time.localtime(mtime or time.time())[:6])
+    # Uploads are mostly PDFs and JPEGs, compressed already; store them.
+    info.compress_type = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+    info.file_size = size  # lets zipfile pick ZIP64 up front for big entries
+    return info
+
+
+def _manifest_rows(app_ids: List[int]) -> Iterator[list]:
+    for app_id in app_ids:
+        c = con_ro()
+        try:
+            agg = applications.read_application_aggregate(app_id, c)
+            email = auth.get_user_email(agg["user_id"], c) if agg else ""
+        finally:
+            c.close()
+        if not agg:
+            continue
+        decision = agg["latest_decision"] or (None, None, None, None)
+        head = [app_id, email, agg["level"], agg["programme"], agg["status"],
+                decision[1] or "", decision[0] or "", decision[2] or ""]
+        if not agg["documents"]:
+            yield head + [""] * 7
+        for doc_id, doc_type, fname, saved_path, ts, state, _info in agg["documents"]:
+            try:
+                size, path = os.path.getsize(saved_path), _zip_path(app_id, doc_id, doc_type, fname)
+            except (OSError, TypeError):
+                size, path = "", ""  # file missing: listed, not in the archive
+            yield head + [doc_id, doc_type, fname, ts, state, size, path]
+
+
+def _write_csv(zf: zipfile.ZipFile, sink: _Sink, name: str, columns: list, rows) -> Iterator[bytes]:
+    with io.TextIOWrapper(zf.open(_entry(name, deflate=True), "w"), encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(columns)
+        for i, row in enumerate(rows):
+            w.writerow(row)
+            if i % 500 == 499:
+                f.flush()
+                yield sink.take()
+    yield sink.take()
+
+
+def stream_zip(app_ids) -> Iterator[bytes]:
+    """
+    Yields the archive in pieces of up to about CHUNK bytes. Reads the
+    database one application at a time, on whichever thread asks for the
+    next piece.
+    """
+    return (piece for piece in _pieces([int(x) for x in app_ids]) if piece)
+
+
+def _pieces(app_ids: List[int]) -> Iterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        yield from _write_csv(zf, sink, "manifest.csv", MANIFEST_COLUMNS, _manifest_rows(app_ids))
+        yield from _write_csv(zf, sink, "decisions.csv", DECISION_COLUMNS, (
+            [app_id] + list(d) for app_id in app_ids for d in applications.list_decisions(app_id)
+        ))
+        buf = bytearray(CHUNK)
+        view = memoryview(buf)
+        for app_id in app_ids:
+            c = con_ro()
+            try:
+                docs = applications.list_documents(app_id, c)
+            finally:
+                c.close()
+            for doc_id, doc_type, fname, saved_path, _ts, _state, _info in docs:
+                try:
+                    src = open(saved_path, "rb")
+                except (OSError, TypeError):
+                    continue
+                with src:
+                    st = os.fstat(src.fileno())
+                    entry = _entry(_zip_path(app_id, doc_id, doc_type, fname), st.st_size, st.st_mtime)
+                    with zf.open(entry, "w") as dst:
+                        while True:
+                            n = src.readinto(buf)
+                            if not n:
+                                break
+                            dst.write(view[:n])
+                            yield sink.take()
+                yield sink.take()
+    yield sink.take()
+
+
+# token -> {"admin_user_id", "app_ids", "filename", "expires"}
+_exports = {}
+_exports_lock = threading.Lock()
+
+
+def create_export(admin_user_id: int, app_ids, label: str = "applications") -> str:
+    """Registers an export for EXPORT_TTL_S seconds and returns its token (the download link)."""
+    ids = sorted({int(x) for x in app_ids or []}, reverse=True)
+    if not ids:
+        raise ValueError("Select at least one application to export.")
+    if len(ids) > EXPORT_MAX_APPLICATIONS:
+        raise ValueError(f"At most {EXPORT_MAX_APPLICATIONS} applications per export; narrow the filters.")
+    token = secrets.token_urlsafe(24)
+    t = time.time()
+    with _exports_lock:
+        for old in [k for k, v in _exports.items() if v["expires"] <= t]:
+            del _exports[old]
+        _exports[token] = {
+            "admin_user_id": int(admin_user_id),
+            "app_ids": ids,
+            "filename": f"{_safe(label)}_{time.strftime('%Y%m%d-%H%M%S')}.zip",
+            "expires": t + EXPORT_TTL_S,
+        }
+    return token
+
+
+def lookup(token: str) -> Optional[dict]:
+    """The export behind the token, if it has not expired and its admin still is one."""
+    with _exports_lock:
+        export = _exports.get(token)
+    if not export or export["expires"] <= time.time():
+        return None
+    if not auth.is_admin_user(export["admin_user_id"]):
+        return None
+    return export
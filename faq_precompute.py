@@ -0,0 +1,111 @@
+"""
+Warm the public AI answer cache before application season.
+
+    python faq_precompute.py [--workers 2] [--refresh-within-days 7]
+
+Answers every COMMON_QUESTIONS entry for every programme and stores it
+under the same key the "AI (Public)" tab looks up. Entries that are already
+cached and not about to expire are skipped, so an interrupted run can
+simply be started again.
+"""
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ai import ask_llm, LLMBusy, LLMUnavailable
+from intents import detect_intent
+from llm_cache import answer_cache
+from models_db import init_db_all
+from portal_tools import public_prompt, public_cache_key
+from programmes import BACHELOR_PROGRAMMES, MASTER_PROGRAMMES
+
+COMMON_QUESTIONS = [
+    "What documents do I need?",
+    "What are the admission requirements?",
+    "Do I need an English language certificate?",
+    "What should I write in my motivation letter?",
+    "How long does the application review take?",
+    "Can I apply to more than one programme?",
+    "What happens after I submit my application?",
+    "Can I upload my documents later?",
+]
+
+FAQ_TTL_S = 30 * 24 * 3600
+
+
+def faq_entries():
+    for level, programmes in (("Bachelor", BACHELOR_PROGRAMMES), ("Master", MASTER_PROGRAMMES)):
+        for programme in programmes:
+            for question in COMMON_QUESTIONS:
+                yield level, programme, question
+
+
+def _answer(level: str, programme: str, question: str, retries: int = 5) -> str:
+    delay = 1.0
+    for attempt in range(retries):
+        try:
+            return ask_llm(
+                public_prompt(question, level, programme),
+                surface="batch",
+                intent=detect_intent(question),
+                route_surface="public",  # same model the public tab would pick
+            )
+        except LLMBusy:
+            # Live traffic outranks us; back off and try again.
+            if attempt == retries - 1:
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--workers", type=int, default=2, help="concurrent model calls")
+    p.add_argument("--refresh-within-days", type=float, default=7,
+                   help="regenerate entries that expire sooner than this")
+    p.add_argument("--ttl-days", type=float, default=FAQ_TTL_S / 86400)
+    args = p.parse_args()
+    init_db_all()  # a fresh or older database gets the tables the calls are logged to
+
+    min_remaining = args.refresh_within_days * 86400
+    entries = list(faq_entries())
+    todo = [e for e in entries if not answer_cache.is_fresh(public_cache_key(e[2], e[0], e[1]), min_remaining)]
+    print(f"{len(entries)} FAQ entries, {len(entries) - len(todo)} fresh, {len(todo)} to generate.")
+    if not todo:
+        return
+
+    done = failed = 0
+    lock = threading.Lock()
+    t0 = time.perf_counter()
+
+    def work(entry):
+        level, programme, question = entry
+        answer = _answer(level, programme, question)
+        if answer:
+            answer_cache.put(public_cache_key(question, level, programme), answer, ttl_s=int(args.ttl_days * 86400))
+        return entry
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        futures = [ex.submit(work, e) for e in todo]
+        for f in as_completed(futures):
+            try:
+                f.result()
+                ok = True
+            except (LLMBusy, LLMUnavailable) as e:
+                ok = False
+                print(f"  failed: {e}")
+            with lock:
+                done += ok
+                failed += not ok
+                n = done + failed
+            if n % 10 == 0 or n == len(todo):
+                elapsed = time.perf_counter() - t0
+                print(f"  {n}/{len(todo)}  {done / elapsed * 60:.1f} answers/min")
+
+    wall = time.perf_counter() - t0
+    print(f"Generated {done} answer(s), {failed} failed, in {wall:.1f}s ({done / wall * 60:.1f} answers/min).")
+
+
+if __name__ == "__main__":
+    main()
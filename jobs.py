@@ -0,0 +1,438 @@
+"""
+Background jobs stored in app.db (models_db migration 7). Inserting a
+documents row queues a "process_document" job by trigger, so an upload
+returns as soon as its row is committed. JobRunner claims queued jobs
+under a lease, runs doc_processing.process() in worker processes (the
+checks are CPU bound: inflating and scanning PDF streams) and writes the
+result to documents.processing_state / processing_info.
+
+A job stays 'running' only while its lease is renewed. After a crash or
+restart, recover() puts it back in the queue: at once if its worker process
+is gone, else when the lease runs out. Failures are retried with backoff up
+to MAX_ATTEMPTS; a document that fails a check is not a failure, it ends
+as 'invalid' with the reason.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import atexit
+import socket
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import blobstore
+import doc_processing
+from models_db import con, con_ro, now, transaction
+
+log = logging.getLogger(__name__)
+
+JOB_PROCESSES = int(os.environ.get("JOB_PROCESSES", "2"))  # 0: run jobs in the dispatcher thread
+JOB_LEASE_S = float(os.environ.get("JOB_LEASE_S", "300"))
+JOB_TIMEOUT_S = float(os.environ.get("JOB_TIMEOUT_S", "120"))  # per check, in a worker process
+JOB_POLL_S = float(os.environ.get("JOB_POLL_S", "5"))
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+RETRY_BASE_S = 10.0
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+PROCESSING_LABELS = {
+    "queued": "⏳ waiting for checks",
+    "processing": "⚙️ checking",
+    "ready": "✅ checked",
+    "invalid": "⚠️",
+    "failed": "❌ could not be checked",
+}
+
+
+def processing_label(state: str, info_json: str = None) -> str:
+    """One-line status for a documents row, e.g. "✅ checked, 3 pages"."""
+    label = PROCESSING_LABELS.get(state, state or "")
+    try:
+        info = json.loads(info_json) if info_json else {}
+    except ValueError:
+        info = {}
+    if state == "ready" and info.get("pages"):
+        label += f", {info['pages']} page{'s' if info['pages'] != 1 else ''}"
+    elif state == "invalid":
+        label += f" {info.get('reason') or 'not accepted'}"
+    return label
+
+
+def _worker_gone(worker: str) -> bool:
+    host, _, pid = (worker or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False  # another machine: only its lease tells
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def recover() -> int:
+    """Requeues running jobs whose lease ran out or whose worker process died."""
+    t = time.time()
+    with transaction() as c:
+        rows = c.execute("SELECT id, document_id, worker, lease_until FROM jobs WHERE state = 'running'").fetchall()
+        lost = [(i, d) for i, d, worker, lease in rows if (lease or 0) < t or _worker_gone(worker)]
+        c.executemany(
+            "UPDATE jobs SET state = 'queued', lease_until = NULL, worker = NULL WHERE id = ? AND state = 'running'",
+            [(i,) for i, _d in lost],
+        )
+        c.executemany(
+            "UPDATE documents SET processing_state = 'queued' WHERE id = ? AND processing_state = 'processing'",
+            [(d,) for _i, d in lost if d is not None],
+        )
+    return len(lost)
+
+
+def claim(limit: int, worker: str = WORKER_ID) -> List[tuple]:
+    """
+    Takes up to `limit` due jobs, oldest first, in one write.
+    Returns [(job id, kind, document_id, attempts)].
+    """
+    t = time.time()
+    with transaction() as c:
+        jobs = c.execute(
+            """
+            UPDATE jobs SET state = 'running', attempts = attempts + 1, lease_until = ?, worker = ?
+            WHERE id IN (SELECT id FROM jobs WHERE state = 'queued' AND run_after <= ?
+                         ORDER BY run_after, id LIMIT ?)
+            RETURNING id, kind, document_id, attempts
+            """,
+            (t + JOB_LEASE_S, worker, t, int(limit)),
+        ).fetchall()
+        c.execute(
+            "UPDATE documents SET processing_state = 'processing' WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([j[2] for j in jobs if j[2] is not None]),),
+        )
+    return sorted(jobs)
+
+
+def finish(results, worker: str = WORKER_ID) -> None:
+    """
+    results: [(job, info dict or None, error str or None)], written in one
+    transaction. A job that was requeued meanwhile (lost lease) is skipped.
+    """
+    t, ts = time.time(), now()
+    with transaction() as c:
+        for (job_id, _kind, doc_id, attempts), info, error in results:
+            if c.execute("SELECT 1 FROM jobs WHERE id = ? AND state = 'running' AND worker = ?",
+                         (job_id, worker)).fetchone() is None:
+                continue
+            if error is None:
+                c.execute("UPDATE jobs SET state = 'done', lease_until = NULL, error = NULL, finished_ts = ? "
+                          "WHERE id = ?", (ts, job_id))
+                state = "ready" if info.get("valid") else "invalid"
+            elif attempts < MAX_ATTEMPTS:
+                c.execute("UPDATE jobs SET state = 'queued', run_after = ?, lease_until = NULL, worker = NULL, "
+                          "error = ? WHERE id = ?", (t + RETRY_BASE_S * 2 ** (attempts - 1), error, job_id))
+                state, info = "queued", None
+            else:
+                c.execute("UPDATE jobs SET state = 'failed', lease_until = NULL, error = ?, finished_ts = ? "
+                          "WHERE id = ?", (error, ts, job_id))
+                state, info = "failed", {"reason": error}
+            if doc_id is not None:
+                c.execute("UPDATE documents SET processing_state = ?, processing_info = ? WHERE id = ?",
+                          (state, json.dumps(info) if info else None, doc_id))
+
+
+def retry_failed() -> int:
+    """Puts failed jobs back in the queue with a fresh set of attempts."""
+    with transaction() as c:
+        ids = [r[0] for r in c.execute(
+            "UPDATE jobs SET state = 'queued', attempts = 0, run_after = 0, finished_ts = NULL "
+            "WHERE state = 'failed' RETURNING document_id"
+        ).fetchall()]
+        c.execute(
+            "UPDATE documents SET processing_state = 'queued' WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([i for i in ids if i is not None]),),
+        )
+    return len(ids)
+
+
+def queue_stats() -> dict:
+    """state -> number of jobs, with every state present."""
+    c = con_ro()
+    rows = dict(c.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+    c.close()
+    return {s: int(rows.get(s, 0)) for s in ("queued", "running", "done", "failed")}
+
+
+class _Workers:
+    """
+    `size` processes running doc_processing.py as a script (its serve()
+    loop), each driven by one thread: a JSON line of arguments in, a JSON
+    line back. They are started with fork+exec, which is safe from a
+    process that already runs threads, and import nothing of the parent.
+    A worker that dies, or is still busy after JOB_TIMEOUT_S (a file that
+    sends a parser into a loop), is killed and replaced, and its job fails
+    with the reason.
+    """
+
+    def __init__(self, size: int):
+        self._threads = ThreadPoolExecutor(size, thread_name_prefix="jobs-worker")
+        self._idle: "queue.LifoQueue[subprocess.Popen]" = queue.LifoQueue()
+        self._procs = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(size):  # started now, so the first upload does not wait for an interpreter
+            self._idle.put(self._start())
+
+    def _start(self) -> subprocess.Popen:
+        proc = subprocess.Popen([sys.executable, os.path.abspath(doc_processing.__file__)],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf-8")
+        with self._lock:
+            self._procs.add(proc)
+        return proc
+
+    def _call(self, args: tuple) -> Tuple[Optional[dict], Optional[str]]:
+        try:
+            proc = self._idle.get_nowait()
+        except queue.Empty:
+            proc = self._start()
+        timed_out = threading.Event()
+
+        def watchdog():
+            timed_out.set()
+            proc.kill()  # readline() below returns ""
+
+        timer = threading.Timer(JOB_TIMEOUT_S, watchdog)
+        timer.start()
+        try:
+            proc.stdin.write(json.dumps(args) + "\n")
+            proc.stdin.flush()
+            line = proc.stdout.readline()
+        except OSError:
+            line = ""
+        finally:
+            timer.cancel()
+        if not line or timed_out.is_set():  # hung, killed, out of memory...
+            proc.kill()
+            code = proc.wait()
+            with self._lock:
+                self._procs.discard(proc)
+            if not self._closed:
+                self._idle.put(self._start())
+            if timed_out.is_set():
+                return None, f"check took longer than {JOB_TIMEOUT_S:g}s"
+            return None, f"worker process died (exit code {code})"
+        self._idle.put(proc)
+        reply = json.loads(line)
+        return reply.get("info"), reply.get("error")
+
+    def submit(self, *args):
+        """A future of (info, error), for doc_processing.process(*args)."""
+        return self._threads.submit(self._call, args)
+
+    def shutdown(self) -> None:
+        """Idle workers exit when their stdin closes; busy ones are killed."""
+        self._closed = True
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            procs = list(self._procs)
+        for proc in procs:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+        deadline = time.monotonic() + 1.0
+        for proc in procs:
+            try:
+                proc.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+
+class JobRunner:
+    """
+    One dispatcher thread: claims jobs while the pool has room, collects
+    finished ones, renews leases. processes=0 runs each job in the thread.
+    notify() wakes it early, so a fresh upload does not wait for the poll.
+    """
+
+    def __init__(self, processes: int = JOB_PROCESSES, poll_s: float = JOB_POLL_S):
+        self.processes = max(0, int(processes))
+        self.poll_s = poll_s
+        self.slots = max(1, self.processes) * 2  # keep the pool fed between polls
+        self.counts = {"done": 0, "invalid": 0, "reused": 0, "errors": 0}
+        self._pool = None
+        self._inflight = {}  # job id -> job
+        self._dispatching = False  # claimed jobs may not be in _inflight yet
+        self._results: "queue.Queue[tuple]" = queue.Queue()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self) -> "JobRunner":
+        if self._thread is None:
+            self._pool = _Workers(self.processes) if self.processes > 0 else None
+            self._thread = threading.Thread(target=self._run, name="jobs", daemon=True)
+            self._thread.start()
+        return self
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Unfinished jobs stay 'running' and are recovered on the next start."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def idle(self) -> bool:
+        """Nothing in flight and no job due now (retries waiting out their backoff do not count)."""
+        c = con_ro()
+        due = c.execute("SELECT EXISTS (SELECT 1 FROM jobs WHERE state = 'queued' AND run_after <= ?)",
+                        (time.time(),)).fetchone()[0]
+        c.close()
+        # Looked at after the query: a job claimed meanwhile is in one of these.
+        return not (due or self._dispatching or self._inflight or not self._results.empty())
+
+    def _submit(self, job) -> None:
+        job_id, kind, doc_id, _attempts = job
+        self._inflight[job_id] = job
+        if kind != "process_document":
+            self._results.put((job, None, f"unknown job kind {kind!r}"))
+            return
+        c = con()
+        row = c.execute("SELECT saved_path, original_filename, blob_sha256 FROM documents WHERE id = ?",
+                        (doc_id,)).fetchone()
+        c.close()
+        if row is None:  # deleted after it was queued
+            self._results.put((job, {"valid": True, "reason": "document deleted"}, None))
+            return
+        path, filename, sha = row
+        out_dir = blobstore.artifact_dir(sha, doc_id)
+        try:
+            with open(os.path.join(out_dir, "info.json"), encoding="utf-8") as f:
+                info = json.load(f)  # same content checked before
+            if info.get("version") == doc_processing.INFO_VERSION:
+                self.counts["reused"] += 1
+                self._results.put((job, doc_processing.verdict(info, filename), None))
+                return
+        except (OSError, ValueError):
+            pass
+        args = (path, out_dir, blobstore.MAX_UPLOAD_BYTES)
+        if self._pool is None:
+            try:
+                self._results.put((job, doc_processing.verdict(doc_processing.process(*args), filename), None))
+            except Exception as e:
+                self._results.put((job, None, f"{type(e).__name__}: {e}"))
+            return
+        fut = self._pool.submit(*args)
+        fut.add_done_callback(lambda f, job=job, filename=filename: self._done(job, filename, f))
+
+    def _done(self, job, filename: str, fut) -> None:
+        """The worker's info.json is about the content; the extension check is this document's."""
+        try:
+            info, error = fut.result()
+        except Exception as e:  # cancelled at shutdown
+            info, error = None, f"{type(e).__name__}: {e}"
+        self._results.put((job, doc_processing.verdict(info, filename) if error is None else None, error))
+        self._wake.set()
+
+    def _collect(self) -> None:
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        if not results:
+            return
+        try:
+            finish(results)
+        except Exception:
+            for result in results:  # written on the next pass
+                self._results.put(result)
+            raise
+        for job, info, error in results:
+            self._inflight.pop(job[0], None)
+            if error:
+                log.warning("job %s (document %s, attempt %s) failed: %s", job[0], job[2], job[3], error)
+                self.counts["errors"] += 1
+            else:
+                self.counts["done" if info.get("valid") else "invalid"] += 1
+
+    def _renew(self) -> None:
+        if not self._inflight:
+            return
+        with transaction() as c:
+            c.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND state = 'running' AND worker = ?",
+                [(time.time() + JOB_LEASE_S, i, WORKER_ID) for i in self._inflight],
+            )
+
+    def _run(self) -> None:
+        next_check = 0.0
+        while not self._stopping.is_set():
+            self._dispatching = True
+            try:
+                self._collect()
+                if time.monotonic() >= next_check:
+                    recover()
+                    self._renew()
+                    next_check = time.monotonic() + JOB_LEASE_S / 3
+                free = self.slots - len(self._inflight)
+                claimed = claim(free) if free > 0 else []
+            except Exception:
+                log.exception("jobs: dispatch failed, trying again after the poll")  # e.g. database busy
+                claimed = []
+            for job in claimed:
+                try:
+                    self._submit(job)
+                except Exception as e:
+                    # Recorded on the job row by the next _collect(), and retried like any failure.
+                    log.exception("jobs: could not start job %s", job[0])
+                    self._inflight[job[0]] = job
+                    self._results.put((job, None, f"{type(e).__name__}: {e}"))
+            self._dispatching = False
+            self._wake.wait(self.poll_s)
+            self._wake.clear()
+        self._collect()
+
+
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def start_workers(processes: int = None) -> JobRunner:
+    """Starts the process-wide runner once."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(JOB_PROCESSES if processes is None else processes).start()
+            atexit.register(_runner.stop)
+    return _runner
+
+
+def notify() -> None:
+    if _runner is not None:
+        _runner.notify()
+
+
+def run_until_idle(processes: int = JOB_PROCESSES, timeout_s: float = None) -> dict:
+    """Works the queue in the foreground until nothing is due; for admin_cli."""
+    runner = JobRunner(processes, poll_s=0.2).start()
+    deadline = time.monotonic() + timeout_s if timeout_s else None
+    try:
+        while not runner.idle():
+            if deadline and time.monotonic() > deadline:
+                break
+            runner.notify()
+            time.sleep(0.2)
+    finally:
+        runner.stop()
+    return dict(runner.counts)
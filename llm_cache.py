@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from models_db import DB_PATH
+
+# Lives next to app.db so it survives restarts but can be deleted freely.
+CACHE_DB_PATH = os.environ.get(
+    "LLM_CACHE_DB", os.path.join(os.path.dirname(DB_PATH) or ".", "llm_cache.db")
+)
+CACHE_TTL_S = int(os.environ.get("LLM_CACHE_TTL_S", str(24 * 3600)))
+MEMORY_ITEMS = int(os.environ.get("LLM_CACHE_MEMORY_ITEMS", "512"))
+
+# Answers quote the programme catalogue, so any edit to it invalidates them.
+PROGRAMMES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "programmes.py")
+
+
+def normalize_question(text: str) -> str:
+    t = (text or "").lower()
+    t = re.sub(r"[^\w\s]", " ", t)
+    return " ".join(t.split())
+
+
+def make_key(question: str, level: str, programme: str, model: str, prompt_version: int, extra: str = "") -> str:
+    parts = [normalize_question(question), level or "", programme or "", model, int(prompt_version), extra or ""]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def _file_fingerprint(path: str) -> str:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return ""
+
+
+class AnswerCache:
+    """
+    Two tiers: an in-process LRU in front of a SQLite table. Entries carry
+    their own expiry so long-lived ones (e.g. precomputed FAQs) can coexist
+    with the default TTL.
+    """
+
+    def __init__(self, path: str = None, ttl_s: int = None, memory_items: int = None,
+                 watch_file: str = PROGRAMMES_FILE):
+        self.path = path or CACHE_DB_PATH
+        self.ttl_s = CACHE_TTL_S if ttl_s is None else ttl_s
+        self.memory_items = MEMORY_ITEMS if memory_items is None else memory_items
+        self.watch_file = watch_file
+        self._lock = threading.Lock()
+        self._mem = OrderedDict()  # key -> (answer, expires_at)
+        self._conn = None
+        self._watch_mtime = None
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            c = sqlite3.connect(self.path, check_same_thread=False)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+            c.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+            c.commit()
+            self._conn = c
+        return self._conn
+
+    def _check_catalogue(self):
+        # Cheap stat on every call; hash only when the mtime moves.
+        if not self.watch_file:
+            return
+        try:
+            mtime = os.stat(self.watch_file).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._watch_mtime:
+            return
+        self._watch_mtime = mtime
+        fp = _file_fingerprint(self.watch_file)
+        c = self._db()
+        row = c.execute("SELECT v FROM meta WHERE k = 'catalogue'").fetchone()
+        if row and row[0] == fp:
+            return
+        c.execute("DELETE FROM answers")
+        c.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('catalogue', ?)", (fp,))
+        c.commit()
+        self._mem.clear()
+        if row:
+            self.invalidations += 1
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            self._check_catalogue()
+            hit = self._mem.get(key)
+            if hit and hit[1] > now:
+                self._mem.move_to_end(key)
+                self.hits_memory += 1
+                return hit[0]
+            if hit:
+                del self._mem[key]
+
+            row = self._db().execute(
+                "SELECT answer, expires_at FROM answers WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+            self._remember(key, row[0], row[1])
+            self.hits_disk += 1
+            return row[0]
+
+    def is_fresh(self, key: str, min_remaining_s: float = 0) -> bool:
+        """True if the entry exists and will not expire within min_remaining_s."""
+        with self._lock:
+            self._check_catalogue()
+            row = self._db().execute(
+                "SELECT 1 FROM answers WHERE key = ? AND expires_at > ?",
+                (key, time.time() + min_remaining_s),
+            ).fetchone()
+            return row is not None
+
+    def put(self, key: str, answer: str, ttl_s: int = None):
+        now = time.time()
+        expires_at = now + (self.ttl_s if ttl_s is None else ttl_s)
+        with self._lock:
+            self._check_catalogue()
+            c = self._db()
+            c.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, answer, now, expires_at),
+            )
+            c.commit()
+            self._remember(key, answer, expires_at)
+
+    def _remember(self, key: str, answer: str, expires_at: float):
+        self._mem[key] = (answer, expires_at)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_items:
+            self._mem.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            c = self._db()
+            n = c.execute("DELETE FROM answers WHERE expires_at <= ?", (time.time(),)).rowcount
+            c.commit()
+            return n
+
+    def clear(self):
+        with self._lock:
+            c = self._db()
+            c.execute("DELETE FROM answers")
+            c.commit()
+            self._mem.clear()
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_disk
+        total = hits + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_ratio": (hits / total) if total else 0.0,
+            "memory_items": len(self._mem),
+            "invalidations": self.invalidations,
+        }
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,126 @@
+import time
+import threading
+from typing import Optional
+
+from models_db import BatchWriter
+
+# Histogram bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# surface -> the handler that uses it
+SURFACES = {
+    "portal": "portal_chat_fn",
+    "public": "ai_public_answer",
+    "cli": "app_cli",
+    "batch": "faq_precompute",
+}
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str):
+        cumulative = 0
+        for b, n in zip(self.buckets, self.counts):
+            cumulative += n
+            yield f'{name}_bucket{{{labels},le="{b}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class LLMMetrics:
+    """
+    Per-call records go to the llm_calls table from a background thread;
+    aggregates stay in memory for the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}  # (surface, model) -> Histogram
+        self.ttft = {}
+        self.queue_wait = {}
+        self.calls = {}  # (surface, model, status) -> count
+        self.prompt_bytes = {}  # (surface, model) -> total
+        self.response_bytes = {}
+        self._rows = BatchWriter(
+            """
+            INSERT INTO llm_calls (ts, surface, model, status, prompt_bytes, response_bytes,
+                                   queue_wait_ms, ttft_ms, total_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            name="llm-metrics-writer",
+            max_queue=10000,
+            batch_size=500,
+            policy="drop",  # metrics must never slow down or fail a request
+        )
+
+    def record(self, surface: str, model: str, status: str, prompt_bytes: int, response_bytes: int,
+               queue_wait_s: Optional[float], ttft_s: Optional[float], total_s: float):
+        key = (surface, model)
+        with self._lock:
+            self.latency.setdefault(key, Histogram()).observe(total_s)
+            if ttft_s is not None:
+                self.ttft.setdefault(key, Histogram()).observe(ttft_s)
+            if queue_wait_s is not None:
+                self.queue_wait.setdefault(key, Histogram()).observe(queue_wait_s)
+            self.calls[key + (status,)] = self.calls.get(key + (status,), 0) + 1
+            self.prompt_bytes[key] = self.prompt_bytes.get(key, 0) + prompt_bytes
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + response_bytes
+
+        ms = lambda s: None if s is None else int(s * 1000)
+        row = (int(time.time()), surface, model, status, prompt_bytes, response_bytes,
+               ms(queue_wait_s), ms(ttft_s), ms(total_s))
+        self._rows.put(row)
+
+    def prometheus_lines(self):
+        with self._lock:
+            yield "# HELP llm_requests_total LLM calls by caller, model and outcome."
+            yield "# TYPE llm_requests_total counter"
+            for (surface, model, status), n in sorted(self.calls.items()):
+                yield f'llm_requests_total{{surface="{surface}",model="{model}",status="{status}"}} {n}'
+
+            for name, help_text, data in (
+                ("llm_prompt_bytes_total", "Prompt bytes sent to the model.", self.prompt_bytes),
+                ("llm_response_bytes_total", "Response bytes received from the model.", self.response_bytes),
+            ):
+                yield f"# HELP {name} {help_text}"
+                yield f"# TYPE {name} counter"
+                for (surface, model), n in sorted(data.items()):
+                    yield f'{name}{{surface="{surface}",model="{model}"}} {n}'
+
+            for name, help_text, data in (
+                ("llm_request_duration_seconds", "End-to-end LLM call latency.", self.latency),
+                ("llm_time_to_first_token_seconds", "Time until the first chunk reached the caller.", self.ttft),
+                ("llm_queue_wait_seconds", "Time spent queued before generation started.", self.queue_wait),
+            ):
+                yield f"# HELP {name} {help_text}"
+                yield f"# TYPE {name} histogram"
+                for (surface, model), h in sorted(data.items()):
+                    yield from h.lines(name, f'surface="{surface}",model="{model}"')
+
+
+llm_metrics = LLMMetrics()
+
+
+def render_prometheus(gauges: dict = None) -> str:
+    """`gauges` maps metric name -> value for point-in-time values from other modules."""
+    lines = list(llm_metrics.prometheus_lines())
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {float(value):g}")
+    return "\n".join(lines) + "\n"
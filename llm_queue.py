@@ -0,0 +1,216 @@
+import time
+import queue
+import asyncio
+import hashlib
+import itertools
+import threading
+from typing import AsyncIterator, Callable, Iterator
+
+from llm_cache import normalize_question
+
+# Lower runs first. Logged-in users beat the anonymous public tab.
+PRIORITY = {
+    "portal": 0,
+    "cli": 0,
+    "public": 1,
+    "batch": 2,
+}
+
+
+class LLMBusy(RuntimeError):
+    pass
+
+
+class Flight:
+    """
+    One model generation, shared by every caller that asked the same thing
+    while it was queued or running. Chunks are kept so late joiners replay
+    from the start.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+        self._cond = threading.Condition()
+        self._async_waiters = []  # (loop, future) pairs from aiter()
+
+    def _wake(self):
+        # Called with self._cond held.
+        self._cond.notify_all()
+        for loop, fut in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve, fut)
+        self._async_waiters.clear()
+
+    def push(self, chunk: str):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._wake()
+
+    def finish(self, error: Exception = None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._wake()
+
+    def queue_wait(self) -> float:
+        if self.started_at is None:
+            return time.perf_counter() - self.enqueued_at
+        return self.started_at - self.enqueued_at
+
+    def iter(self, deadline: float = None) -> Iterator[str]:
+        """`deadline` is a time.perf_counter() value; past it, raises TimeoutError."""
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.chunks) and not self.done:
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise TimeoutError("LLM call exceeded its deadline")
+                    self._cond.wait(remaining)
+                new = self.chunks[i:]
+                i += len(new)
+                finished = self.done and i >= len(self.chunks)
+                error = self.error
+            yield from new
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+    async def aiter(self, deadline: float = None) -> AsyncIterator[str]:
+        """Like iter(), but waits on the event loop instead of blocking a thread."""
+        loop = asyncio.get_running_loop()
+        i = 0
+        while True:
+            fut = None
+            with self._cond:
+                if i >= len(self.chunks) and not self.done:
+                    fut = loop.create_future()
+                    self._async_waiters.append((loop, fut))
+                else:
+                    new = self.chunks[i:]
+                    i += len(new)
+                    finished = self.done and i >= len(self.chunks)
+                    error = self.error
+            if fut is not None:
+                if deadline is None:
+                    await fut
+                else:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise TimeoutError("LLM call exceeded its deadline")
+                    await asyncio.wait_for(fut, remaining)
+                continue
+            for chunk in new:
+                yield chunk
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+def _resolve(fut: asyncio.Future):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class Scheduler:
+    """
+    Bounded priority queue drained by a fixed number of worker threads.
+    Identical prompts in flight are coalesced into one generation.
+    """
+
+    def __init__(self, run: Callable[[str, str], Iterator[str]], workers: int = 2, max_queue: int = 32):
+        self.run = run
+        self.workers = workers
+        self._q = queue.PriorityQueue(maxsize=max_queue)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._started = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.started = 0
+        self.completed = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    @staticmethod
+    def flight_key(prompt: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{normalize_question(prompt)}".encode("utf-8")).hexdigest()
+
+    def _start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"llm-worker-{i}", daemon=True).start()
+        self._started = True
+
+    def submit(self, prompt: str, model: str, priority: int = 1) -> Flight:
+        key = self.flight_key(prompt, model)
+        with self._lock:
+            if not self._started:
+                self._start()
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight
+            flight = Flight(key)
+            try:
+                self._q.put_nowait((priority, next(self._seq), flight, prompt, model))
+            except queue.Full:
+                self.rejected += 1
+                raise LLMBusy("The assistant is busy right now. Please retry in a minute.")
+            self._inflight[key] = flight
+            self.submitted += 1
+            return flight
+
+    def retire(self):
+        """Let the workers exit once the queue drains (used when a route is reconfigured)."""
+        def stop():
+            for _ in range(self.workers):
+                self._q.put((float("inf"), next(self._seq), None, None, None))
+        threading.Thread(target=stop, daemon=True).start()
+
+    def _worker(self):
+        while True:
+            _prio, _seq, flight, prompt, model = self._q.get()
+            if flight is None:
+                return
+            flight.started_at = time.perf_counter()
+            wait = flight.queue_wait()
+            with self._lock:
+                self.started += 1
+                self.wait_total_s += wait
+                self.wait_max_s = max(self.wait_max_s, wait)
+            try:
+                for chunk in self.run(prompt, model):
+                    flight.push(chunk)
+                flight.finish()
+            except Exception as e:
+                flight.finish(e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(flight.key, None)
+                    self.completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            asked = self.submitted + self.coalesced
+            return {
+                "queue_depth": self._q.qsize(),
+                "in_flight": len(self._inflight),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "coalesce_ratio": (self.coalesced / asked) if asked else 0.0,
+                "wait_avg_ms": (self.wait_total_s / self.started * 1000) if self.started else 0.0,
+                "wait_max_ms": self.wait_max_s * 1000,
+            }
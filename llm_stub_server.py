@@ -0,0 +1,147 @@
+"""
+Offline stand-in for Ollama, for benchmarks and local development.
+
+    python llm_stub_server.py --port 11434          # mimics `ollama serve`
+    python llm_stub_server.py --cli run llama3      # mimics `ollama run llama3`
+
+Answers echo the last prompt line. A model "load" delay is paid once per model
+by the server, but on every call by the CLI, like the real thing.
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOAD_DELAY_S = 0.25
+TOKEN_DELAY_S = 0.002
+
+
+def fake_answer(prompt: str, n_tokens: int = 40) -> str:
+    lines = [ln for ln in (prompt or "").strip().splitlines() if ln.strip()]
+    last = lines[-1] if lines else ""
+    words = (f"Stub answer to: {last} " + "lorem ipsum " * n_tokens).split()[:n_tokens]
+    return " ".join(words)
+
+
+class StubState:
+    def __init__(self, load_delay_s: float, token_delay_s: float):
+        self.load_delay_s = load_delay_s
+        self.token_delay_s = token_delay_s
+        self.loaded = set()
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def token_delay(self, model: str) -> float:
+        # Small models generate faster; enough to make routing measurable.
+        small = any(tag in model for tag in (":1b", ":3b", "mini", "small"))
+        return self.token_delay_s * (0.25 if small else 1.0)
+
+    def ensure_loaded(self, model: str):
+        with self.lock:
+            self.requests += 1
+            if model in self.loaded:
+                return
+            time.sleep(self.load_delay_s)
+            self.loaded.add(model)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    state: StubState = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            req = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": "bad json"})
+        if self.path != "/api/generate":
+            return self._send_json(404, {"error": "not found"})
+
+        model = req.get("model") or "llama3"
+        self.state.ensure_loaded(model)
+        answer = fake_answer(req.get("prompt", ""))
+        if req.get("stream", True):
+            return self._stream(model, answer)
+        time.sleep(self.state.token_delay(model) * len(answer.split()))
+        self._send_json(200, {"model": model, "response": answer, "done": True})
+
+    def _write_chunk(self, obj: dict):
+        data = json.dumps(obj).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _stream(self, model: str, answer: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = answer.split()
+        try:
+            for i, word in enumerate(words):
+                time.sleep(self.state.token_delay(model))
+                self._write_chunk({"model": model, "response": (" " if i else "") + word, "done": False})
+            self._write_chunk({"model": model, "response": "", "done": True})
+            self.wfile.write(b"0\r\n\r\n")
+        except ConnectionError:
+            # Client gave up (timeout or lost hedge race).
+            self.close_connection = True
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0,
+                load_delay_s: float = LOAD_DELAY_S, token_delay_s: float = TOKEN_DELAY_S):
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(load_delay_s, token_delay_s)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_in_thread(**kwargs):
+    """Returns (server, "host:port") with the server running on a daemon thread."""
+    srv = make_server(**kwargs)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    host, port = srv.server_address[:2]
+    return srv, f"{host}:{port}"
+
+
+def run_cli(model: str, load_delay_s: float, token_delay_s: float):
+    prompt = sys.stdin.read()
+    time.sleep(load_delay_s)
+    for i, word in enumerate(fake_answer(prompt).split()):
+        time.sleep(token_delay_s)
+        sys.stdout.write((" " if i else "") + word)
+        sys.stdout.flush()
+    sys.stdout.write("\n")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=11434)
+    p.add_argument("--load-delay", type=float, default=LOAD_DELAY_S)
+    p.add_argument("--token-delay", type=float, default=TOKEN_DELAY_S)
+    p.add_argument("--cli", nargs="*", help="behave like `ollama run MODEL`")
+    args = p.parse_args()
+
+    if args.cli is not None:
+        model = args.cli[1] if len(args.cli) > 1 else "llama3"
+        return run_cli(model, args.load_delay, args.token_delay)
+
+    srv = make_server(args.host, args.port, args.load_delay, args.token_delay)
+    print(f"Stub LLM server on http://{args.host}:{args.port}")
+    srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,164 @@
+import os
+import queue
+import atexit
+import logging
 import sqlite3
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
 from datetime import datetime
 
+from programmes import REQUIRED_DOCS_BACHELOR, REQUIRED_DOCS_MASTER
+
+log = logging.getLogger(__name__)
+
 DB_PATH = "app.db"
 
+# DB_POOL=0 falls back to one plain connection per call, as before pooling.
+POOL_ENABLED = os.environ.get("DB_POOL", "1") != "0"
+CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "16384"))
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", "256"))
+
+# Optional copy of the live database for analytics, refreshed every
+# DB_SNAPSHOT_INTERVAL_S seconds (0 = off) with the online backup API.
+SNAPSHOT_PATH = os.environ.get("DB_SNAPSHOT_PATH", "")
+SNAPSHOT_INTERVAL_S = float(os.environ.get("DB_SNAPSHOT_INTERVAL_S", "0"))
+SNAPSHOT_PAGES_PER_STEP = int(os.environ.get("DB_SNAPSHOT_PAGES_PER_STEP", "1024"))
+
+_local = threading.local()
+MAX_IDLE = 4  # idle connections kept per thread and database
+
+class PooledConnection(sqlite3.Connection):
+    """
+    close() hands the connection back to its thread's idle list instead of
+    closing it, so callers keep the con() ... c.close() pattern. Like a real
+    close it discards uncommitted work. A connection that is never closed
+    (the caller raised) is simply not reused and gets closed when collected.
+    Inside transaction(), commit() and close() wait for the end of the block.
+    """
+
+    path = None
+    checked_out = False
+    txn_depth = 0
+
+    def close(self):
+        if self.path is None:
+            return super().close()
+        if self.txn_depth or not self.checked_out:
+            return
+        if self.in_transaction:
+            self.rollback()
+        self.checked_out = False
+        idle = _idle(self.path)
+        if len(idle) < MAX_IDLE:
+            idle.append(self)
+        else:
+            super().close()
+
+    def commit(self):
+        if not self.txn_depth:
+            super().commit()
+
+def _idle(path: str) -> list:
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = _local.pool = {}
+    return pool.setdefault(path, [])
+
+def _connect(path: str) -> PooledConnection:
+    c = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=STATEMENT_CACHE,
+                        factory=PooledConnection)
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    c.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    c.path = path
+    return c
+
+def _connect_ro(path: str) -> PooledConnection:
+    uri = "file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro"
+    c = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=STATEMENT_CACHE,
+                        factory=PooledConnection)
+    c.execute("PRAGMA query_only=ON")
+    c.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    c.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return c
+
 def con():
-    return sqlite3.connect(DB_PATH)
+    if not POOL_ENABLED:
+        return sqlite3.connect(DB_PATH)
+    txn = getattr(_local, "txn", None)
+    if txn is not None and txn.path == DB_PATH:
+        return txn
+    idle = _idle(DB_PATH)
+    c = idle.pop() if idle else _connect(DB_PATH)
+    c.checked_out = True
+    return c
+
+def con_ro(path: str = None):
+    """
+    A read-only connection (mode=ro, query_only) for admin listings and
+    exports. In WAL mode it reads a consistent snapshot without taking the
+    write lock, so long scans and student uploads do not block each other.
+    `path` may point at a snapshot file instead of the live database.
+    """
+    path = path or DB_PATH
+    if not POOL_ENABLED:
+        return _connect_ro(path)
+    idle = _idle("ro:" + path)
+    if idle:
+        c = idle.pop()
+    else:
+        c = _connect_ro(path)
+        c.path = "ro:" + path
+    c.checked_out = True
+    return c
+
+@contextmanager
+def transaction():
+    """
+    with transaction() as c: ...  commits on success, rolls back on error.
+    Takes the write lock up front (BEGIN IMMEDIATE). Nested blocks, and
+    helpers that call con()/commit() inside one, join the outer transaction.
+    """
+    c = con()
+    if not isinstance(c, PooledConnection):
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield c
+            c.commit()
+        except BaseException:
+            c.rollback()
+            raise
+        finally:
+            c.close()
+        return
+
+    if c.txn_depth:
+        c.txn_depth += 1
+        try:
+            yield c
+        finally:
+            c.txn_depth -= 1
+        return
+
+    c.execute("BEGIN IMMEDIATE")
+    c.txn_depth = 1
+    _local.txn = c
+    try:
+        yield c
+        c.txn_depth = 0
+        sqlite3.Connection.commit(c)
+    except BaseException:
+        c.txn_depth = 0
+        c.rollback()
+        raise
+    finally:
+        c.txn_depth = 0
+        _local.txn = None
+        c.close()
 
 def now():
     return datetime.utcnow().isoformat()
@@ -62,5 +216,509 @@ def init_db_all():
     )
     """)
 
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS chat_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts TEXT NOT NULL,
+        user_text TEXT NOT NULL,
+        assistant_text TEXT NOT NULL
+    )
+    """)
+
+    # One row per model call; see llm_metrics.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS llm_calls (
+        id INTEGER PRIMARY KEY,
+        ts INTEGER NOT NULL,
+        surface TEXT NOT NULL,
+        model TEXT NOT NULL,
+        status TEXT NOT NULL,
+        prompt_bytes INTEGER NOT NULL,
+        response_bytes INTEGER NOT NULL,
+        queue_wait_ms INTEGER,
+        ttft_ms INTEGER,
+        total_ms INTEGER NOT NULL
+    )
+    """)
+
     c.commit()
     c.close()
+
+    migrate()
+    sync_required_doc_types()
+
+# Completeness counters on applications, kept in sync by the triggers in
+# migration 3. Both count distinct required doc types for the row's level.
+_REQUIRED_TOTAL_SQL = """
+    (SELECT COUNT(*) FROM required_doc_types r WHERE r.level = applications.program_level)
+"""
+_REQUIRED_UPLOADED_SQL = """
+    (SELECT COUNT(DISTINCT d.doc_type)
+     FROM documents d
+     JOIN required_doc_types r ON r.level = applications.program_level AND r.doc_type = d.doc_type
+     WHERE d.application_id = applications.id)
+"""
+
+def _recount_trigger(name: str, event: str, table: str, where: str) -> str:
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}
+    BEGIN
+        UPDATE applications
+        SET required_uploaded_count = {_REQUIRED_UPLOADED_SQL},
+            required_total = {_REQUIRED_TOTAL_SQL}
+        WHERE {where};
+    END
+    """
+
+# Schema changes after the baseline tables above. Append only: each entry
+# runs once, in order, and PRAGMA user_version records the last one applied.
+# Full-text search (migration 5): one external-content FTS5 table per
+# source, rowid = the source row's id, kept in sync by triggers. See search.py.
+def _fts_steps(fts: str, table: str, cols: list, prefix: bool = True) -> list:
+    names = ", ".join(cols)
+    new = ", ".join(f"NEW.{c}" for c in cols)
+    old = ", ".join(f"OLD.{c}" for c in cols)
+    options = "tokenize='unicode61 remove_diacritics 2'" + (", prefix='2 3'" if prefix else "")
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, content='{table}', "
+        f"content_rowid='id', {options})",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {names}) VALUES (NEW.id, {new});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', OLD.id, {old});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', OLD.id, {old});
+            INSERT INTO {fts}(rowid, {names}) VALUES (NEW.id, {new});
+        END
+        """,
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+MIGRATIONS = [
+    (1, "indexes for per-application lookups and status lists", [
+        "CREATE INDEX IF NOT EXISTS idx_documents_app ON documents(application_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_decisions_app ON application_decisions(application_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_applications_status ON applications(status, id)",
+        "CREATE INDEX IF NOT EXISTS idx_applications_user ON applications(user_id, id)",
+    ]),
+    (2, "chat_logs records where a chat happened and who had it", [
+        "ALTER TABLE chat_logs ADD COLUMN surface TEXT NOT NULL DEFAULT 'cli'",
+        "ALTER TABLE chat_logs ADD COLUMN user_id INTEGER",
+    ]),
+    (3, "trigger-maintained document completeness counters", [
+        """
+        CREATE TABLE IF NOT EXISTS required_doc_types (
+            level TEXT NOT NULL,
+            doc_type TEXT NOT NULL,
+            PRIMARY KEY (level, doc_type)
+        ) WITHOUT ROWID
+        """,
+        "ALTER TABLE applications ADD COLUMN required_uploaded_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE applications ADD COLUMN required_total INTEGER NOT NULL DEFAULT 0",
+        _recount_trigger("trg_documents_insert_recount", "INSERT", "documents", "id = NEW.application_id"),
+        _recount_trigger("trg_documents_delete_recount", "DELETE", "documents", "id = OLD.application_id"),
+        _recount_trigger("trg_documents_update_recount", "UPDATE OF doc_type, application_id", "documents",
+                         "id IN (OLD.application_id, NEW.application_id)"),
+        _recount_trigger("trg_applications_insert_recount", "INSERT", "applications", "id = NEW.id"),
+        _recount_trigger("trg_applications_level_recount", "UPDATE OF program_level", "applications", "id = NEW.id"),
+        # Partial index: only the (few) complete, unsubmitted applications.
+        # Queries must repeat applications.COMPLETE_NOT_SUBMITTED_SQL to use it.
+        """
+        CREATE INDEX IF NOT EXISTS idx_applications_complete_open ON applications(id)
+        WHERE required_total > 0 AND required_uploaded_count >= required_total AND status != 'Submitted'
+        """,
+        lambda c: sync_required_doc_types(c, force_backfill=True),
+    ]),
+    (4, "admin listing filters by level and programme", [
+        "CREATE INDEX IF NOT EXISTS idx_applications_programme ON applications(program_level, program_name, id)",
+    ]),
+    (5, "full-text search for the reviewer console", [
+        *_fts_steps("users_fts", "users", ["full_name", "email"]),
+        *_fts_steps("applications_fts", "applications", ["program_name"]),
+        *_fts_steps("decisions_fts", "application_decisions", ["note"]),
+        *_fts_steps("documents_fts", "documents", ["original_filename"]),
+        *_fts_steps("chat_logs_fts", "chat_logs", ["user_text", "assistant_text"], prefix=False),
+    ]),
+    (6, "content-addressed document blobs with reference counts", [
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_ts TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "ALTER TABLE documents ADD COLUMN blob_sha256 TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_documents_blob ON documents(blob_sha256) WHERE blob_sha256 IS NOT NULL",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_documents_insert_blobref AFTER INSERT ON documents
+        WHEN NEW.blob_sha256 IS NOT NULL BEGIN
+            UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = NEW.blob_sha256;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_documents_delete_blobref AFTER DELETE ON documents
+        WHEN OLD.blob_sha256 IS NOT NULL BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.blob_sha256;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_documents_update_blobref AFTER UPDATE OF blob_sha256 ON documents
+        WHEN OLD.blob_sha256 IS NOT NEW.blob_sha256 BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.blob_sha256;
+            UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = NEW.blob_sha256;
+        END
+        """,
+    ]),
+    # Every new documents row gets a processing job (jobs.py); rows that
+    # existed before are queued too, so they get checked once after upgrade.
+    (7, "background document processing jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            document_id INTEGER,
+            state TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL DEFAULT 0,
+            lease_until REAL,
+            worker TEXT,
+            error TEXT,
+            created_ts TEXT NOT NULL,
+            finished_ts TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs(run_after, id) WHERE state = 'queued'",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs(lease_until) WHERE state = 'running'",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_document ON jobs(document_id)",
+        "ALTER TABLE documents ADD COLUMN processing_state TEXT NOT NULL DEFAULT 'queued'",
+        "ALTER TABLE documents ADD COLUMN processing_info TEXT",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_documents_insert_job AFTER INSERT ON documents BEGIN
+            INSERT INTO jobs (kind, document_id, created_ts)
+            VALUES ('process_document', NEW.id, strftime('%Y-%m-%dT%H:%M:%f', 'now'));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_documents_delete_job AFTER DELETE ON documents BEGIN
+            DELETE FROM jobs WHERE document_id = OLD.id AND state != 'running';
+        END
+        """,
+        """
+        INSERT INTO jobs (kind, document_id, created_ts)
+        SELECT 'process_document', id, strftime('%Y-%m-%dT%H:%M:%f', 'now') FROM documents
+        """,
+    ]),
+    # reconcile.py: one row per walk of the upload tree, its checkpoint in
+    # `cursor`, and what it found. saved_path lookups are per batch of files.
+    (8, "storage reconciler checkpoints and findings", [
+        """
+        CREATE TABLE IF NOT EXISTS storage_runs (
+            id INTEGER PRIMARY KEY,
+            root TEXT NOT NULL,
+            phase TEXT NOT NULL DEFAULT 'files',
+            cursor TEXT,
+            stats TEXT,
+            started_ts TEXT NOT NULL,
+            updated_ts TEXT,
+            finished_ts TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS storage_findings (
+            run_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            document_id INTEGER NOT NULL DEFAULT 0,
+            path TEXT NOT NULL,
+            size INTEGER,
+            action TEXT,
+            PRIMARY KEY (run_id, kind, document_id, path)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_documents_saved_path ON documents(saved_path)",
+    ]),
+]
+
+def schema_version(c=None) -> int:
+    if c is not None:
+        return c.execute("PRAGMA user_version").fetchone()[0]
+    c = con()
+    try:
+        return c.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        c.close()
+
+def _required_doc_rows():
+    return sorted(
+        [("Bachelor", d) for d in REQUIRED_DOCS_BACHELOR] + [("Master", d) for d in REQUIRED_DOCS_MASTER]
+    )
+
+def backfill_completeness(c=None) -> int:
+    """Recomputes the counters for every application. Returns rows updated."""
+    if c is not None:
+        return c.execute(f"""
+            UPDATE applications
+            SET required_uploaded_count = {_REQUIRED_UPLOADED_SQL},
+                required_total = {_REQUIRED_TOTAL_SQL}
+        """).rowcount
+    with transaction() as c:
+        return backfill_completeness(c)
+
+def sync_required_doc_types(c=None, force_backfill: bool = False) -> bool:
+    """
+    Mirrors the required documents from programmes.py into required_doc_types
+    and backfills the counters when the list changed. Returns True if it did.
+    """
+    wanted = _required_doc_rows()
+    if c is None:
+        # Compare first so the common case takes no write lock.
+        c = con()
+        try:
+            if schema_version(c) < 3:
+                return False
+            current = c.execute("SELECT level, doc_type FROM required_doc_types ORDER BY level, doc_type").fetchall()
+        finally:
+            c.close()
+        if current == wanted and not force_backfill:
+            return False
+        with transaction() as c:
+            return sync_required_doc_types(c, force_backfill=True)
+    current = c.execute("SELECT level, doc_type FROM required_doc_types ORDER BY level, doc_type").fetchall()
+    if current == wanted and not force_backfill:
+        return False
+    c.execute("DELETE FROM required_doc_types")
+    c.executemany("INSERT INTO required_doc_types (level, doc_type) VALUES (?, ?)", wanted)
+    backfill_completeness(c)
+    return True
+
+def migrate() -> int:
+    """Applies pending MIGRATIONS, each in its own transaction. Returns how many ran."""
+    applied = 0
+    current = schema_version()
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        with transaction() as c:
+            # Re-read inside the write lock so two processes can't both apply it.
+            if version <= schema_version(c):
+                continue
+            for step in steps:
+                if callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            c.execute(f"PRAGMA user_version = {int(version)}")
+        applied += 1
+    if applied:
+        c = con()
+        c.execute("ANALYZE")
+        c.commit()
+        c.close()
+    return applied
+
+
+class BatchWriter:
+    """
+    Append-only rows written off the request path: put() enqueues, one
+    background thread inserts them with executemany, one commit per batch.
+    A batch is written once batch_size rows are waiting or the oldest has
+    waited flush_interval_s, and whatever is left is flushed at exit.
+
+    When the queue is full, policy "drop" discards the row at once and
+    "block" waits up to block_timeout_s for room before dropping it.
+    """
+
+    _STOP = object()
+
+    def __init__(self, sql: str, name: str, max_queue: int = 10000, batch_size: int = 200,
+                 flush_interval_s: float = 1.0, policy: str = "drop", block_timeout_s: float = 1.0):
+        if policy not in {"drop", "block"}:
+            raise ValueError(f"unknown BatchWriter policy {policy!r}")
+        self.sql = sql
+        self.name = name
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self.policy = policy
+        self.block_timeout_s = block_timeout_s
+        self._q = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def put(self, row: tuple) -> bool:
+        """False if the row was dropped."""
+        if self._thread is None:
+            self._ensure_thread()
+        try:
+            if self.policy == "block":
+                self._q.put(row, timeout=self.block_timeout_s)
+            else:
+                self._q.put_nowait(row)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def flush(self, timeout: float = None) -> bool:
+        """Blocks until everything queued before this call is written."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._q.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._q.put(self._STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        buf = []
+        oldest = 0.0
+        while True:
+            timeout = None if not buf else max(0.0, oldest + self.flush_interval_s - time.monotonic())
+            try:
+                item = self._q.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                self._write(buf)
+                return
+            if isinstance(item, threading.Event):
+                self._write(buf)
+                buf = []
+                item.set()
+                continue
+            if item is not None:
+                if not buf:
+                    oldest = time.monotonic()
+                buf.append(item)
+            if buf and (len(buf) >= self.batch_size or time.monotonic() - oldest >= self.flush_interval_s):
+                self._write(buf)
+                buf = []
+
+    def _write(self, rows: list):
+        if not rows:
+            return
+        try:
+            c = con()
+            c.executemany(self.sql, rows)
+            c.commit()
+            c.close()
+        except Exception:
+            log.exception("%s: could not store %d row(s)", self.name, len(rows))
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.written += len(rows)
+            self.batches += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self._q.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "errors": self.errors,
+            }
+
+
+def default_snapshot_path() -> str:
+    if SNAPSHOT_PATH:
+        return SNAPSHOT_PATH
+    root, ext = os.path.splitext(DB_PATH)
+    return f"{root}.snapshot{ext or '.db'}"
+
+class _BackupRestarted(Exception):
+    pass
+
+def backup_snapshot(dest: str = None, pages: int = None, sleep_s: float = 0.005, max_restarts: int = 3) -> dict:
+    """
+    Copies the live database to `dest` with the online backup API, `pages`
+    pages per step so writers get the lock back in between. The copy is
+    written next to `dest` and renamed into place, so readers of the
+    snapshot never see a half-written file.
+
+    SQLite restarts a stepped backup whenever another connection writes to
+    the source. After max_restarts the copy is redone in a single step; in
+    WAL mode that holds only a read snapshot, so writers still proceed.
+    """
+    dest = dest or default_snapshot_path()
+    tmp = dest + ".tmp"
+    t0 = time.perf_counter()
+    state = {"remaining": None, "restarts": 0}
+
+    def progress(_status, remaining, _total):
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > max_restarts:
+                raise _BackupRestarted()
+        state["remaining"] = remaining
+
+    src = _connect_ro(DB_PATH)
+    try:
+        dst = sqlite3.connect(tmp)
+        try:
+            try:
+                src.backup(dst, pages=pages or SNAPSHOT_PAGES_PER_STEP, progress=progress, sleep=sleep_s)
+                single_step = False
+            except _BackupRestarted:
+                src.backup(dst, pages=-1)
+                single_step = True
+            # A plain rollback-journal file: nothing to keep in sync with a -wal.
+            dst.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    os.replace(tmp, dest)
+    return {
+        "path": dest,
+        "bytes": os.path.getsize(dest),
+        "seconds": time.perf_counter() - t0,
+        "restarts": state["restarts"],
+        "single_step": single_step,
+    }
+
+_snapshot_thread = None
+
+def start_snapshot_thread(interval_s: float = None, dest: str = None) -> bool:
+    """Refreshes the snapshot every interval_s seconds in a daemon thread. False if disabled."""
+    global _snapshot_thread
+    interval_s = SNAPSHOT_INTERVAL_S if interval_s is None else interval_s
+    if interval_s <= 0 or _snapshot_thread is not None:
+        return False
+
+    def loop():
+        while True:
+            try:
+                info = backup_snapshot(dest)
+                log.info("db snapshot %s: %d bytes in %.2fs", info["path"], info["bytes"], info["seconds"])
+            except Exception:
+                log.exception("db snapshot failed")
+            time.sleep(interval_s)
+
+    _snapshot_thread = threading.Thread(target=loop, name="db-snapshot", daemon=True)
+    _snapshot_thread.start()
+    return True
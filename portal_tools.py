@@ -1,21 +1,25 @@
 import os
+import queue
+import threading
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
 
+import ai
 import applications
-from programmes import REQUIRED_DOCS_BACHELOR, REQUIRED_DOCS_MASTER
-from models_db import con
+import blobstore
+from intents import detect_intent
+from llm_cache import make_key
+from programmes import (
+    BACHELOR_PROGRAMMES,
+    MASTER_PROGRAMMES,
+    REQUIRED_DOCS_BACHELOR,
+    REQUIRED_DOCS_MASTER,
+)
+import models_db
+from models_db import con, transaction
 
 
 # Internal helpers
-def _table_columns(table_name: str) -> List[str]:
-    conn = con()
-    cur = conn.cursor()
-    cur.execute(f"PRAGMA table_info({table_name})")
-    cols = [row[1] for row in cur.fetchall()]
-    conn.close()
-    return cols
-
-
 def _pick_col(existing_cols: List[str], candidates: List[str]) -> Optional[str]:
     existing = set(existing_cols)
     for c in candidates:
@@ -24,15 +28,62 @@ def _pick_col(existing_cols: List[str], candidates: List[str]) -> Optional[str]:
     return None
 
 
-def _documents_schema():
-    cols = _table_columns("documents")
-    id_col = _pick_col(cols, ["id", "doc_id", "document_id"])
-    app_col = _pick_col(cols, ["application_id", "app_id"])
-    path_col = _pick_col(cols, ["saved_path", "path", "file_path", "filepath"])
-    if not id_col or not app_col:
-        raise RuntimeError("Cannot detect documents schema columns.")
-    return id_col, app_col, path_col
+# (db path, PRAGMA schema_version) -> (id_col, app_col, path_col, blob_col).
+# SQLite bumps schema_version on every CREATE/ALTER/DROP, so a migration
+# invalidates the entry without a process restart.
+_schema_cache = {}
+
+
+def _documents_schema(conn=None):
+    own = conn is None
+    conn = conn or con()
+    version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    key = (models_db.DB_PATH, version)
+    cached = _schema_cache.get(key)
+    if cached is None:
+        cols = [row[1] for row in conn.execute("PRAGMA table_info(documents)")]
+        id_col = _pick_col(cols, ["id", "doc_id", "document_id"])
+        app_col = _pick_col(cols, ["application_id", "app_id"])
+        path_col = _pick_col(cols, ["saved_path", "path", "file_path", "filepath"])
+        blob_col = _pick_col(cols, ["blob_sha256"])
+        if not id_col or not app_col:
+            if own:
+                conn.close()
+            raise RuntimeError("Cannot detect documents schema columns.")
+        _schema_cache.clear()
+        cached = _schema_cache[key] = (id_col, app_col, path_col, blob_col)
+    if own:
+        conn.close()
+    return cached
+
+
+# Public AI prompt, shared by the portal and the FAQ precompute job
+def required_docs_for(level: str) -> List[str]:
+    return REQUIRED_DOCS_BACHELOR if level == "Bachelor" else REQUIRED_DOCS_MASTER
+
+
+def public_prompt(question: str, level: str, programme: str) -> str:
+    injected = ""
+    if level in {"Bachelor", "Master"} and programme:
+        injected = (
+            f"\nProgramme:\n"
+            f"- Level: {level}\n"
+            f"- Name: {programme}\n"
+            f"- Typical required documents: {', '.join(required_docs_for(level))}\n"
+        )
+
+    return (
+        "You are an admissions assistant. Answer clearly and practically.\n"
+        "If asked about document requirements, use the typical checklist provided.\n"
+        f"{injected}\nUser question: {question}\nAssistant:"
+    )
+
 
+def public_cache_key(question: str, level: str, programme: str) -> str:
+    model = ai.choose_model("public", detect_intent(question), public_prompt(question, level, programme))
+    if not (level in {"Bachelor", "Master"} and programme):
+        level, programme = "", ""
+    return make_key(question, level, programme, model, ai.PROMPT_VERSION)
 
 
 # Listing
@@ -46,15 +97,14 @@ def list_my_applications(user_id: int) -> List[Dict[str, Any]]:
 
 # Summary status
 def application_summary(app_id: int) -> Optional[Dict[str, Any]]:
-    row = applications.read_application(int(app_id))
-    if not row:
+    agg = applications.read_application_aggregate(int(app_id))
+    if not agg:
         return None
 
-    level, programme, status = row
+    level, programme, status = agg["level"], agg["programme"], agg["status"]
     required = REQUIRED_DOCS_BACHELOR if level == "Bachelor" else REQUIRED_DOCS_MASTER
 
-    docs = applications.list_documents(int(app_id))
-    uploaded_types = sorted({d[1] for d in docs}) if docs else []
+    uploaded_types = sorted({d[1] for d in agg["documents"]})
     missing_types = [x for x in required if x not in set(uploaded_types)]
 
     return {
@@ -68,52 +118,146 @@ def application_summary(app_id: int) -> Optional[Dict[str, Any]]:
     }
 
 
-# Delete docs
+# Requirements (answered without the LLM)
+@lru_cache(maxsize=None)
+def requirements_text(level: str) -> str:
+    required = REQUIRED_DOCS_BACHELOR if level == "Bachelor" else REQUIRED_DOCS_MASTER
+    programmes = BACHELOR_PROGRAMMES if level == "Bachelor" else MASTER_PROGRAMMES
+    return (
+        f"Required documents for {level} programmes:\n"
+        + "\n".join(f"- {x}" for x in required)
+        + f"\n\nThis applies to all {len(programmes)} {level} programmes."
+    )
 
-def delete_doc_by_id(doc_id: int) -> bool:
-    id_col, _app_col, path_col = _documents_schema()
 
-    conn = con()
-    cur = conn.cursor()
+def _checklist(required: List[str], uploaded) -> str:
+    return "\n".join(f"- {'✅' if x in uploaded else '⬜'} {x}" for x in required)
 
-    file_path = None
-    if path_col:
-        cur.execute(f"SELECT {path_col} FROM documents WHERE {id_col} = ?", (int(doc_id),))
-        row = cur.fetchone()
-        if not row:
-            conn.close()
-            return False
-        file_path = row[0]
 
-    cur.execute(f"DELETE FROM documents WHERE {id_col} = ?", (int(doc_id),))
-    deleted = cur.rowcount
-    conn.commit()
-    conn.close()
+def requirements_reply(info: Optional[Dict[str, Any]]) -> str:
+    """`info` is an application_summary() dict, or None for the generic answer."""
+    if not info:
+        return requirements_text("Bachelor") + "\n\n" + requirements_text("Master")
+
+    uploaded = set(info["uploaded_types"])
+    return (
+        requirements_text(info["level"])
+        + f"\n\nFor application #{info['app_id']} ({info['programme']}, {info['status']}):\n"
+        + _checklist(info["required_types"], uploaded)
+    )
+
+
+def requirements_reply_all_apps(user_id: int) -> str:
+    rows = applications.list_applications_with_doc_types(int(user_id))
+    if not rows:
+        return "You don’t have any applications yet."
+
+    apps = {}
+    for app_id, level, programme, status, doc_type in rows:
+        a = apps.setdefault(app_id, {"level": level, "programme": programme, "status": status, "uploaded": set()})
+        if doc_type:
+            a["uploaded"].add(doc_type)
+
+    parts = []
+    for app_id, a in apps.items():
+        required = REQUIRED_DOCS_BACHELOR if a["level"] == "Bachelor" else REQUIRED_DOCS_MASTER
+        missing = [x for x in required if x not in a["uploaded"]]
+        head = f"#{app_id} [{a['level']}] {a['programme']} — {a['status']}"
+        tail = "all required documents uploaded" if not missing else f"{len(missing)} missing"
+        parts.append(f"{head} ({tail})\n" + _checklist(required, a["uploaded"]))
+    return "\n\n".join(parts)
 
-    if deleted <= 0:
-        return False
 
-    if isinstance(file_path, str) and file_path.strip() and os.path.exists(file_path):
+# Delete docs
+
+def _remove_files(paths) -> int:
+    removed = 0
+    for p in paths:
+        if isinstance(p, str) and p.strip():
+            try:
+                os.remove(p)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+# (fn, items) pairs run by one background thread: fn(items)
+_unlink_q: "queue.Queue[tuple]" = queue.Queue()
+_unlink_thread = None
+_unlink_lock = threading.Lock()
+
+
+def _unlink_worker():
+    while True:
+        fn, items = _unlink_q.get()
         try:
-            os.remove(file_path)
+            fn(items)
         except Exception:
             pass
+        finally:
+            _unlink_q.task_done()
+
+
+def _later(fn, items) -> None:
+    global _unlink_thread
+    if not items:
+        return
+    with _unlink_lock:
+        if _unlink_thread is None:
+            _unlink_thread = threading.Thread(target=_unlink_worker, name="doc-unlink", daemon=True)
+            _unlink_thread.start()
+    _unlink_q.put((fn, list(items)))
+
+
+def unlink_later(paths: List[str]) -> None:
+    """Removes the files on a background thread; the request does not wait for the disk."""
+    _later(_remove_files, paths)
 
+
+def wait_for_unlinks() -> None:
+    _unlink_q.join()
+
+
+def _delete_documents(by_app: bool, value: int):
+    """
+    Deletes one document (by id) or all of an application's in one
+    transaction. Returns (rows deleted, files of pre-blob-store rows, blobs
+    that lost their last reference, for blobstore.purge()).
+    """
+    trashed = []
+    try:
+        with transaction() as conn:
+            id_col, app_col, path_col, blob_col = _documents_schema(conn)
+            where = f"{app_col if by_app else id_col} = ?"
+            rows = conn.execute(
+                f"SELECT {path_col or 'NULL'}, {blob_col or 'NULL'} FROM documents WHERE {where}", (int(value),)
+            ).fetchall()
+            deleted = conn.execute(f"DELETE FROM documents WHERE {where}", (int(value),)).rowcount
+            if blob_col:
+                trashed = blobstore.release(conn, [blob for _path, blob in rows])
+    except BaseException:
+        blobstore.restore(trashed)
+        raise
+    return deleted, [path for path, blob in rows if not blob], trashed
+
+
+def delete_doc_by_id(doc_id: int) -> bool:
+    deleted, files, trashed = _delete_documents(False, doc_id)
+    if deleted <= 0:
+        return False
+    _remove_files(files)
+    blobstore.purge(trashed)
     return True
 
 
 def delete_all_docs_for_application(app_id: int) -> int:
-    id_col, app_col, _path_col = _documents_schema()
-
-    conn = con()
-    cur = conn.cursor()
-    cur.execute(f"SELECT {id_col} FROM documents WHERE {app_col} = ?", (int(app_id),))
-    doc_ids = [r[0] for r in cur.fetchall()]
-    conn.close()
-
-    deleted = 0
-    for did in doc_ids:
-        if delete_doc_by_id(int(did)):
-            deleted += 1
+    """
+    Deletes every document row of the application in one transaction and
+    hands the files to the background unlinker once the rows are gone.
+    Shared blobs stay until their last document goes.
+    """
+    deleted, files, trashed = _delete_documents(True, app_id)
+    unlink_later(files)
+    _later(blobstore.purge, trashed)
     return deleted
-
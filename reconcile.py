@@ -0,0 +1,344 @@
+"""
+Reconciles the upload tree with the database. Files nothing refers to are
+"orphans"; documents rows whose file is gone are "dangling". run() records
+both in storage_findings (models_db migration 8); act() then quarantines or
+deletes the orphans. Nothing is removed by run() itself.
+
+run() is incremental. It walks UPLOAD_ROOT with os.scandir in sorted order,
+looks up each batch of files in one query, and commits the batch's findings
+with a checkpoint: the last path done (storage_runs.cursor). A run stopped
+by time_budget_s, a crash or Ctrl-C carries on from there, so a tree of
+millions of files can be done a slice at a time.
+
+What refers to a file:
+    blobs/<xx>/<sha256>       a blobs row (blobstore)
+    blobs/named/<sha256>/...  a blobs row
+    blobs/tmp/...             nothing: staging files and trash of crashed deletes
+    artifacts/<sha256>/...    a blobs row; artifacts/doc-<id>/... a documents row
+    anything else             documents.saved_path (pre-blob-store uploads)
+"""
+import os
+import json
+import time
+import errno
+import shutil
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+
+import blobstore
+from models_db import con_ro, now, transaction
+
+RECONCILE_BATCH = int(os.environ.get("RECONCILE_BATCH", "1000"))
+# Younger files are never orphans: an upload places its blob, and a job its
+# artifacts, before the row that refers to them commits.
+RECONCILE_GRACE_S = float(os.environ.get("RECONCILE_GRACE_S", "3600"))
+
+_HEX = set("0123456789abcdef")
+
+
+def quarantine_root(root: str = None) -> str:
+    return os.path.join(root or blobstore.UPLOAD_ROOT, "quarantine")
+
+
+class _References:
+    """
+    Classifies files below `root` by their path components (from _walk),
+    with the root's spellings and the store directories worked out once:
+    per file it is tuple slicing and string joins, no path normalisation.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        absroot = os.path.abspath(root)
+        self.prefixes = {p if p.endswith(os.sep) else p + os.sep
+                         for p in (root, os.path.normpath(root), absroot, os.path.relpath(absroot))}
+        self.blobs = self._parts_under(absroot, blobstore.BLOB_ROOT)
+        self.artifacts = self._parts_under(absroot, blobstore.ARTIFACT_ROOT)
+
+    @staticmethod
+    def _parts_under(absroot: str, directory: str) -> Optional[tuple]:
+        rel = os.path.relpath(os.path.abspath(directory), absroot)
+        if rel == os.curdir:
+            return ()
+        return None if rel.split(os.sep)[0] == os.pardir else tuple(rel.split(os.sep))
+
+    def parts(self, path: str) -> tuple:
+        return tuple(os.path.relpath(path, self.root).split(os.sep))
+
+    def key(self, parts: tuple) -> Tuple[str, object]:
+        """("blob", sha256), ("doc", id), ("path", None) or ("tmp", None): see the module docstring."""
+        b = self.blobs
+        if b is not None and parts[:len(b)] == b and len(parts) > len(b) + 1:
+            sub = parts[len(b)]
+            if sub == "tmp":
+                return "tmp", None
+            if sub == "named":
+                return "blob", parts[len(b) + 1]
+            name = parts[-1]
+            if len(name) == 64 and set(name) <= _HEX:
+                return "blob", name
+        a = self.artifacts
+        if a is not None and parts[:len(a)] == a and len(parts) > len(a) + 1:
+            art = parts[len(a)]
+            if art.startswith("doc-") and art[4:].isdigit():
+                return "doc", int(art[4:])
+            return "blob", art
+        return "path", None
+
+    def forms(self, parts: tuple) -> set:
+        """saved_path may have been stored relative to the working directory or absolute."""
+        tail = os.sep.join(parts)
+        return {prefix + tail for prefix in self.prefixes}
+
+    def unreferenced(self, c, items: List[Tuple[str, tuple]]) -> List[str]:
+        """
+        The paths among items ((path, parts) pairs) that nothing in the
+        database refers to; three queries at most.
+        """
+        keys = []
+        wanted = {"blob": set(), "doc": set(), "path": set()}
+        for path, parts in items:
+            kind, key = self.key(parts)
+            if kind == "path":
+                key = self.forms(parts)
+                wanted["path"] |= key
+            keys.append((path, parts, (kind, key)))
+            if kind not in ("path", "tmp"):
+                wanted[kind].add(key)
+        found = {
+            "path": _existing(c, "SELECT saved_path FROM documents WHERE saved_path IN "
+                                 "(SELECT value FROM json_each(?))", wanted["path"]),
+            "blob": _existing(c, "SELECT sha256 FROM blobs WHERE sha256 IN (SELECT value FROM json_each(?))",
+                              wanted["blob"]),
+            "doc": _existing(c, "SELECT id FROM documents WHERE id IN (SELECT value FROM json_each(?))",
+                             wanted["doc"]),
+        }
+        out = []
+        for path, parts, (kind, key) in keys:
+            if kind == "tmp":
+                out.append(path)
+            elif kind == "path":
+                if not key & found["path"]:
+                    out.append(path)
+            elif key not in found[kind]:
+                out.append(path)
+        return out
+
+
+def _existing(c, sql: str, values) -> set:
+    if not values:
+        return set()
+    return {r[0] for r in c.execute(sql, (json.dumps(sorted(values)),))}
+
+
+def _walk(directory: str, after: tuple, skip: set, parts: tuple = ()) -> Iterator[Tuple[str, tuple]]:
+    """
+    Files below `directory` in sorted depth-first order, as (path, path
+    components). Only those after `after` (the checkpoint) are yielded;
+    directories entirely before it are not listed at all.
+    """
+    try:
+        with os.scandir(directory) as it:
+            entries = sorted((e.name, e.is_dir(follow_symlinks=False), e.is_file(follow_symlinks=False))
+                             for e in it)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+    for name, is_dir, is_file in entries:
+        here = parts + (name,)
+        path = os.path.join(directory, name)
+        if is_dir:
+            if here < after[:len(here)] or os.path.abspath(path) in skip:
+                continue
+            yield from _walk(path, after if here == after[:len(here)] else (), skip, here)
+        elif is_file and here > after:
+            yield path, here
+
+
+def _open_run(root: str, resume: bool) -> Tuple[int, str, dict, dict]:
+    with transaction() as c:
+        row = c.execute(
+            "SELECT id, phase, cursor, stats FROM storage_runs WHERE root = ? AND finished_ts IS NULL "
+            "ORDER BY id DESC LIMIT 1",
+            (root,),
+        ).fetchone()
+        if row and resume:
+            return row[0], row[1], json.loads(row[2] or "{}"), json.loads(row[3] or "{}")
+        if row:
+            c.execute("UPDATE storage_runs SET phase = 'abandoned', finished_ts = ? WHERE id = ?", (now(), row[0]))
+        stats = {"files": 0, "orphans": 0, "orphan_bytes": 0, "recent": 0, "rows": 0, "dangling": 0, "seconds": 0.0}
+        run_id = c.execute(
+            "INSERT INTO storage_runs (root, phase, cursor, stats, started_ts) VALUES (?, 'files', '{}', ?, ?)",
+            (root, json.dumps(stats), now()),
+        ).lastrowid
+        return run_id, "files", {}, stats
+
+
+def _checkpoint(c, run_id: int, phase: str, cursor: dict, stats: dict, finished: bool = False) -> None:
+    c.execute(
+        "UPDATE storage_runs SET phase = ?, cursor = ?, stats = ?, updated_ts = ?, finished_ts = ? WHERE id = ?",
+        (phase, json.dumps(cursor), json.dumps(stats), now(), now() if finished else None, run_id),
+    )
+
+
+def run(root: str = None, batch: int = RECONCILE_BATCH, resume: bool = True, time_budget_s: float = None,
+        grace_s: float = RECONCILE_GRACE_S) -> dict:
+    """
+    Walks root (default UPLOAD_ROOT), then checks every documents row, for
+    at most time_budget_s seconds. Returns the run's stats plus "run_id" and
+    "phase" ("files", "rows": call again to continue; "done").
+    """
+    root = root or blobstore.UPLOAD_ROOT
+    run_id, phase, cursor, stats = _open_run(root, resume)
+    t0 = time.perf_counter()
+    deadline = t0 + time_budget_s if time_budget_s else None
+    batches = 0
+
+    def out_of_time() -> bool:
+        # At least one batch per call, so a tiny budget still makes progress.
+        return batches > 0 and deadline is not None and time.perf_counter() > deadline
+
+    refs = _References(root)
+    if phase == "files":
+        files = _walk(root, tuple(cursor.get("after") or ()), {os.path.abspath(quarantine_root(root))})
+        while phase == "files" and not out_of_time():
+            chunk = list(islice(files, batch))
+            orphans = []
+            if chunk:
+                c = con_ro()
+                lost = refs.unreferenced(c, chunk)
+                c.close()
+                cutoff = time.time() - grace_s
+                for path in lost:
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if st.st_mtime > cutoff:
+                        stats["recent"] += 1
+                    else:
+                        orphans.append((path, st.st_size))
+                stats["files"] += len(chunk)
+                stats["orphans"] += len(orphans)
+                stats["orphan_bytes"] += sum(size for _p, size in orphans)
+                cursor["after"] = list(chunk[-1][1])
+            else:
+                phase, cursor = "rows", {"after_id": 0}
+            stats["seconds"] = round(stats.get("seconds", 0) + time.perf_counter() - t0, 3)
+            t0 = time.perf_counter()
+            with transaction() as c:
+                c.executemany(
+                    "INSERT OR IGNORE INTO storage_findings (run_id, kind, path, size) VALUES (?, 'orphan', ?, ?)",
+                    [(run_id, path, size) for path, size in orphans],
+                )
+                _checkpoint(c, run_id, phase, cursor, stats)
+            batches += 1
+
+    while phase == "rows" and not out_of_time():
+        c = con_ro()
+        rows = c.execute("SELECT id, saved_path FROM documents WHERE id > ? ORDER BY id LIMIT ?",
+                         (int(cursor.get("after_id") or 0), int(batch))).fetchall()
+        c.close()
+        dangling = [(doc_id, path) for doc_id, path in rows if not path or not os.path.isfile(path)]
+        stats["rows"] += len(rows)
+        stats["dangling"] += len(dangling)
+        stats["seconds"] = round(stats.get("seconds", 0) + time.perf_counter() - t0, 3)
+        t0 = time.perf_counter()
+        if rows:
+            cursor["after_id"] = rows[-1][0]
+        else:
+            phase = "done"
+        with transaction() as c:
+            c.executemany(
+                "INSERT OR IGNORE INTO storage_findings (run_id, kind, document_id, path) VALUES (?, 'dangling', ?, ?)",
+                [(run_id, doc_id, path or "") for doc_id, path in dangling],
+            )
+            _checkpoint(c, run_id, phase, cursor, stats, finished=(phase == "done"))
+        batches += 1
+
+    return dict(stats, run_id=run_id, phase=phase)
+
+
+def findings(run_id: int, kind: str, limit: int = 20) -> List[tuple]:
+    """Largest first. Returns (path, size, document_id, action); document_id is None for orphans."""
+    c = con_ro()
+    rows = c.execute(
+        "SELECT path, size, NULLIF(document_id, 0), action FROM storage_findings WHERE run_id = ? AND kind = ? "
+        "ORDER BY size DESC, path, document_id LIMIT ?",
+        (int(run_id), kind, int(limit)),
+    ).fetchall()
+    c.close()
+    return rows
+
+
+def _prune_empty_dirs(directory: str, root: str) -> None:
+    root = os.path.abspath(root)
+    d = os.path.abspath(directory)
+    while d.startswith(root + os.sep):
+        try:
+            os.rmdir(d)
+        except OSError:
+            return
+        d = os.path.dirname(d)
+
+
+def act(run_id: int, action: str, batch: int = RECONCILE_BATCH, grace_s: float = RECONCILE_GRACE_S) -> dict:
+    """
+    Quarantines (moves under <root>/quarantine/<run id>/) or deletes the
+    orphans a finished run found. Each batch is checked again under the
+    write lock, which uploads take before reusing a blob file, so a file
+    that gained a reference since the scan stays ("kept").
+    """
+    if action not in ("quarantine", "delete"):
+        raise ValueError(f"unknown action {action!r}")
+    c = con_ro()
+    row = c.execute("SELECT root, phase FROM storage_runs WHERE id = ?", (int(run_id),)).fetchone()
+    c.close()
+    if not row:
+        raise ValueError(f"no reconcile run #{run_id}")
+    root, phase = row
+    if phase != "done":
+        raise ValueError(f"run #{run_id} has not finished its scan; run it again first")
+    done = "quarantined" if action == "quarantine" else "deleted"
+    counts = {done: 0, "bytes": 0, "kept": 0, "gone": 0}
+    target = os.path.join(quarantine_root(root), str(run_id))
+    refs = _References(root)
+    while True:
+        with transaction() as c:
+            rows = c.execute(
+                "SELECT path, size FROM storage_findings WHERE run_id = ? AND kind = 'orphan' AND action IS NULL "
+                "LIMIT ?",
+                (int(run_id), int(batch)),
+            ).fetchall()
+            if not rows:
+                break
+            still = set(refs.unreferenced(c, [(p, refs.parts(p)) for p, _size in rows]))
+            cutoff = time.time() - grace_s
+            results = []
+            for path, size in rows:
+                try:
+                    if path not in still or os.stat(path).st_mtime > cutoff:
+                        result = "kept"
+                    elif action == "delete":
+                        os.remove(path)
+                        result = done
+                    else:
+                        dest = os.path.join(target, os.path.relpath(path, root))
+                        os.makedirs(os.path.dirname(dest), exist_ok=True)
+                        try:
+                            os.replace(path, dest)
+                        except OSError as e:
+                            if e.errno != errno.EXDEV:
+                                raise
+                            shutil.move(path, dest)
+                        result = done
+                except FileNotFoundError:
+                    result = "gone"
+                counts[result] += 1
+                if result == done:
+                    counts["bytes"] += size or 0
+                    _prune_empty_dirs(os.path.dirname(path), root)
+                results.append((result, int(run_id), path))
+            c.executemany(
+                "UPDATE storage_findings SET action = ? WHERE run_id = ? AND kind = 'orphan' AND path = ?", results
+            )
+    return counts
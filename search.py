@@ -0,0 +1,112 @@
+import re
+import json
+from typing import List, Optional
+
+from models_db import con_ro
+
+SEARCH_PAGE_SIZE = 20
+MAX_TERMS = 8
+
+# kind -> (FTS5 table from models_db migration 5, snippet column, details).
+# The details query gets the page's rowids as a JSON array and returns
+# (rowid, application_id, user_id, snippet prefix).
+_SOURCES = {
+    "applicant": ("users_fts", -1, """
+        SELECT u.id, a.id, u.id, ''
+        FROM users u LEFT JOIN applications a ON a.user_id = u.id
+        WHERE u.id IN (SELECT value FROM json_each(?))
+        ORDER BY a.id DESC
+    """),
+    "programme": ("applications_fts", 0, """
+        SELECT a.id, a.id, a.user_id, a.program_level || ': '
+        FROM applications a
+        WHERE a.id IN (SELECT value FROM json_each(?))
+    """),
+    "decision note": ("decisions_fts", 0, """
+        SELECT d.id, d.application_id, a.user_id, d.new_status || ': '
+        FROM application_decisions d LEFT JOIN applications a ON a.id = d.application_id
+        WHERE d.id IN (SELECT value FROM json_each(?))
+    """),
+    "document": ("documents_fts", 0, """
+        SELECT d.id, d.application_id, a.user_id, d.doc_type || ': '
+        FROM documents d LEFT JOIN applications a ON a.id = d.application_id
+        WHERE d.id IN (SELECT value FROM json_each(?))
+    """),
+    "chat": ("chat_logs_fts", -1, """
+        SELECT c.id, NULL, c.user_id, c.surface || ': '
+        FROM chat_logs c
+        WHERE c.id IN (SELECT value FROM json_each(?))
+    """),
+}
+SEARCH_KINDS = tuple(_SOURCES)
+
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    Turns what a reviewer typed into an FTS5 query: every word must match,
+    the last one as a prefix, so "anna smi" finds Anna Smith while they are
+    still typing. Operators and quotes in the input are treated as plain
+    text. None if there is nothing to search for.
+    """
+    terms = re.findall(r"\w+", text or "")[:MAX_TERMS]
+    if not terms:
+        return None
+    return " ".join([f'"{t}"' for t in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+
+def search(text: str, offset: int = 0, limit: int = SEARCH_PAGE_SIZE, kinds=None) -> dict:
+    """
+    Ranked hits (bm25) across applicants, programmes, decision notes,
+    document filenames and chat logs. An applicant hit is listed once per
+    application they have.
+    Returns {"rows": [(kind, application_id, user_id, snippet)], "has_more": bool}
+    """
+    match = fts_query(text)
+    kinds = [k for k in (kinds or SEARCH_KINDS) if k in _SOURCES]
+    if not match or not kinds:
+        return {"rows": [], "has_more": False}
+    offset, limit = max(0, int(offset)), int(limit)
+
+    # 1. Rank: rowid and score only, over every match. The page can only
+    # hold rows among the best offset + limit + 1 of each source, so each
+    # source keeps just those and the union is ranked again.
+    arms = " UNION ALL ".join(
+        f"SELECT * FROM (SELECT '{k}', rowid, bm25({_SOURCES[k][0]}) FROM {_SOURCES[k][0]} "
+        f"WHERE {_SOURCES[k][0]} MATCH ? ORDER BY 3, 2 LIMIT ?)"
+        for k in kinds
+    )
+    args: List = []
+    for _ in kinds:
+        args += [match, offset + limit + 1]
+
+    c = con_ro()
+    try:
+        ranked = c.execute(f"SELECT * FROM ({arms}) ORDER BY 3, 1, 2 LIMIT ? OFFSET ?",
+                           args + [limit + 1, offset]).fetchall()
+        has_more = len(ranked) > limit
+        ranked = ranked[:limit]
+
+        # 2. Snippets and ids for this page only.
+        by_kind = {}
+        for kind, rowid, _score in ranked:
+            by_kind.setdefault(kind, []).append(rowid)
+        details, snippets = {}, {}
+        for kind, rowids in by_kind.items():
+            fts, col, details_sql = _SOURCES[kind]
+            ids = json.dumps(rowids)
+            for rowid, app_id, user_id, prefix in c.execute(details_sql, (ids,)):
+                details.setdefault((kind, rowid), []).append((app_id, user_id, prefix))
+            for rowid, snip in c.execute(
+                f"SELECT rowid, snippet({fts}, {col}, '[', ']', '…', 12) FROM {fts} "
+                f"WHERE {fts} MATCH ? AND rowid IN (SELECT value FROM json_each(?))",
+                (match, ids),
+            ):
+                snippets[(kind, rowid)] = snip
+    finally:
+        c.close()
+
+    rows = []
+    for kind, rowid, _score in ranked:
+        for app_id, user_id, prefix in details.get((kind, rowid), []):
+            rows.append((kind, app_id, user_id, prefix + snippets.get((kind, rowid), "")))
+    return {"rows": rows, "has_more": has_more}
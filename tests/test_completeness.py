@@ -0,0 +1,35 @@
+"""Completeness counters (models_db migration 3) and what counts as complete."""
+import pytest
+
+import applications
+import auth
+import models_db
+import programmes
+
+
+@pytest.fixture()
+def db(tmp_path):
+    saved = models_db.DB_PATH
+    models_db.DB_PATH = str(tmp_path / "complete.db")
+    models_db.init_db_all()
+    yield auth.register_user("Ada", "ada@example.com", "pw")
+    models_db.DB_PATH = saved
+
+
+def test_all_required_documents_make_it_complete(db):
+    app_id = applications.create_application(db, "Bachelor", "Robotics")
+    for doc_type in programmes.REQUIRED_DOCS_BACHELOR:
+        applications.add_document(app_id, doc_type, "f.pdf", "/tmp/f.pdf")
+    uploaded, total = applications.read_required_counts(app_id)
+    assert total == len(programmes.REQUIRED_DOCS_BACHELOR)
+    assert applications.is_complete(uploaded, total)
+    assert [r[0] for r in applications.list_complete_not_submitted()] == [app_id]
+
+
+def test_no_required_documents_is_not_complete(db):
+    app_id = applications.create_application(db, "Exchange", "Robotics")  # no required types for the level
+    assert applications.read_required_counts(app_id) == (0, 0)
+    assert not applications.is_complete(0, 0)
+    assert applications.list_complete_not_submitted() == []
+    page = applications.list_applications_page(complete_not_submitted=True)
+    assert page["rows"] == []
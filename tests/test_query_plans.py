@@ -0,0 +1,103 @@
+"""
+The hot queries must be answered from an index (models_db MIGRATIONS):
+no full table SCAN and no temp B-tree for the ORDER BY. Each query is
+captured from the function that runs it, on con() and con_ro() alike.
+"""
+import pytest
+
+import applications
+import auth
+import models_db
+import programmes
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("plans") / "plans.db")
+    saved = models_db.DB_PATH
+    models_db.DB_PATH = path
+    models_db.init_db_all()
+    uids, app_ids = [], []
+    for u in range(20):
+        uid = auth.register_user(f"User {u}", f"user{u}@example.com", "pw")
+        uids.append(uid)
+        for i in range(6):
+            app_ids.append(applications.create_application(uid, "Bachelor", f"Programme {i}"))
+    for app_id in app_ids[:50]:
+        applications.add_document(app_id, "Transcript", "t.pdf", "/tmp/t.pdf")
+        applications.add_decision_note(app_id, uids[0], "Under Review", "note")
+    for app_id in app_ids[:5]:  # a few complete applications
+        for doc_type in programmes.REQUIRED_DOCS_BACHELOR:
+            applications.add_document(app_id, doc_type, "f.pdf", "/tmp/f.pdf")
+    c = models_db.con()
+    c.execute("ANALYZE")
+    c.commit()
+    c.close()
+    yield uids, app_ids
+    models_db.DB_PATH = saved
+
+
+def _selects(fn):
+    """The SELECTs fn runs on this thread's pooled connections."""
+    conns = [models_db.con(), models_db.con_ro()]
+    stmts = []
+    for c in conns:
+        c.close()  # back on the idle list, where fn picks it up
+        c.set_trace_callback(stmts.append)
+    try:
+        fn()
+    finally:
+        for c in conns:
+            c.set_trace_callback(None)
+    return [s for s in stmts if s.lstrip().upper().startswith("SELECT")]
+
+
+def _plan(sql: str) -> list:
+    c = models_db.con_ro()
+    try:
+        return [row[3] for row in c.execute("EXPLAIN QUERY PLAN " + sql)]
+    finally:
+        c.close()
+
+
+# name, call (given user ids and application ids), index each SELECT must use
+CASES = [
+    ("list_applications", lambda u, a: applications.list_applications(u[0]), ["idx_applications_user"]),
+    ("read_application", lambda u, a: applications.read_application(a[0]), ["INTEGER PRIMARY KEY"]),
+    ("read_required_counts", lambda u, a: applications.read_required_counts(a[0]), ["INTEGER PRIMARY KEY"]),
+    ("list_documents", lambda u, a: applications.list_documents(a[0]), ["idx_documents_app"]),
+    ("get_latest_decision_note", lambda u, a: applications.get_latest_decision_note(a[0]), ["idx_decisions_app"]),
+    ("get_latest_decision_row", lambda u, a: applications.get_latest_decision_row(a[0]), ["idx_decisions_app"]),
+    ("read_application_aggregate", lambda u, a: applications.read_application_aggregate(a[0]),
+     ["idx_decisions_app", "idx_documents_app"]),
+    ("list_complete_not_submitted", lambda u, a: applications.list_complete_not_submitted(),
+     ["idx_applications_complete_open"]),
+    ("page before", lambda u, a: applications.list_applications_page(before_id=a[-1]),
+     ["INTEGER PRIMARY KEY", "INTEGER PRIMARY KEY"]),
+    ("page after", lambda u, a: applications.list_applications_page(after_id=a[0]),
+     ["INTEGER PRIMARY KEY", "INTEGER PRIMARY KEY"]),
+    ("page by status", lambda u, a: applications.list_applications_page(status="Submitted"),
+     ["idx_applications_status"]),
+    ("page complete, not submitted", lambda u, a: applications.list_applications_page(complete_not_submitted=True),
+     ["idx_applications_complete_open"]),
+    ("page by programme", lambda u, a: applications.list_applications_page(level="Bachelor", programme="Programme 1"),
+     ["idx_applications_programme"]),
+]
+
+
+@pytest.mark.parametrize("name,call,indexes", CASES, ids=[case[0] for case in CASES])
+def test_query_uses_index(db, name, call, indexes):
+    uids, app_ids = db
+    selects = _selects(lambda: call(uids, app_ids))
+    assert len(selects) == len(indexes), selects
+    for sql, index in zip(selects, indexes):
+        steps = _plan(sql)
+        plan = " | ".join(steps)
+        # A SCAN is only acceptable over an index (e.g. a small partial one).
+        assert not any(s.startswith("SCAN") and "INDEX" not in s and "CONSTANT ROW" not in s for s in steps), plan
+        assert "TEMP B-TREE" not in plan, plan
+        assert index in plan, plan
+
+
+def test_schema_is_current(db):
+    assert models_db.schema_version() == models_db.MIGRATIONS[-1][0]
@@ -0,0 +1,38 @@
+"""Every match is reachable by paging (search.py)."""
+import pytest
+
+import models_db
+import search
+
+
+@pytest.fixture(scope="module")
+def smiths(tmp_path_factory):
+    saved = models_db.DB_PATH
+    models_db.DB_PATH = str(tmp_path_factory.mktemp("search") / "search.db")
+    models_db.init_db_all()
+    with models_db.transaction() as c:
+        c.executemany(
+            "INSERT INTO users (created_ts, full_name, email, password_hash, password_salt) VALUES (?, ?, ?, '', '')",
+            [(models_db.now(), "Anna Smith", f"smith{i}@example.com") for i in range(3000)],
+        )
+    yield 3000
+    models_db.DB_PATH = saved
+
+
+def test_paging_reaches_every_match(smiths):
+    seen, offset = set(), 0
+    while True:
+        page = search.search("smith", offset=offset, limit=500, kinds=["applicant"])
+        seen.update(user_id for _kind, _app_id, user_id, _snippet in page["rows"])
+        if not page["has_more"]:
+            break
+        offset += 500
+    assert len(seen) == smiths
+    assert min(seen) == 1
+
+
+def test_pages_do_not_overlap(smiths):
+    first = search.search("smith", offset=0, limit=20, kinds=["applicant"])
+    second = search.search("smith", offset=20, limit=20, kinds=["applicant"])
+    assert first["has_more"] and second["has_more"]
+    assert not {r[2] for r in first["rows"]} & {r[2] for r in second["rows"]}